@@ -1,6 +1,14 @@
 import streamlit as st
 import pandas as pd
 import datetime as dt
+import math
+from app.services.lead_list import leads_source, read_leads, score_leads, query_leads
+from app.services.assignment_service import assign_leads
+from app.services.knowledge_index import load_or_build
+from app.services.keyword_detector import SuggestionEngine
+from app.services.temperature_engine import TemperatureEngine
+from app.services.capture_store import CaptureStore
+from ml.preprocess import REQUIRED_KEYS
 
 # -------------------------------------------------
 # 🎯 MOCK DATA GENERATORS
@@ -10,23 +18,33 @@ def get_mock_master():
     leads = pd.DataFrame({
         "customer_name": ["田中 圭", "鈴木 一恵", "高橋 誠", "伊藤 沙織"],
         "customer_attr": ["32歳 / フリーランス", "45歳 / 主婦", "28歳 / IT系会社員", "55歳 / 飲食自営業"],
-        "score": [68, 75, 85, 62],
+        # スコアは保存せず、以下の特徴量から ATLAS モデルで算出する
+        "Age": [32, 45, 28, 55],
+        "Residence_Type": ["Rental", "Own_House", "Rental", "Own_House"],
+        "Years_at_Work": [3, 0, 5, 20],
+        "Annual_Income_JPY_10k": [450, 300, 600, 700],
+        "Other_Debt_JPY_10k": [80, 0, 0, 150],
+        "Guarantor": ["No", "Yes", "No", "No"],
+        "Medical_History": ["なし", "なし", "なし", "高血圧"],
+        "Payment_Rate": [0.95, 1.0, 1.0, 0.9],
     })
     reps = pd.DataFrame({
         "rep_name": ["佐藤さん", "加藤さん", "伊藤さん"],
-        "specialty": ["若年層・単身者", "主婦・ファミリー", "高価格帯・経営者"]
+        "specialty": ["若年層・単身者", "主婦・ファミリー", "高価格帯・経営者"],
+        "base_rate": [0.4, 0.5, 0.45],
     })
     conv = [
-        {"speaker": "customer", "line": "安全な車が欲しいんです…", "ai": "ニーズヒアリングを深掘りしてください"},
-        {"speaker": "agent", "line": "ご安心ください…", "ai": "お客様の反応を観察"},
-        {"speaker": "customer", "line": "初期費用は抑えたい…", "ai": "初期費用ゼロプラン提案"},
+        {"speaker": "customer", "line": "安全な車が欲しいんです…"},
+        {"speaker": "agent", "line": "ご安心ください…"},
+        {"speaker": "customer", "line": "初期費用は抑えたい…"},
     ]
     tags = ["#価格に敏感", "#納期重視", "#安全性重視", "#クルマ好き"]
+    # 継続フォロー用の接触イベント（何日前に発生したか）
     follow = pd.DataFrame({
-        "customer_name": ["渡辺 徹", "山本 裕子"],
-        "last_contact": ["15日前", "28日前"],
-        "thermo": [70, 30],
-        "insight": ["料金ページ閲覧3回、再アプローチ好機", "アクセス途絶、冷却推奨"]
+        "customer_id": ["F001"] * 5 + ["F002"] * 2,
+        "customer_name": ["渡辺 徹"] * 5 + ["山本 裕子"] * 2,
+        "event_type": ["call", "pricing_page_view", "pricing_page_view", "pricing_page_view", "email_open", "call", "page_view"],
+        "days_ago": [15, 5, 3, 1, 1, 28, 26],
     })
     kb = {
         "類似顧客の成功例は？": "過去15名中8名が成約、頭金10%が有効でした",
@@ -34,35 +52,164 @@ def get_mock_master():
     }
     return leads, reps, conv, tags, follow, kb
 
+@st.cache_resource
+def get_prediction_service():
+    """ モデルは全セッションで1度だけ読み込む """
+    from app.services.prediction_service import prediction_service
+    return prediction_service
+
+@st.cache_data(show_spinner="スコアを算出しています…")
+def load_scored_leads(source, model_version):
+    """ 商談リストを一括スコアリングする（リードの集合 source とモデルのバージョンが同じ間はキャッシュを使う） """
+    leads = read_leads(source[0]) if source else get_mock_master()[0]
+    return score_leads(leads, get_prediction_service())
+
+@st.cache_data(show_spinner="担当者を割り当てています…")
+def load_assignment(source, model_version, reps, capacity):
+    """ 受け入れ上限の範囲で総期待成約数が最大になるよう、商談リスト全件を担当者に割り当てる """
+    leads = load_scored_leads(source, model_version)
+    return assign_leads(leads["score"], leads["customer_attr"], reps, capacity)
+
+@st.cache_resource
+def get_knowledge_index():
+    """ AI重政チャットの検索インデックス（ATLAS_KB_INDEX_PATH に保存済みのものがあれば読み込む） """
+    return load_or_build(get_mock_master()[5])
+
+def ask_knowledge_base():
+    """ 質問欄の入力に近い Q&A を検索してチャットに追加し、入力欄を空にする """
+    q = st.session_state.kb_question
+    if not q:
+        return
+    st.session_state.chat.append(f"🧑‍💼 あなた: {q}")
+    hit = get_knowledge_index().answer(q)
+    if hit is None:
+        ans = "すみません、まだ回答データがありません"
+    elif hit["question"] == q:
+        ans = hit["answer"]
+    else:
+        ans = f"{hit['answer']}（近い質問:「{hit['question']}」 類似度 {hit['score']:.0%}）"
+    st.session_state.chat.append(f"🤖 AI重政: {ans}")
+    st.session_state.kb_question = ""
+
+@st.cache_resource
+def get_suggestion_engine():
+    """ リアルタイム・サジェストのキーワード辞書は全セッションで1度だけ構築する """
+    return SuggestionEngine()
+
+@st.cache_resource
+def get_temperature_engine():
+    """ 顧客温度の DB（ATLAS_TEMPERATURE_DB_PATH が未設定の場合は、サンプルの接触イベントを取り込んだメモリ上の DB） """
+    engine = TemperatureEngine()
+    if len(engine) == 0:
+        events = get_mock_master()[4]
+        now = dt.datetime.now(dt.timezone.utc)
+        engine.ingest(events.assign(occurred_at=[now - dt.timedelta(days=int(d)) for d in events["days_ago"]]))
+    return engine
+
+@st.cache_resource
+def get_capture_store():
+    """ 商談結果の記録ストア（ATLAS_CAPTURE_DB_PATH。書き込みはバックグラウンドでまとめて行う） """
+    return CaptureStore()
+
+def record_outcome(outcome):
+    """ 商談結果を確定し、最初の1回だけタグ・チャット履歴とともに記録ストアへ追記する（画面は書き込みを待たない） """
+    if st.session_state.outcome is None:
+        lead = leads_df.loc[st.session_state.lead_idx].to_dict()
+        get_capture_store().record(
+            outcome, {key: lead[key] for key in REQUIRED_KEYS}, customer_id=st.session_state.lead_idx,
+            customer_name=lead["customer_name"], rep_name=st.session_state.get("rep_name"),
+            score=None if pd.isna(lead["score"]) else lead["score"], model_version=service.model_version,
+            tags=st.session_state.tags, chat=st.session_state.chat,
+        )
+    st.session_state.outcome = outcome
+
+# 文字起こしが届く単位（音声認識の結果が数文字ずつ届く想定）
+TRANSCRIPT_CHUNK_SIZE = 8
+
+def feed_conversation(step):
+    """ 表示済みの会話のうち未処理のお客様の発話を、チャンクに分けてキーワード検出に流す """
+    session = st.session_state.suggestion_session
+    while st.session_state.fed_step < step:
+        turn = conv_flow[st.session_state.fed_step]
+        st.session_state.fed_step += 1
+        if turn["speaker"] != "customer":
+            st.session_state.keywords, st.session_state.suggestions = [], []
+            continue
+        line, detected, fired = turn["line"], [], []
+        for start in range(0, len(line), TRANSCRIPT_CHUNK_SIZE):
+            end_of_utterance = start + TRANSCRIPT_CHUNK_SIZE >= len(line)
+            result = session.feed(line[start:start + TRANSCRIPT_CHUNK_SIZE], end_of_utterance)
+            detected += [match["keyword"] for match in result["keywords"]]
+            fired += result["suggestions"]
+        st.session_state.keywords, st.session_state.suggestions = list(dict.fromkeys(detected)), fired
+
+def reset_suggestions():
+    st.session_state.suggestion_session = get_suggestion_engine().session()
+    st.session_state.fed_step = 0
+    st.session_state.keywords, st.session_state.suggestions = [], []
+
+# 並び順の選択肢: 表示名 -> (カラム, 昇順か)
+SORT_OPTIONS = {"スコアが高い順": ("score", False), "スコアが低い順": ("score", True), "名前順": ("customer_name", True)}
+
 st.set_page_config(page_title="AI重政 DEMO", layout="wide")
 
-leads_df, reps_df, conv_flow, tag_list, follow_df, kb = get_mock_master()
+_, reps_df, conv_flow, tag_list, _, _ = get_mock_master()
+service = get_prediction_service()
+service.registry.check_for_update()
+leads_df = load_scored_leads(leads_source(), service.model_version)
 
 if "lead_idx" not in st.session_state: st.session_state.lead_idx = None
 if "step" not in st.session_state: st.session_state.step = 0
 if "tags" not in st.session_state: st.session_state.tags = []
 if "chat" not in st.session_state: st.session_state.chat = []
 if "outcome" not in st.session_state: st.session_state.outcome = None
+if "suggestion_session" not in st.session_state: reset_suggestions()
 
 T1, T2, T3, T4 = st.tabs(["① 新規リスト", "② コックピット", "③ サマリー", "④ フォロー"])
 
 with T1:
     st.header("📋 新規商談リスト（スコア × 担当者マッチング）")
-    for idx, row in leads_df.iterrows():
-        color = "green" if row.score >= 80 else "yellow" if row.score >= 70 else "red"
-        rep = reps_df.iloc[0] if "フリーランス" in row.customer_attr else reps_df.iloc[1] if "主婦" in row.customer_attr else reps_df.iloc[2]
+    f1, f2, f3, f4, f5 = st.columns([2, 1, 1, 1, 1])
+    search = f1.text_input("🔍 名前・属性で検索", key="lead_search")
+    min_score = f2.slider("最低スコア", 0, 100, 0, key="lead_min_score")
+    sort_by, ascending = SORT_OPTIONS[f3.selectbox("並び順", list(SORT_OPTIONS), key="lead_sort")]
+    page_size = f4.selectbox("表示件数", [10, 20, 50], index=1, key="lead_page_size")
+    capacity = f5.number_input("担当者あたりの上限件数", min_value=1, value=max(1, math.ceil(len(leads_df) / len(reps_df))), key="rep_capacity")
+    assignment = load_assignment(leads_source(), service.model_version, reps_df, capacity)
+    st.caption(f"🤖 期待成約数 合計 {assignment['total_expected_conversions']:.1f} 件 / "
+               + " / ".join(f"{name} {load} 件" for name, load in zip(reps_df.rep_name, assignment['rep_loads'])))
+
+    # 絞り込み・並べ替えはまとめて行い、描画するのは表示中のページの行だけにする
+    page_df, n_matches, n_pages = query_leads(
+        leads_df, search, ["customer_name", "customer_attr"], min_score or None, "score",
+        sort_by, ascending, st.session_state.get("lead_page", 1), page_size)
+    if st.session_state.get("lead_page", 1) > n_pages:
+        st.session_state.lead_page = n_pages
+    p1, p2 = st.columns([1, 4])
+    p1.number_input("ページ", min_value=1, max_value=n_pages, key="lead_page")
+    p2.caption(f"{n_matches:,} 件中 {len(page_df):,} 件を表示（全 {n_pages} ページ）")
+
+    for idx, row in page_df.iterrows():
+        score = "-" if pd.isna(row.score) else row.score
+        color = "gray" if score == "-" else "lime" if score >= 80 else "orange" if score >= 70 else "red"
+        position = leads_df.index.get_loc(idx)
+        rep_index = assignment['assigned'][position]
+        rep_text = f"<b>{reps_df.rep_name.iloc[rep_index]}</b>（{reps_df.specialty.iloc[rep_index]}）" if rep_index >= 0 else "未割り当て（上限超過）"
+        expected = assignment['expected_conversion'][position]
         st.markdown(f"""
         <div style='background:#1e293b;padding:1em;margin:1em 0;border-radius:10px;color:white;'>
             <h4>👤 {row.customer_name} 様</h4>
             <p>🧬 {row.customer_attr}</p>
-            <p>🔥 スコア: <span style='color:{'lime' if color=='green' else 'orange' if color=='yellow' else 'red'};'>{row.score}</span></p>
-            <p>🤖 推奨担当: <b>{rep.rep_name}</b>（{rep.specialty}）</p>
+            <p>🔥 スコア: <span style='color:{color};'>{score}</span></p>
+            <p>🤖 推奨担当: {rep_text} / 期待成約率 {expected:.0%}</p>
         </div>
         """, unsafe_allow_html=True)
 
         if st.button(f"この商談を開始 ▶", key=f"start_{idx}"):
             st.session_state.lead_idx = idx
+            st.session_state.rep_name = reps_df.rep_name.iloc[rep_index] if rep_index >= 0 else None
             st.session_state.step = 0
+            reset_suggestions()
             st.session_state.tags = []
             st.session_state.chat = []
             st.session_state.outcome = None
@@ -74,7 +221,7 @@ with T2:
     if st.session_state.lead_idx is None:
         st.info("タブ①で商談を開始してください")
     else:
-        lead = leads_df.iloc[st.session_state.lead_idx]
+        lead = leads_df.loc[st.session_state.lead_idx]
         st.subheader(f"お客様: {lead.customer_name} / スコア {lead.score}")
 
         log_container = st.container(height=250, border=True)
@@ -82,14 +229,20 @@ with T2:
             who = "👤 お客様:" if conv_flow[i]["speaker"] == "customer" else "💼 担当者:"
             log_container.markdown(f"{who} {conv_flow[i]['line']}")
 
-        suggest = conv_flow[st.session_state.step]["ai"] if st.session_state.step < len(conv_flow) else "商談終了！成果を入力してください"
-        st.success(suggest)
+        feed_conversation(st.session_state.step)
+        if st.session_state.suggestions:
+            detected = ", ".join(f"`{keyword}`" for keyword in st.session_state.keywords)
+            st.success(f"【検知: {detected}】 " + " ".join(s["message"] for s in st.session_state.suggestions))
+        elif st.session_state.step < len(conv_flow):
+            st.success("ニーズヒアリングを深掘りしてください" if st.session_state.step == 0 else "お客様の反応を観察")
+        if st.session_state.step >= len(conv_flow):
+            st.info("商談終了！成果を入力してください")
 
         c1, c2, c3 = st.columns(3)
         c1.button("▶ 次へ", on_click=lambda: st.session_state.__setitem__('step', st.session_state.step+1), disabled=st.session_state.step>=len(conv_flow))
         if st.session_state.step >= len(conv_flow):
-            c2.button("✅ 成約", on_click=lambda: st.session_state.__setitem__('outcome', '成約'))
-            c3.button("❌ 見送り", on_click=lambda: st.session_state.__setitem__('outcome', '見送り'))
+            c2.button("✅ 成約", on_click=record_outcome, args=("成約",))
+            c3.button("❌ 見送り", on_click=record_outcome, args=("見送り",))
 
         st.divider()
         tag = st.selectbox("感じた手触りタグを記録", tag_list)
@@ -102,18 +255,15 @@ with T2:
         chat_area = st.container(height=200, border=True)
         for m in st.session_state.chat:
             chat_area.markdown(m)
-        if q := st.text_input("AI重政に質問 ⇩", placeholder="類似顧客の成功例は？"):
-            st.session_state.chat.append(f"🧑‍💼 あなた: {q}")
-            ans = kb.get(q, "すみません、まだ回答データがありません")
-            st.session_state.chat.append(f"🤖 AI重政: {ans}")
-            st.experimental_rerun()
+        # 送信後に入力欄を空にする（値が残ると再実行のたびに同じ質問が追加され続けるため）
+        st.text_input("AI重政に質問 ⇩", placeholder="類似顧客の成功例は？", key="kb_question", on_change=ask_knowledge_base)
 
 with T3:
     st.header("📝 商談サマリー")
     if st.session_state.outcome is None:
         st.info("商談終了後に結果が表示されます")
     else:
-        lead = leads_df.iloc[st.session_state.lead_idx]
+        lead = leads_df.loc[st.session_state.lead_idx]
         st.subheader(f"結果: {st.session_state.outcome}")
         st.write("**顧客:**", lead.customer_name)
         st.write("**タグ:**", ", ".join(st.session_state.tags) if st.session_state.tags else "なし")
@@ -125,14 +275,17 @@ with T3:
 
 with T4:
     st.header("🔥 フォローアップ顧客 温度計")
+    hottest = st.toggle("熱い順に表示", value=True)
+    follow_df = get_temperature_engine().ranking(10, hottest=hottest)
     for _, r in follow_df.iterrows():
-        color = "green" if r.thermo > 60 else "orange" if r.thermo > 40 else "red"
+        color = "green" if r.temperature > 60 else "orange" if r.temperature > 40 else "red"
+        last_contact = "なし" if pd.isna(r.days_since_contact) else f"{int(r.days_since_contact)}日前"
         st.markdown(f"""
         <div style='background:#1e293b;padding:1em;margin:1em 0;border-radius:10px;color:white;'>
             <h4>👤 {r.customer_name}</h4>
-            <p>最終接触: {r.last_contact}</p>
-            <p>🔥 温度: <span style='color:{color};'>{r.thermo}</span></p>
-            <p>{r.insight}</p>
+            <p>最終接触: {last_contact}</p>
+            <p>🔥 温度: <span style='color:{color};'>{r.temperature}</span></p>
+            <p>{r.insight.replace("**", "")}</p>
             <button style='background:#3b82f6;color:white;border:none;padding:0.5em 1em;border-radius:6px;'>今すぐリマインド📞</button>
         </div>
         """, unsafe_allow_html=True)
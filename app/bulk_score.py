@@ -0,0 +1,235 @@
+# app/bulk_score.py
+#
+# 顧客ポートフォリオ全件を一括でスコアリングする夜間バッチ用CLI
+#   python bulk_score.py customers.parquet out/ --simulate
+#   python bulk_score.py customers.csv out/ --format csv --chunksize 200000 --workers 8
+#
+# 入力（CSV / Parquet）を chunksize 行ずつ読み込み、チャンクをプロセスプールに振り分けてスコアリングする。
+# 各ワーカーはチャンクごとに out/part-000000.parquet のような部分ファイルを書き出し、
+# 完了したチャンクを out/_manifest.json に記録する。途中で落ちても同じコマンドを再実行すれば
+# 未完了のチャンクから再開する（--restart で最初からやり直す）。
+# 同時に処理中のチャンク数を制限しているため、入力の大きさに関わらずメモリ使用量は一定に保たれる。
+# 出力は pd.read_parquet('out/') などでディレクトリごと読み込める。
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+# 一括スコアリングでは同じ顧客が繰り返し現れないため、スコアキャッシュは既定で無効にする
+os.environ.setdefault('ATLAS_SCORE_CACHE_SIZE', '0')
+
+# `python app/bulk_score.py` で実行した場合も ml パッケージを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.preprocess import ID_COLUMN, REQUIRED_KEYS, iter_chunks
+from services.prediction_service import PredictionService
+
+MANIFEST_NAME = '_manifest.json'
+# 出力するWhat-Ifシミュレーション（PredictionService.run_simulations のシナリオ名）
+SIMULATION_SCENARIOS = ['simulation_guarantor', 'simulation_no_debt']
+# 再開時に前回の実行と一致している必要がある設定
+RUN_KEYS = ['input', 'input_size', 'input_mtime', 'chunksize', 'format', 'simulate', 'id_column', 'model_version']
+
+# ワーカープロセスごとのサービス（fork 時は親で読み込んだモデルをそのまま共有する）
+_service = None
+
+def _init_worker(backend, model_version):
+    """ ワーカーの初期化: モデルを一度だけ読み込み、親と同じバージョンであることを確認する """
+    global _service
+    if _service is None:
+        _service = PredictionService(backend=backend)
+    bundle = _service.registry.current()
+    if bundle.model_version != model_version:
+        raise RuntimeError(f"Worker loaded model {bundle.model_version}, expected {model_version}")
+
+def _part_path(output_dir, index, fmt):
+    return os.path.join(output_dir, f'part-{index:06d}.{fmt}')
+
+def _write_atomic(df, path, fmt):
+    """ 一時ファイルに書いてから置き換え、書きかけの部分ファイルが残らないようにする """
+    tmp_path = path + '.tmp'
+    if fmt == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def score_chunk(index, chunk, output_dir, fmt, simulate, id_column):
+    """ 1チャンク分をスコアリングして部分ファイルに書き出し、(チャンク番号, 件数, エラー件数) を返す """
+    bundle = _service.registry.current()
+    n_rows = len(chunk)
+    scores = pd.Series(pd.NA, index=range(n_rows), dtype='Int16')
+    errors = pd.Series(pd.NA, index=range(n_rows), dtype='string')
+    simulations = {name: pd.Series(pd.NA, index=range(n_rows), dtype='Int16') for name in SIMULATION_SCENARIOS}
+
+    # 欠損値を含む行は予測できないため、スコアリングの前にエラーとして除外する
+    features = chunk[REQUIRED_KEYS].reset_index(drop=True)
+    incomplete = features.isna()
+    incomplete_rows = incomplete.any(axis=1).to_numpy()
+    for i in incomplete_rows.nonzero()[0]:
+        errors[i] = f"Missing values: {incomplete.columns[incomplete.iloc[i].to_numpy()].tolist()}"
+
+    positions = (~incomplete_rows).nonzero()[0]
+    records = features.iloc[positions].to_dict('records')
+    if simulate:
+        # run_simulations_many は基準ケースも含めて1回の予測でまとめてスコアリングする
+        valid = []
+        for i, record in zip(positions, records):
+            error = _service.validate(record)
+            if error is None:
+                valid.append((i, record))
+            else:
+                errors[i] = error
+        results = _service.run_simulations_many([record for _, record in valid]) if valid else []
+        for (i, _), result in zip(valid, results):
+            scores[i] = result['base_case']['score']
+            for name in SIMULATION_SCENARIOS:
+                if name in result:
+                    simulations[name][i] = result[name]['score']
+    else:
+        for i, result in zip(positions, _service.score_many(records)):
+            if 'error' in result:
+                errors[i] = result['error']
+            else:
+                scores[i] = result['score']
+
+    out = pd.DataFrame({'atlas_score': scores, 'error': errors})
+    if id_column in chunk.columns:
+        out.insert(0, id_column, chunk[id_column].to_numpy())
+    if simulate:
+        for name in SIMULATION_SCENARIOS:
+            out[f'{name}_score'] = simulations[name]
+    out['model_version'] = bundle.model_version
+
+    _write_atomic(out, _part_path(output_dir, index, fmt), fmt)
+    return index, n_rows, int(errors.notna().sum())
+
+def _load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise SystemExit(f"{path} is corrupted ({e}). Use --restart to discard it or choose another output directory.")
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('completed'), dict):
+        raise SystemExit(f"{path} is not a bulk scoring manifest. Use --restart to discard it or choose another output directory.")
+    return manifest
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _clear_output(output_dir):
+    for name in os.listdir(output_dir):
+        if name == MANIFEST_NAME or name.startswith('part-'):
+            os.remove(os.path.join(output_dir, name))
+
+def run(input_path, output_dir, fmt='parquet', chunksize=100_000, workers=None, simulate=False,
+        id_column=ID_COLUMN, backend=None, restart=False):
+    """ 入力ファイル全件をスコアリングし、完了したマニフェストを返す """
+    global _service
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 親プロセスでモデルを読み込み、全ワーカーが同じバージョンで処理するよう固定する
+    _service = PredictionService(backend=backend)
+    bundle = _service.registry.current()
+    os.environ['ATLAS_MODEL_VERSION'] = bundle.version
+
+    stat = os.stat(input_path)
+    run_config = {
+        'input': os.path.abspath(input_path),
+        'input_size': stat.st_size,
+        'input_mtime': stat.st_mtime,
+        'chunksize': chunksize,
+        'format': fmt,
+        'simulate': simulate,
+        'id_column': id_column,
+        'model_version': bundle.model_version,
+    }
+
+    manifest = None if restart else _load_manifest(output_dir)
+    if manifest is not None:
+        changed = [key for key in RUN_KEYS if manifest.get(key) != run_config[key]]
+        if changed:
+            raise SystemExit(
+                f"{output_dir} contains a run with different settings ({changed}). "
+                "Use --restart to discard it or choose another output directory.")
+        # 部分ファイルが消えているチャンクは完了済みとして扱わず、もう一度スコアリングする
+        for index in [index for index in manifest['completed'] if not os.path.exists(_part_path(output_dir, int(index), fmt))]:
+            del manifest['completed'][index]
+        print(f"前回の実行を再開します（完了済み {len(manifest['completed'])} チャンク）")
+    else:
+        _clear_output(output_dir)
+        manifest = dict(run_config, completed={}, finished=False)
+        _save_manifest(output_dir, manifest)
+
+    workers = workers or multiprocessing.cpu_count()
+    max_in_flight = workers * 2
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            index, n_rows, n_errors = future.result()
+            manifest['completed'][str(index)] = {'rows': n_rows, 'errors': n_errors}
+        _save_manifest(output_dir, manifest)
+        total = sum(part['rows'] for part in manifest['completed'].values())
+        print(f"  {len(manifest['completed'])} チャンク / {total:,} 件を書き出しました")
+
+    columns = REQUIRED_KEYS + [id_column]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_service.backend, bundle.model_version)) as executor:
+        try:
+            for index, chunk in enumerate(iter_chunks(input_path, chunksize, columns)):
+                if str(index) in manifest['completed']:
+                    continue
+                missing = [key for key in REQUIRED_KEYS if key not in chunk.columns]
+                if missing:
+                    raise SystemExit(f"{input_path} is missing required columns: {missing}")
+                # 処理中のチャンク数を制限し、読み込みが先行してメモリを使い切らないようにする
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(score_chunk, index, chunk, output_dir, fmt, simulate, id_column))
+            if pending:
+                collect(wait(pending)[0])
+                pending = set()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    manifest['finished'] = True
+    _save_manifest(output_dir, manifest)
+    return manifest
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATLAS スコアの一括算出")
+    parser.add_argument('input', help="顧客データ（CSV / Parquet）")
+    parser.add_argument('output_dir', help="部分ファイルとマニフェストを書き出すディレクトリ")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help="出力形式")
+    parser.add_argument('--chunksize', type=int, default=100_000, help="1チャンクの行数")
+    parser.add_argument('--workers', type=int, help="ワーカープロセス数（既定: CPUコア数）")
+    parser.add_argument('--simulate', action='store_true', help="What-Ifシミュレーションのスコアも出力する")
+    parser.add_argument('--id-column', default=ID_COLUMN, help="出力にそのまま残す顧客IDのカラム")
+    parser.add_argument('--backend', help="推論バックエンド（sklearn / compiled）")
+    parser.add_argument('--restart', action='store_true', help="前回の途中結果を破棄して最初から実行する")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    manifest = run(
+        args.input, args.output_dir, fmt=args.format, chunksize=args.chunksize, workers=args.workers,
+        simulate=args.simulate, id_column=args.id_column, backend=args.backend, restart=args.restart,
+    )
+    total = sum(part['rows'] for part in manifest['completed'].values())
+    errors = sum(part['errors'] for part in manifest['completed'].values())
+    print(f"完了しました: {total:,} 件（エラー {errors:,} 件） -> {args.output_dir}")
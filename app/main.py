@@ -1,16 +1,123 @@
 # app/main.py
 
-from flask import Flask, request, jsonify
-from services.prediction_service import prediction_service # サービス部品をインポート
+import hmac
+import json
+import os
+import threading
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from services.prediction_service import prediction_service, REQUIRED_KEYS # サービス部品をインポート
+from services.micro_batcher import MicroBatcher
+from services.assignment_service import assign_records
+from services.keyword_detector import SuggestionEngine, SuggestionSessionStore
+from services.metrics import REGISTRY, REQUESTS, ERRORS, REQUEST_DURATION, STAGE_DURATION, MICROBATCH_SIZE
 
 # Flaskアプリケーションを初期化
 app = Flask(__name__)
 app.json.ensure_ascii = False # この行を追加
 
+# ATLAS_MICROBATCH=1 のとき、同時に届いた /predict をまとめて1回でスコアリングする
+# 最大バッチサイズと最大待ち時間で、p50レイテンシとスループットのバランスを調整する
+micro_batcher = None
+if os.environ.get('ATLAS_MICROBATCH', '0') == '1':
+    micro_batcher = MicroBatcher(
+        prediction_service.run_simulations_many,
+        max_batch_size=int(os.environ.get('ATLAS_MICROBATCH_MAX_SIZE', 64)),
+        max_wait_ms=float(os.environ.get('ATLAS_MICROBATCH_MAX_WAIT_MS', 2.0)),
+        batch_size_histogram=MICROBATCH_SIZE,
+        validate=prediction_service.validate,
+    )
+
+# 商談コックピットのリアルタイム・サジェスト（ATLAS_SUGGESTION_RULES_PATH でルールの JSON を差し替え可能）
+# セッションの状態は ATLAS_SUGGESTION_DB_PATH の SQLite に置き、どのワーカーに届いたリクエストでも続きを処理する。
+# SQLite は最初のコックピットのリクエストで開くため、コックピットを使わない場合（ベンチマークやテストでの import を含む）はファイルを作らない。
+# SSE の接続は配信中ずっとスレッドを1つ使うため、ATLAS_COCKPIT=0 で無効にしない限り serve.py は gthread ワーカーで起動する
+COCKPIT_ENABLED = os.environ.get('ATLAS_COCKPIT', '1') == '1'
+suggestion_engine = None
+_suggestion_sessions = None
+_suggestion_sessions_lock = threading.Lock()
+if COCKPIT_ENABLED:
+    _rules_path = os.environ.get('ATLAS_SUGGESTION_RULES_PATH')
+    suggestion_engine = SuggestionEngine.from_file(_rules_path) if _rules_path else SuggestionEngine()
+
+def get_suggestion_sessions():
+    """ 商談セッションのストアを返す（初回呼び出し時に SQLite を開く） """
+    global _suggestion_sessions
+    if _suggestion_sessions is None:
+        with _suggestion_sessions_lock:
+            if _suggestion_sessions is None:
+                _suggestion_sessions = SuggestionSessionStore(
+                    suggestion_engine,
+                    ttl=float(os.environ.get('ATLAS_SUGGESTION_SESSION_TTL', 1800)),
+                    poll_interval=float(os.environ.get('ATLAS_SUGGESTION_POLL_INTERVAL', 0.2)),
+                )
+    return _suggestion_sessions
+
+# /predict ハンドラー内の処理段階のタイマー
+_REQUEST_VALIDATE_TIMER = STAGE_DURATION.labels(stage='request_validate')
+_SERIALIZE_TIMER = STAGE_DURATION.labels(stage='jsonify')
+
+def _score_cache_metrics():
+    """ スコアキャッシュの統計を /metrics に出力する """
+    stats = prediction_service.score_cache.stats()
+    return [
+        ('atlas_score_cache_hits_total', 'counter', 'Score cache hits.', stats['hits']),
+        ('atlas_score_cache_misses_total', 'counter', 'Score cache misses.', stats['misses']),
+        ('atlas_score_cache_evictions_total', 'counter', 'Score cache LRU evictions.', stats['evictions']),
+        ('atlas_score_cache_expirations_total', 'counter', 'Score cache TTL expirations.', stats['expirations']),
+        ('atlas_score_cache_entries', 'gauge', 'Current number of score cache entries.', stats['size']),
+    ]
+
+REGISTRY.register_collector(_score_cache_metrics)
+
+def start_background_tasks():
+    """
+    プロセスごとのバックグラウンド処理を開始する（開発サーバー起動時、または fork 後の各ワーカーで呼ぶ）
+    ATLAS_MODEL_WATCH_INTERVAL（秒）を指定すると models/ を監視し、更新されたモデルに自動で差し替える
+    """
+    watch_interval = float(os.environ.get('ATLAS_MODEL_WATCH_INTERVAL', 0))
+    if watch_interval > 0:
+        prediction_service.registry.start_watching(watch_interval)
+    # マルチワーカー構成では、スコアキャッシュの統計などを定期的に共有ファイルへ書き込む
+    REGISTRY.start_publishing(float(os.environ.get('ATLAS_METRICS_PUBLISH_INTERVAL', 5)))
+
+def stop_background_tasks():
+    """ グレースフルシャットダウン時に、キューに残ったリクエストを処理してから監視・ディスパッチャーを止める """
+    if micro_batcher is not None:
+        micro_batcher.stop()
+    prediction_service.registry.stop_watching()
+    REGISTRY.stop_publishing()
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """ エンドポイントごとのリクエスト数・レイテンシ・エラー種別を記録する """
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint)
+    REQUEST_DURATION.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    if response.status_code >= 400:
+        ERRORS.inc(endpoint=endpoint, error_type=g.get('error_type', f'http_{response.status_code}'))
+    return response
+
 @app.route('/')
 def index():
     return "ATLAS API is running!"
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """ ライブネス: プロセスがリクエストに応答できれば200を返す """
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """ レディネス: モデルを読み込み済みでスコアリングできる場合だけ200を返す """
+    if not prediction_service.registry.is_loaded():
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ready", "model_version": prediction_service.model_version})
+
 @app.route('/predict', methods=['POST'])
 def predict():
     """
@@ -21,18 +128,214 @@ def predict():
 
     customer_data = request.json
     
-    # 必須キーのチェック
-    required_keys = ['Age', 'Residence_Type', 'Years_at_Work', 'Annual_Income_JPY_10k', 'Other_Debt_JPY_10k', 'Guarantor', 'Medical_History', 'Payment_Rate']
-    if not all(key in customer_data for key in required_keys):
-         return jsonify({"error": f"Missing required keys. Required: {required_keys}"}), 400
+    # 必須キーと値の型のチェック（/predict/batch の score_many と同じ検証）
+    with _REQUEST_VALIDATE_TIMER.time():
+        has_required_keys = isinstance(customer_data, dict) and all(key in customer_data for key in REQUIRED_KEYS)
+        error = prediction_service.validate(customer_data) if has_required_keys else None
+    if not has_required_keys:
+         g.error_type = 'missing_keys'
+         return jsonify({"error": f"Missing required keys. Required: {REQUIRED_KEYS}"}), 400
+    if error is not None:
+        g.error_type = 'invalid_value'
+        return jsonify({"error": error}), 400
 
     try:
         # 予測サービスを使ってシミュレーションを実行
-        results = prediction_service.run_simulations(customer_data)
+        if micro_batcher is not None:
+            results = micro_batcher.score(customer_data)
+        else:
+            results = prediction_service.run_simulations(customer_data)
+        with _SERIALIZE_TIMER.time():
+            return jsonify(results)
+    except ValueError as e:
+        g.error_type = 'invalid_value'
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    顧客データのリストをJSONで受け取り、まとめてスコアリングした結果を返すエンドポイント
+    入力は顧客データの配列、または {"records": [...]} 形式
+    """
+    payload = request.get_json(silent=True)
+    records = payload.get('records') if isinstance(payload, dict) else payload
+    if not isinstance(records, list):
+        return jsonify({"error": "Invalid input, JSON array of records required"}), 400
+
+    try:
+        results = prediction_service.score_many(records)
+        return jsonify({"results": results})
+    except Exception as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/simulate', methods=['POST'])
+def simulate():
+    """
+    基準顧客と宣言的なグリッド / 個別シナリオを受け取り、感度カーブと限界効果を返すエンドポイント
+    入力例: {"customer": {...}, "grid": {"Annual_Income_JPY_10k": {"start": 300, "stop": 1200, "num": 50}},
+             "perturbations": [{"Guarantor": "Yes"}]}
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('customer'), dict):
+        return jsonify({"error": "Invalid input, JSON with 'customer' object required"}), 400
+
+    try:
+        results = prediction_service.simulate(payload['customer'], payload.get('grid'), payload.get('perturbations'))
         return jsonify(results)
+    except ValueError as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
+        g.error_type = type(e).__name__
         return jsonify({"error": str(e)}), 500
 
+@app.route('/assign', methods=['POST'])
+def assign():
+    """
+    リードと担当者のリストを受け取り、担当者ごとの受け入れ上限の範囲で総期待成約数が最大になる割り当てを返すエンドポイント
+    入力例: {"leads": [{"score": 70, "attributes": "32歳/フリーランス"}],
+             "reps": [{"rep_name": "佐藤さん", "specialty": "若年層・単身者", "base_rate": 0.4, "capacity": 20}]}
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('leads'), list) or not isinstance(payload.get('reps'), list):
+        return jsonify({"error": "Invalid input, JSON with 'leads' and 'reps' arrays required"}), 400
+
+    try:
+        results = assign_records(payload['leads'], payload['reps'], payload.get('capacity'), prediction_service)
+        return jsonify(results)
+    except ValueError as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 500
+
+def _cockpit_not_found():
+    return jsonify({"error": "Session not found" if COCKPIT_ENABLED else "Cockpit is disabled"}), 404
+
+@app.route('/cockpit/sessions', methods=['POST'])
+def create_cockpit_session():
+    """ 商談1件分のサジェストセッションを作成し、セッションIDを返すエンドポイント """
+    if not COCKPIT_ENABLED:
+        return _cockpit_not_found()
+    return jsonify({"session_id": get_suggestion_sessions().create()}), 201
+
+@app.route('/cockpit/sessions/<session_id>/transcript', methods=['POST'])
+def feed_transcript(session_id):
+    """
+    文字起こしの断片を受け取り、検出したキーワードと発火したサジェストを返すエンドポイント
+    入力例: {"text": "初期費用が少し", "end_of_utterance": false}
+    発話の途中で区切られた断片も、前の断片とつなげてキーワードを照合する
+    """
+    if not COCKPIT_ENABLED or not get_suggestion_sessions().exists(session_id):
+        return _cockpit_not_found()
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('text'), str):
+        return jsonify({"error": "Invalid input, JSON with 'text' string required"}), 400
+
+    try:
+        result = get_suggestion_sessions().feed(session_id, payload['text'], bool(payload.get('end_of_utterance', False)))
+        if result is None:
+            return _cockpit_not_found()
+        return jsonify(result)
+    except Exception as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cockpit/sessions/<session_id>/events', methods=['GET'])
+def cockpit_events(session_id):
+    """
+    発火したサジェストを Server-Sent Events で配信するエンドポイント（event: suggestion）
+    別のワーカーで処理した文字起こしのサジェストも配信する。再接続時は Last-Event-ID の続きから送る。
+    接続中はスレッドを1つ占有するため、本番では serve.py の gthread ワーカーで動かす
+    """
+    if not COCKPIT_ENABLED or not get_suggestion_sessions().exists(session_id):
+        return _cockpit_not_found()
+    last_event_id = request.headers.get('Last-Event-ID')
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    def events():
+        for event, data, event_id in get_suggestion_sessions().listen(session_id, last_event_id=last_event_id):
+            if event == 'heartbeat':
+                yield ': keepalive\n\n'
+            else:
+                yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cockpit/sessions/<session_id>', methods=['DELETE'])
+def close_cockpit_session(session_id):
+    """ 商談の終了時にセッションを破棄し、配信中の SSE 接続も閉じるエンドポイント """
+    if not COCKPIT_ENABLED or not get_suggestion_sessions().close(session_id):
+        return _cockpit_not_found()
+    return jsonify({"closed": session_id})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """ スコアキャッシュのヒット・ミス・追い出し件数などを返すエンドポイント """
+    return jsonify(prediction_service.score_cache.stats())
+
+def _is_admin_request():
+    """ X-Admin-Token ヘッダーを ATLAS_ADMIN_TOKEN と照合する（未設定の場合は全て拒否する） """
+    token = os.environ.get('ATLAS_ADMIN_TOKEN')
+    if not token:
+        return False
+    # 一致するまでの文字数で応答時間が変わらないよう、定数時間で比較する
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode())
+
+@app.route('/admin/models', methods=['GET'])
+def list_models():
+    """ 利用可能なモデルのバージョンと、稼働中のモデルを返すエンドポイント """
+    if not _is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    registry = prediction_service.registry
+    active = prediction_service.model_version if registry.is_loaded() else None
+    return jsonify({"versions": registry.versions(), "active": active})
+
+@app.route('/admin/models/reload', methods=['POST'])
+def reload_model():
+    """
+    モデルを読み込み直して差し替えるエンドポイント（{"version": "v3"} で切り替え先を指定可能）
+    バージョンを指定した場合は models/CURRENT に書き込んで固定するため、全ワーカーが監視スレッド経由で同じバージョンに揃い、
+    ロールバックが最新版に戻されることもない。処理中のリクエストは旧モデルのまま完了し、以降のリクエストから新モデルが使われる
+    """
+    if not _is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    payload = request.get_json(silent=True) or {}
+
+    try:
+        registry = prediction_service.registry
+        version = payload.get('version')
+        bundle = registry.pin(version) if version else registry.reload()
+        return jsonify({"active": bundle.model_version})
+    except FileNotFoundError as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        g.error_type = type(e).__name__
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/batcher/stats', methods=['GET'])
+def batcher_stats():
+    """ マイクロバッチのバッチサイズ分布などを返すエンドポイント """
+    if micro_batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **micro_batcher.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ リクエスト数・エラー数・各処理段階のレイテンシなどを Prometheus テキスト形式で返すエンドポイント """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    # Webサーバーを起動
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # 開発用のWebサーバーを起動（本番は serve.py のマルチワーカー構成を使う）
+    start_background_tasks()
+    app.run(debug=os.environ.get('FLASK_DEBUG', '0') == '1', port=int(os.environ.get('PORT', 5000)), threaded=True)
\ No newline at end of file
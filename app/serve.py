@@ -0,0 +1,100 @@
+# app/serve.py
+#
+# 本番用のマルチワーカー起動スクリプト（gunicorn のプリフォーク構成）
+#   python serve.py
+# 親プロセスでモデルを一度だけ読み込んでから fork するため、各ワーカーはモデルをコピーオンライトで共有する。
+#
+# 主な設定（環境変数）
+#   ATLAS_BIND               待ち受けアドレス（既定: 0.0.0.0:5000）
+#   ATLAS_WORKERS            ワーカープロセス数（既定: CPUコア数）
+#   ATLAS_THREADS            ワーカーあたりのスレッド数（既定: 1、商談コックピット有効時は 16。2以上で gthread ワーカーを使う）
+#   ATLAS_COCKPIT            商談コックピットの API（SSE を含む）を有効にするか（既定: 1）
+#                            有効な場合は常に gthread ワーカーを使う。sync ワーカーでは SSE の接続1本がワーカー1つを
+#                            占有し、timeout で強制終了されるため
+#   ATLAS_GRACEFUL_TIMEOUT   SIGTERM 受信後、処理中のリクエストの完了を待つ秒数（既定: 30）
+#   ATLAS_MODEL_WATCH_INTERVAL  各ワーカーでの models/ 監視間隔（秒、既定: 5）
+#   ATLAS_METRICS_DIR        ワーカー間で /metrics の値を共有するディレクトリ（既定: 起動ごとの一時ディレクトリ）
+#   ATLAS_SUGGESTION_DB_PATH ワーカー間で商談コックピットのセッションを共有する SQLite（既定: 起動ごとの一時ディレクトリ）
+
+import gc
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# 全ワーカーが同じモデルファイルの更新を拾えるよう、本番では監視を既定で有効にする
+os.environ.setdefault('ATLAS_MODEL_WATCH_INTERVAL', '5')
+
+# /metrics をどのワーカーが受けても全ワーカーの合算を返すよう、値を共有ディレクトリに書き込む
+# （app/services/metrics.py が読み込み時に参照するため、main より先に設定する）
+_created_metrics_dir = None
+if not os.environ.get('ATLAS_METRICS_DIR'):
+    _created_metrics_dir = tempfile.mkdtemp(prefix='atlas-metrics-')
+    os.environ['ATLAS_METRICS_DIR'] = _created_metrics_dir
+# 前回の起動の値が合計に混ざらないよう、残っているファイルは消してから始める
+for _path in glob.glob(os.path.join(os.environ['ATLAS_METRICS_DIR'], 'metrics_*.db')):
+    os.remove(_path)
+
+# 商談コックピットのセッションは起動ごとの一時的な状態のため、指定が無ければ一時ディレクトリに置き、終了時に消す
+_created_cockpit_dir = None
+if not os.environ.get('ATLAS_SUGGESTION_DB_PATH'):
+    _created_cockpit_dir = tempfile.mkdtemp(prefix='atlas-cockpit-')
+    os.environ['ATLAS_SUGGESTION_DB_PATH'] = os.path.join(_created_cockpit_dir, 'cockpit_sessions.db')
+
+from gunicorn.app.base import BaseApplication
+from main import COCKPIT_ENABLED, app, prediction_service, start_background_tasks, stop_background_tasks
+
+# 商談コックピット有効時のワーカーあたりのスレッド数の既定値（SSE の同時接続数の目安）
+COCKPIT_THREADS = 16
+
+def post_fork(server, worker):
+    # 監視スレッドやマイクロバッチのディスパッチャーは fork で引き継がれないため、ワーカーごとに起動する
+    start_background_tasks()
+
+def worker_exit(server, worker):
+    stop_background_tasks()
+
+def on_exit(server):
+    for directory in (_created_metrics_dir, _created_cockpit_dir):
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def build_options():
+    """ 環境変数から gunicorn の設定を組み立てる """
+    threads = int(os.environ.get('ATLAS_THREADS', COCKPIT_THREADS if COCKPIT_ENABLED else 1))
+    return {
+        'bind': os.environ.get('ATLAS_BIND', '0.0.0.0:5000'),
+        'workers': int(os.environ.get('ATLAS_WORKERS', multiprocessing.cpu_count())),
+        'threads': threads,
+        # gthread ワーカーは処理中のリクエストと別にハートビートを送るため、SSE の長い接続でも timeout で落ちない
+        'worker_class': 'gthread' if threads > 1 or COCKPIT_ENABLED else 'sync',
+        # アプリ（とモデル）を親プロセスで読み込んでから fork する
+        'preload_app': True,
+        'graceful_timeout': int(os.environ.get('ATLAS_GRACEFUL_TIMEOUT', 30)),
+        'timeout': int(os.environ.get('ATLAS_WORKER_TIMEOUT', 60)),
+        'keepalive': int(os.environ.get('ATLAS_KEEPALIVE', 5)),
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'on_exit': on_exit,
+    }
+
+class AtlasServer(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+if __name__ == '__main__':
+    # モデルを親プロセスで読み込み、読み込み済みのオブジェクトを GC の走査対象から外しておく
+    # （fork 後の GC がモデルのページに書き込み、コピーが発生するのを抑える）
+    prediction_service.registry.current()
+    gc.freeze()
+    AtlasServer(app, build_options()).run()
@@ -0,0 +1,200 @@
+# app/services/assignment_service.py
+#
+# リード × 担当者の期待成約率行列と、担当者の受け入れ上限付きの割り当て
+# 期待成約率はこれまでの UI と同じ「顧客スコア × 担当者の基本成約率 × 相性係数 / 50」を行列で一度に計算し、
+# 割り当ては総期待成約数が最大になるよう、上限付きの輸送問題（線形計画）として厳密に解く。
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+# 顧客セグメント: (名前, リード属性のキーワード, 担当者の得意領域のキーワード)
+# 上から順に判定し、どれにも当たらないリード / 担当者は最後のセグメントになる
+SEGMENTS = [
+    ('single', ('フリーランス', '会社員'), ('単身', '若年')),
+    ('family', ('主婦',), ('主婦', 'ファミリー')),
+    ('executive', (), ()),
+]
+MATCH_FACTOR = 1.2
+MISMATCH_FACTOR = 0.8
+SCORE_SCALE = 50.0
+
+def _segment(texts, keyword_index):
+    texts = pd.Series(texts, dtype=object).fillna('').astype(str)
+    segments = np.full(len(texts), len(SEGMENTS) - 1, dtype=np.intp)
+    # 優先度の低いセグメントから順に上書きし、先頭のセグメントが優先されるようにする
+    for index in range(len(SEGMENTS) - 2, -1, -1):
+        keywords = SEGMENTS[index][keyword_index]
+        if keywords:
+            hit = texts.str.contains('|'.join(keywords), regex=True).to_numpy()
+            segments[hit] = index
+    return segments
+
+def segment_leads(attributes):
+    """ リードの属性文字列をセグメント番号の配列に変換する """
+    return _segment(attributes, 1)
+
+def segment_reps(specialties):
+    """ 担当者の得意領域をセグメント番号の配列に変換する """
+    return _segment(specialties, 2)
+
+def conversion_matrix(scores, lead_segments, base_rates, rep_segments, dtype=np.float64):
+    """ リード × 担当者の期待成約率行列を1回のブロードキャストで計算する（0〜1に丸める） """
+    scores = np.asarray(scores, dtype=dtype)
+    base_rates = np.asarray(base_rates, dtype=dtype)
+    match = np.asarray(lead_segments)[:, None] == np.asarray(rep_segments)[None, :]
+    matrix = np.where(match, dtype(MATCH_FACTOR), dtype(MISMATCH_FACTOR))
+    matrix *= scores[:, None] / SCORE_SCALE
+    matrix *= base_rates[None, :]
+    np.clip(matrix, 0.0, 1.0, out=matrix)
+    # スコアの無いリードは誰にも割り当てない
+    matrix[np.isnan(scores)] = 0.0
+    return matrix
+
+def solve_transport(value, supply, capacity):
+    """
+    輸送問題として解く: 行 t（同じ期待成約率を持つリードのグループ、supply[t] 件）から担当者 j へ何件割り当てるか。
+    担当者ごとの上限 capacity[j] を守りつつ総期待成約数を最大化し、整数の件数行列を返す。
+    制約行列は完全単模なので、単体法の解（頂点）はそのまま整数になる。
+    """
+    value = np.asarray(value, dtype=np.float64)
+    n_groups, n_reps = value.shape
+    flow = np.zeros((n_groups, n_reps), dtype=np.int64)
+    # 期待成約率が0以下の組は割り当てても得が無いため、変数から外しておく
+    group_index, rep_index = np.nonzero(value > 0.0)
+    if len(group_index) == 0:
+        return flow
+
+    n_vars = len(group_index)
+    columns = np.arange(n_vars)
+    constraints = sparse.vstack([
+        sparse.csr_matrix((np.ones(n_vars), (group_index, columns)), shape=(n_groups, n_vars)),
+        sparse.csr_matrix((np.ones(n_vars), (rep_index, columns)), shape=(n_reps, n_vars)),
+    ])
+    bounds = np.concatenate([np.asarray(supply, dtype=np.float64), np.asarray(capacity, dtype=np.float64)])
+    objective = -value[group_index, rep_index]
+    # 内点法 + クロスオーバーの方が同点の多いこの問題では単体法より速い。頂点解にならなかった場合だけ単体法で解き直す
+    for method in ('highs-ipm', 'highs-ds'):
+        result = linprog(objective, A_ub=constraints, b_ub=bounds, bounds=(0, None), method=method)
+        if result.status != 0:
+            raise RuntimeError(f"Assignment solver failed: {result.message}")
+        counts = np.rint(result.x)
+        if np.abs(result.x - counts).max() < 1e-6:
+            break
+    flow[group_index, rep_index] = counts.astype(np.int64)
+    return flow
+
+def solve_assignment(value, capacity, groups=None):
+    """
+    value（リード × 担当者の期待成約率）と担当者ごとの上限件数から、総期待成約数が最大になる割り当てを求める。
+    各リードの担当者番号（未割り当ては -1）を返す。
+    同じ行を持つリードをまとめて輸送問題として解くため、規模はリード数ではなくグループ数で決まる。
+    groups（リードごとのグループのキー。1次元、または1行1リードの2次元配列）を渡せば、行の重複判定を省略できる。
+    """
+    value = np.asarray(value, dtype=np.float64)
+    n_leads, n_reps = value.shape
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=np.int64), (n_reps,))
+    if n_leads == 0 or n_reps == 0:
+        return np.full(n_leads, -1, dtype=np.intp)
+
+    if groups is None:
+        _, first, groups = np.unique(value, axis=0, return_index=True, return_inverse=True)
+    else:
+        _, first, groups = np.unique(np.asarray(groups), axis=0, return_index=True, return_inverse=True)
+    groups = groups.ravel()
+    supply = np.bincount(groups)
+    flow = solve_transport(value[first], supply, capacity)
+
+    # グループごとの割り当て件数を、グループ内のリードに先頭から順に配る
+    assigned = np.full(n_leads, -1, dtype=np.intp)
+    members = np.split(np.argsort(groups, kind='stable'), np.cumsum(supply)[:-1])
+    for group in np.flatnonzero(flow.sum(axis=1)):
+        reps = np.repeat(np.arange(n_reps), flow[group])
+        assigned[members[group][:len(reps)]] = reps
+    return assigned
+
+def assign_leads(scores, attributes, reps, capacity):
+    """
+    リード（スコアと属性）を担当者に割り当てる。reps は rep_name / specialty / base_rate を持つ DataFrame。
+    戻り値は割り当て結果（担当者番号、未割り当ては -1）、その期待成約率、リードのセグメントなどをまとめた辞書。
+    """
+    scores = np.asarray(pd.to_numeric(pd.Series(scores), errors='coerce'), dtype=np.float64)
+    lead_segments = segment_leads(attributes)
+    rep_segments = segment_reps(reps['specialty'])
+    value = conversion_matrix(scores, lead_segments, reps['base_rate'], rep_segments)
+
+    # 期待成約率はスコアとセグメントだけで決まるため、その組でリードをまとめて解く
+    # （小数のスコアでも衝突しないよう、1つの数値に畳み込まずに組のまま比較する。スコアの無いリードは1つにまとめる）
+    missing = np.isnan(scores)
+    groups = np.column_stack([missing, np.where(missing, 0.0, scores), lead_segments])
+    assigned = solve_assignment(value, capacity, groups)
+    is_assigned = assigned >= 0
+    expected = np.zeros(len(assigned))
+    expected[is_assigned] = value[np.flatnonzero(is_assigned), assigned[is_assigned]]
+    return {
+        'assigned': assigned,
+        'expected_conversion': expected,
+        'lead_segments': lead_segments,
+        'rep_segments': rep_segments,
+        'rep_loads': np.bincount(assigned[is_assigned], minlength=len(rep_segments)),
+        'total_expected_conversions': float(expected.sum()),
+    }
+
+def assign_records(leads, reps, capacity=None, service=None):
+    """
+    /assign 用: JSON のリードと担当者のリストから割り当てを求める。
+    リードは {"score": 70, "attributes": "..."}、または score の代わりに顧客データ（service で一括スコアリング）を持つ。
+    担当者は {"rep_name", "specialty", "base_rate", "capacity"}。capacity を省略した担当者には引数の capacity を使う。
+    """
+    reps = pd.DataFrame(reps)
+    missing = [key for key in ('rep_name', 'specialty', 'base_rate') if key not in reps.columns]
+    if len(reps) == 0 or missing:
+        raise ValueError(f"Each rep requires 'rep_name', 'specialty' and 'base_rate' (missing: {missing})")
+    default_capacity = len(leads) if capacity is None else capacity
+    rep_capacity = reps['capacity'].fillna(default_capacity) if 'capacity' in reps.columns else pd.Series(default_capacity, index=reps.index)
+    if (rep_capacity < 0).any():
+        raise ValueError("'capacity' must be zero or more")
+
+    scores = np.full(len(leads), np.nan)
+    errors = [None] * len(leads)
+    to_score = []
+    for i, lead in enumerate(leads):
+        if not isinstance(lead, dict):
+            errors[i] = "Each lead must be a JSON object"
+        elif lead.get('score') is not None:
+            score = lead['score']
+            if isinstance(score, bool) or not isinstance(score, (int, float)):
+                errors[i] = "'score' must be a number"
+            else:
+                scores[i] = score
+        else:
+            to_score.append(i)
+    if to_score:
+        if service is None:
+            raise ValueError("Leads without 'score' require a prediction service")
+        for i, result in zip(to_score, service.score_many([leads[i] for i in to_score])):
+            if 'error' in result:
+                errors[i] = result['error']
+            else:
+                scores[i] = result['score']
+
+    attributes = [lead.get('attributes', '') if isinstance(lead, dict) else '' for lead in leads]
+    result = assign_leads(scores, attributes, reps, rep_capacity.to_numpy(dtype=np.int64))
+
+    rep_names = reps['rep_name'].tolist()
+    assignments = []
+    for i, (rep, expected) in enumerate(zip(result['assigned'], result['expected_conversion'])):
+        if errors[i] is not None:
+            assignments.append({'error': errors[i]})
+        else:
+            assignments.append({
+                'rep_name': rep_names[rep] if rep >= 0 else None,
+                'score': int(scores[i]),
+                'expected_conversion': float(expected),
+            })
+    return {
+        'assignments': assignments,
+        'rep_loads': dict(zip(rep_names, result['rep_loads'].tolist())),
+        'total_expected_conversions': result['total_expected_conversions'],
+    }
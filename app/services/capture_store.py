@@ -0,0 +1,297 @@
+# app/services/capture_store.py
+#
+# 商談結果の記録ストア（UI タブ③「夜間バッチでAI学習DBに反映」の保存先）
+# 商談ごとの結果・顧客の特徴量・手触りタグ・チャット履歴を SQLite に追記だけで保存する（更新 / 削除はトリガーで禁止）。
+# record() はキューに積むだけで戻り、バックグラウンドのライターが一定件数 / 一定時間ごとにまとめて1トランザクションで書き込む。
+# 書き込みに失敗し続けたバッチは捨てずに DB の隣の退避用セグメント（<DB>.fallback/*.jsonl）に書き出し、
+# 次に書き込めたとき（またはライターの起動時）に DB へ戻す。
+# 夜間の再学習（ml/train_incremental.py）は capture_id を透かし（watermark）にして、前回以降に追記された分だけを読む。
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+DB_PATH_ENV = 'ATLAS_CAPTURE_DB_PATH'
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', 'captures.db')
+# 商談結果と成約モデルの学習ラベルの対応（成約 = 1）。
+# 商談の結果は返済の遅延とは別の事象のため、与信モデル（is_delayed）のラベルには使わない
+OUTCOME_LABELS = {'見送り': 0, '成約': 1}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deal_captures (
+    capture_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    captured_at REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    customer_id TEXT,
+    customer_name TEXT,
+    rep_name TEXT,
+    score INTEGER,
+    model_version TEXT,
+    features TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    chat TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS deal_captures_no_update BEFORE UPDATE ON deal_captures
+BEGIN SELECT RAISE(ABORT, 'deal_captures is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS deal_captures_no_delete BEFORE DELETE ON deal_captures
+BEGIN SELECT RAISE(ABORT, 'deal_captures is append-only'); END;
+CREATE TABLE IF NOT EXISTS replayed_segments (
+    name TEXT PRIMARY KEY,
+    replayed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS training_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished_at REAL NOT NULL,
+    watermark INTEGER NOT NULL,
+    n_rows INTEGER NOT NULL,
+    base_version TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+"""
+
+_INSERT = """
+INSERT INTO deal_captures
+    (captured_at, outcome, customer_id, customer_name, rep_name, score, model_version, features, tags, chat)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 書き込みに失敗したバッチを再試行する回数（それでも失敗した場合は退避用セグメントに書き出す）
+_MAX_ATTEMPTS = 3
+FALLBACK_SUFFIX = '.fallback'
+
+def _json(value):
+    # NumPy のスカラー（DataFrame の行から取り出した値など）は Python の数値として保存する
+    return json.dumps(value, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, 'item') else str(v))
+
+class CaptureStore:
+    """ 商談結果を追記専用の SQLite に保存する。書き込みはバックグラウンドのスレッドでまとめて行う """
+
+    def __init__(self, path=None, max_batch_size=256, flush_interval=1.0):
+        self.path = path or os.environ.get(DB_PATH_ENV) or DEFAULT_DB_PATH
+        self.fallback_dir = self.path + FALLBACK_SUFFIX
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        # 退避用セグメントへの書き出しにも失敗して失われた件数
+        self.dropped = 0
+        self.last_error = None
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _ensure_started(self):
+        # fork 後の子プロセスにはスレッドが引き継がれないため、プロセスごとに起動し直す
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+                self._thread.start()
+
+    def record(self, outcome, features, customer_id=None, customer_name=None, rep_name=None,
+               score=None, model_version=None, tags=(), chat=()):
+        """ 商談1件の結果をキューに積む（書き込みを待たずに戻る） """
+        if outcome not in OUTCOME_LABELS:
+            raise ValueError(f"Unknown outcome {outcome!r} (expected one of {list(OUTCOME_LABELS)})")
+        row = (
+            time.time(), outcome,
+            None if customer_id is None else str(customer_id), customer_name, rep_name,
+            None if score is None or pd.isna(score) else int(score), model_version,
+            _json(dict(features)), _json(list(tags)), _json(list(chat)),
+        )
+        self._ensure_started()
+        self._queue.put(row)
+
+    def _collect(self):
+        """ 最初の1件を待ち、その後は flush_interval 秒の間に届いた分を max_batch_size 件までまとめる """
+        item = self._queue.get()
+        batch, markers = [], []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                # flush() の呼び出し: ここまでに積まれた分を待たずに書き込む
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                return batch, markers, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, markers, False
+
+    def _run(self):
+        self._replay_quietly()
+        stopping = False
+        while not stopping:
+            batch, markers, stopping = self._collect()
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+
+    def _write(self, batch):
+        for attempt in range(_MAX_ATTEMPTS):
+            try:
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.executemany(_INSERT, batch)
+                finally:
+                    conn.close()
+                self.written += len(batch)
+                break
+            except sqlite3.Error as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                time.sleep(0.5 * (attempt + 1))
+        else:
+            self._spill(batch)
+            return
+        # DB に書き込めるようになったので、退避していた分も戻す
+        self._replay_quietly()
+
+    def _spill(self, batch):
+        """ 書き込めなかったバッチを退避用セグメントに書き出す（一時ファイルに書いてから名前を変え、途中までのファイルを残さない） """
+        name = f'{time.time_ns()}-{os.getpid()}.jsonl'
+        path = os.path.join(self.fallback_dir, name)
+        try:
+            os.makedirs(self.fallback_dir, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                for row in batch:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            self.spilled += len(batch)
+        except OSError as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.dropped += len(batch)
+
+    def _replay_quietly(self):
+        try:
+            self.replay_fallback()
+        except sqlite3.Error as e:
+            # DB にまだ書き込めない場合は、セグメントを残したまま次の機会に回す
+            self.last_error = f"{type(e).__name__}: {e}"
+
+    def replay_fallback(self):
+        """
+        退避用セグメントの記録を DB に戻し、戻した件数を返す。
+        セグメント名を同じトランザクションで replayed_segments に記録するため、複数のプロセスが同時に戻したり、
+        ファイルの削除前に落ちたりしても、同じセグメントが二重に追記されることはない。
+        """
+        try:
+            names = sorted(name for name in os.listdir(self.fallback_dir) if name.endswith('.jsonl'))
+        except FileNotFoundError:
+            return 0
+        total = 0
+        for name in names:
+            path = os.path.join(self.fallback_dir, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    rows = [tuple(json.loads(line)) for line in f if line.strip()]
+            except FileNotFoundError:
+                # 他のプロセスが戻し終えて削除した
+                continue
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    done = conn.execute('SELECT 1 FROM replayed_segments WHERE name = ?', (name,)).fetchone()
+                    if done is None:
+                        conn.execute('INSERT INTO replayed_segments (name, replayed_at) VALUES (?, ?)', (name, time.time()))
+                        conn.executemany(_INSERT, rows)
+                        total += len(rows)
+            finally:
+                conn.close()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.replayed += total
+        return total
+
+    def flush(self, timeout=10.0):
+        """ キューに積まれた分が書き込まれるまで待つ """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """ キューに残っている分を書き込んでからライターを止める """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'spilled': self.spilled, 'replayed': self.replayed,
+                'dropped': self.dropped, 'last_error': self.last_error}
+
+    def read_since(self, watermark=0, limit=None):
+        """ capture_id が watermark より大きい記録を古い順に返す（features / tags / chat は JSON をデコード済み） """
+        query = 'SELECT * FROM deal_captures WHERE capture_id > ? ORDER BY capture_id'
+        params = [watermark]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        conn = self._connect()
+        try:
+            df = pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+        for column in ('features', 'tags', 'chat'):
+            df[column] = df[column].map(json.loads)
+        return df
+
+    def training_watermark(self):
+        """ 前回までの再学習で取り込み済みの capture_id（まだ無ければ 0） """
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COALESCE(MAX(watermark), 0) FROM training_runs').fetchone()[0]
+        finally:
+            conn.close()
+
+    def record_training_run(self, watermark, n_rows, base_version, version):
+        """ 再学習の完了を記録し、次回の取り込み開始位置を進める """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT INTO training_runs (finished_at, watermark, n_rows, base_version, version) VALUES (?, ?, ?, ?, ?)',
+                    (time.time(), watermark, n_rows, base_version, version))
+        finally:
+            conn.close()
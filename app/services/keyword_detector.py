@@ -0,0 +1,411 @@
+# app/services/keyword_detector.py
+#
+# 商談コックピットのリアルタイム・サジェスト
+# 会話の文字起こしをテキストの断片（チャンク）単位で受け取り、Aho-Corasick オートマトンでキーワード辞書と照合する。
+# オートマトンの状態はチャンクをまたいで引き継ぐため、チャンクの境目で分かれたキーワードも検出できる。
+# 1文字あたりの処理は辞書の大きさや会話の長さに依存しない（状態は現在のノードと文字位置だけ）。
+# 検出したキーワードはサジェストのルールに対応付け、セッションのイベントキューから SSE で UI に配信する。
+# API（app/main.py）では照合の状態と配信待ちのイベントを SQLite（SuggestionSessionStore）に置き、
+# マルチワーカー構成でもどのワーカーに届いたリクエストで同じ商談を続けられるようにしている。
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import deque
+
+from .metrics import STAGE_DURATION
+
+_MATCH_TIMER = STAGE_DURATION.labels(stage='keyword_match')
+
+# 既定のサジェストのルール（ATLAS_SUGGESTION_RULES_PATH の JSON で差し替え可能）
+DEFAULT_RULES = [
+    {'id': 'safety', 'keywords': ['安全', '事故', '子供が生まれ', '家族'], 'priority': 2,
+     'message': 'お客様は**安全性**を重視しています。安全装備と家族向けの実績を具体的に紹介してください。'},
+    {'id': 'anxiety', 'keywords': ['不安', '心配', '迷って', '将来の収入'], 'priority': 3,
+     'message': 'お客様が**不安**を口にしています。まず**共感**を示し、懸念を具体的に聞き出してください。'},
+    {'id': 'initial_cost', 'keywords': ['初期費用', '頭金', '最初にかかる', 'まとまったお金'], 'priority': 3,
+     'message': 'お客様は**初期費用**を気にされています。**初期費用ゼロ**のプランを提示して不安を解消してください。'},
+    {'id': 'delivery', 'keywords': ['納期', '納車', 'いつ届', 'すぐ乗', 'どれくらいかかり'], 'priority': 2,
+     'message': '**納期（スピード感）**が重要因子になっています。即納可能な車両を提示しましょう。'},
+    {'id': 'positive', 'keywords': ['ぜひ', '嬉しい', 'いいですね', 'お願いします'], 'priority': 1,
+     'message': '**ポジティブな反応**です！クロージングに向けて条件の確認を進めましょう。'},
+]
+
+# セッションに残す直近のキーワード / サジェストの件数
+HISTORY_SIZE = 50
+
+# API 用のセッションストア（全ワーカーから同じファイルを参照する）
+DB_PATH_ENV = 'ATLAS_SUGGESTION_DB_PATH'
+# セッションは一時的な状態のため、既定ではソースツリーの外（OS の一時ディレクトリ）に置く
+DEFAULT_DB_PATH = os.path.join(tempfile.gettempdir(), 'atlas', 'cockpit_sessions.db')
+# 終了したセッションを、配信中の SSE 接続が残りのイベントを読み切るまで残しておく秒数
+CLOSED_SESSION_GRACE = 60.0
+
+def normalize(text):
+    """ 全角/半角・大文字/小文字の違いをそろえる（照合はこの正規化後の文字列で行う） """
+    return unicodedata.normalize('NFKC', text).lower()
+
+class KeywordAutomaton:
+    """ 複数キーワードを1回の走査で照合する Aho-Corasick オートマトン """
+
+    def __init__(self, keywords):
+        self.keywords = []
+        self.index = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [()]
+        for keyword in keywords:
+            self._insert(normalize(keyword))
+        self._link()
+
+    def _insert(self, keyword):
+        if not keyword or keyword in self.index:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(())
+            state = next_state
+        self.index[keyword] = len(self.keywords)
+        self._outputs[state] = self._outputs[state] + (len(self.keywords),)
+        self.keywords.append(keyword)
+
+    def _link(self):
+        """ 幅優先で失敗リンクを張り、失敗先の出力を各ノードにまとめておく """
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+                pending.append(next_state)
+
+    def scan(self, text, state=0, offset=0):
+        """
+        正規化済みの text を state から走査し、(一致したキーワード番号, 終了位置) のリストと最後の状態を返す。
+        終了位置は offset からの通し番号（キーワードの最後の文字の次の位置）。
+        """
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = []
+        for position, char in enumerate(text, offset + 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                matches.extend((keyword, position) for keyword in outputs[state])
+        return matches, state
+
+class SuggestionEngine:
+    """ サジェストのルール（キーワード → メッセージ）から1つのオートマトンを作る """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = {rule['id']: rule for rule in rules}
+        # 同じルールからは同じ番号のノードを持つオートマトンができるため、状態を共有してよいかの判定に使う
+        self.digest = hashlib.sha256(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+        keywords = [keyword for rule in rules for keyword in rule['keywords']]
+        self.automaton = KeywordAutomaton(keywords)
+        # キーワード番号 -> そのキーワードを持つルールの ID
+        self.keyword_rules = [[] for _ in self.automaton.keywords]
+        for rule in rules:
+            for keyword in rule['keywords']:
+                rule_ids = self.keyword_rules[self.automaton.index[normalize(keyword)]]
+                if rule['id'] not in rule_ids:
+                    rule_ids.append(rule['id'])
+
+    @classmethod
+    def from_file(cls, path):
+        """ [{"id", "keywords", "message", "priority"}, ...] 形式の JSON からルールを読み込む """
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def session(self, history=HISTORY_SIZE):
+        return SuggestionSession(self, history)
+
+class SuggestionSession:
+    """
+    1つの商談の文字起こしストリーム。チャンクを feed するたびに、新しく検出したキーワードと
+    発火したサジェストを返し、SSE 配信用のイベントキューにも積む。
+    ルールは1回の商談で1度だけ発火する（cooldown を指定したルールは、その文字数が経てば再度発火する）。
+    keywords / suggestions には直近 history 件だけを残し、長い商談でもメモリ使用量を一定に保つ。
+    """
+
+    def __init__(self, engine, history=HISTORY_SIZE):
+        self.engine = engine
+        self.keywords = deque(maxlen=history)
+        self.suggestions = deque(maxlen=history)
+        self.events = queue.Queue(maxsize=history)
+        self.closed = False
+        self.last_active = time.monotonic()
+        self._state = 0
+        self._offset = 0
+        self._fired_at = {}
+        self._lock = threading.Lock()
+
+    def feed(self, chunk, end_of_utterance=False):
+        """ 文字起こしの断片を処理する。end_of_utterance=True で発話の区切りとし、次の発話とは連結して照合しない """
+        with _MATCH_TIMER.time(), self._lock:
+            self.last_active = time.monotonic()
+            text = normalize(chunk)
+            automaton = self.engine.automaton
+            matches, self._state = automaton.scan(text, self._state, self._offset)
+            self._offset += len(text)
+            if end_of_utterance:
+                self._state = 0
+
+            detected = []
+            fired = []
+            for keyword_index, end in matches:
+                keyword = automaton.keywords[keyword_index]
+                detected.append({'keyword': keyword, 'start': end - len(keyword), 'end': end})
+                for rule_id in self.engine.keyword_rules[keyword_index]:
+                    if self._should_fire(rule_id, end):
+                        self._fired_at[rule_id] = end
+                        rule = self.engine.rules[rule_id]
+                        fired.append({'rule': rule_id, 'message': rule['message'], 'priority': rule.get('priority', 0),
+                                      'keyword': keyword, 'offset': end})
+            fired.sort(key=lambda suggestion: -suggestion['priority'])
+            self.keywords.extend(detected)
+            self.suggestions.extend(fired)
+
+        for suggestion in fired:
+            self._publish(('suggestion', suggestion))
+        return {'keywords': detected, 'suggestions': fired}
+
+    def snapshot(self):
+        """ 照合の状態（オートマトンのノード・文字位置・ルールごとの発火位置）を返す """
+        with self._lock:
+            return self._state, self._offset, dict(self._fired_at)
+
+    def restore(self, state, offset, fired_at):
+        """ snapshot() で取り出した状態から照合を再開する """
+        with self._lock:
+            self._state, self._offset, self._fired_at = state, offset, dict(fired_at)
+
+    def _should_fire(self, rule_id, end):
+        last = self._fired_at.get(rule_id)
+        if last is None:
+            return True
+        cooldown = self.engine.rules[rule_id].get('cooldown')
+        return cooldown is not None and end - last >= cooldown
+
+    def _publish(self, event):
+        """ SSE の接続が無い間は直近 history 件だけを残し、古いイベントから捨てる """
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.closed = True
+        self._publish(('close', None))
+
+    def listen(self, heartbeat=15.0):
+        """ イベントを (種類, データ) で順に返すジェネレーター。heartbeat 秒ごとに ('heartbeat', None) を返す """
+        while not self.closed:
+            try:
+                event = self.events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield 'heartbeat', None
+                continue
+            if event[0] == 'close':
+                return
+            yield event
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cockpit_sessions (
+    session_id TEXT PRIMARY KEY,
+    rules_digest TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    char_offset INTEGER NOT NULL,
+    fired_at TEXT NOT NULL,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    last_active REAL NOT NULL,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS cockpit_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cockpit_events_session ON cockpit_events (session_id, event_id);
+"""
+
+class SuggestionSessionStore:
+    """
+    API 用の商談セッション管理。照合の状態と配信待ちのイベントを SQLite に置き、プロセス間で共有する。
+    gunicorn のワーカーはリクエストをセッション単位で振り分けられないため、どのワーカーに届いても
+    同じセッションの続きとして処理し、SSE の接続も別のワーカーで発火したサジェストを受け取れるようにする。
+    一定時間操作の無いセッションは破棄する。
+    """
+
+    def __init__(self, engine, path=None, ttl=1800.0, history=HISTORY_SIZE, poll_interval=0.2):
+        self.engine = engine
+        self.path = path or os.environ.get(DB_PATH_ENV) or DEFAULT_DB_PATH
+        self.ttl = ttl
+        self.history = history
+        self.poll_interval = poll_interval
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        self._local = threading.local()
+
+    def _connect(self):
+        # スレッドごとに接続を使い回す（fork 後の子プロセスでは親の接続を使わずに作り直す）
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        """ fn(conn) を1つの書き込みトランザクションで実行する（ワーカー間の同時更新は SQLite のロックで直列化する） """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def _expire(self, conn, now):
+        expired = 'SELECT session_id FROM cockpit_sessions WHERE last_active < ? OR (closed = 1 AND last_active < ?)'
+        params = (now - self.ttl, now - CLOSED_SESSION_GRACE)
+        conn.execute(f'DELETE FROM cockpit_events WHERE session_id IN ({expired})', params)
+        conn.execute(f'DELETE FROM cockpit_sessions WHERE session_id IN ({expired})', params)
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+
+        def insert(conn):
+            self._expire(conn, now)
+            conn.execute(
+                'INSERT INTO cockpit_sessions (session_id, rules_digest, state, char_offset, fired_at, last_active) '
+                'VALUES (?, ?, 0, 0, ?, ?)', (session_id, self.engine.digest, '{}', now))
+
+        self._write(insert)
+        return session_id
+
+    def exists(self, session_id):
+        """ 終了しておらず、期限も切れていないセッションか """
+        row = self._connect().execute(
+            'SELECT last_active FROM cockpit_sessions WHERE session_id = ? AND closed = 0', (session_id,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def feed(self, session_id, chunk, end_of_utterance=False):
+        """ SuggestionSession.feed と同じ結果を返す（セッションが無い場合は None） """
+        now = time.time()
+
+        def update(conn):
+            row = conn.execute(
+                'SELECT rules_digest, state, char_offset, fired_at, last_active FROM cockpit_sessions '
+                'WHERE session_id = ? AND closed = 0', (session_id,)).fetchone()
+            if row is None or now - row[4] > self.ttl:
+                return None
+            digest, state, offset, fired_at, _ = row
+            if digest != self.engine.digest:
+                # ルールが差し替わった場合はノード番号が変わるため、照合を次の文字から始め直す
+                state = 0
+            session = SuggestionSession(self.engine, self.history)
+            session.restore(state, offset, json.loads(fired_at))
+            result = session.feed(chunk, end_of_utterance)
+
+            state, offset, fired_at = session.snapshot()
+            conn.execute(
+                'UPDATE cockpit_sessions SET rules_digest = ?, state = ?, char_offset = ?, fired_at = ?, last_active = ? '
+                'WHERE session_id = ?', (self.engine.digest, state, offset, json.dumps(fired_at), now, session_id))
+            if result['suggestions']:
+                conn.executemany(
+                    'INSERT INTO cockpit_events (session_id, event, data) VALUES (?, ?, ?)',
+                    [(session_id, 'suggestion', json.dumps(suggestion, ensure_ascii=False)) for suggestion in result['suggestions']])
+                # SSE の接続が無い間は直近 history 件だけを残す
+                conn.execute(
+                    'DELETE FROM cockpit_events WHERE session_id = ? AND event_id <= '
+                    '(SELECT event_id FROM cockpit_events WHERE session_id = ? ORDER BY event_id DESC LIMIT 1 OFFSET ?)',
+                    (session_id, session_id, self.history))
+            return result
+
+        return self._write(update)
+
+    def close(self, session_id):
+        """ セッションを終了する。配信中の SSE 接続は残りのイベントを送ってから閉じる """
+        now = time.time()
+
+        def mark_closed(conn):
+            return conn.execute(
+                'UPDATE cockpit_sessions SET closed = 1, last_active = ? WHERE session_id = ? AND closed = 0',
+                (now, session_id)).rowcount > 0
+
+        return self._write(mark_closed)
+
+    def listen(self, session_id, heartbeat=15.0, last_event_id=None):
+        """
+        イベントを (種類, データ, イベントID) で順に返すジェネレーター。heartbeat 秒ごとに ('heartbeat', None, None) を返す。
+        last_event_id（SSE の Last-Event-ID）を省略した場合は、まだどの接続にも送っていないイベントから返す。
+        別のワーカーで発火したイベントも受け取れるよう、共有ストアを poll_interval 秒ごとに確認する。
+        """
+        conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        try:
+            cursor = last_event_id
+            idle = 0.0
+            while True:
+                row = conn.execute(
+                    'SELECT closed, last_active, delivered FROM cockpit_sessions WHERE session_id = ?', (session_id,)).fetchone()
+                if cursor is None:
+                    cursor = 0 if row is None else row[2]
+                events = conn.execute(
+                    'SELECT event_id, event, data FROM cockpit_events WHERE session_id = ? AND event_id > ? ORDER BY event_id',
+                    (session_id, cursor)).fetchall()
+                for event_id, event, data in events:
+                    cursor = event_id
+                    yield event, json.loads(data), event_id
+                if events:
+                    conn.execute('UPDATE cockpit_sessions SET delivered = MAX(delivered, ?) WHERE session_id = ?', (cursor, session_id))
+                    idle = 0.0
+                # 終了・期限切れのセッションは、それまでのイベントを送り切ってから閉じる
+                if row is None or row[0] or time.time() - row[1] > self.ttl:
+                    return
+                if not events:
+                    time.sleep(self.poll_interval)
+                    idle += self.poll_interval
+                    if idle >= heartbeat:
+                        idle = 0.0
+                        yield 'heartbeat', None, None
+        finally:
+            conn.close()
+
+    def __len__(self):
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM cockpit_sessions WHERE closed = 0 AND last_active >= ?', (time.time() - self.ttl,)).fetchone()
+        return row[0]
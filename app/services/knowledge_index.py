@@ -0,0 +1,316 @@
+# app/services/knowledge_index.py
+#
+# AI重政チャット用のナレッジベース検索（文字 n-gram の TF-IDF + 転置インデックス）
+# 質問文を文字 2〜3-gram に分解して疎行列（列ごとの転置リスト）に持ち、言い回しが違っても近い質問の回答を返す。
+# 追加分は小さな差分セグメントに入れ、一定件数たまったら本体に統合する。インデックスは .npz に保存して再利用できる。
+#   python knowledge_index.py qa.csv kb_index.npz   # question / answer 列を持つ CSV からインデックスを作成
+# np.savez の仕様で、保存先の拡張子が .npz でない場合は .npz が付け足される。
+
+import json
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+NGRAM_RANGE = (2, 3)
+# 差分セグメントがこの件数を超えるか、削除済みの行が全体のこの割合を超えたら本体を作り直す
+MERGE_THRESHOLD = 1024
+MAX_DEAD_RATIO = 0.25
+INDEX_FORMAT_VERSION = 1
+# 保存済みインデックスのパス（UI は起動時にここから読み込み、無ければ作成して保存する）
+INDEX_PATH_ENV = 'ATLAS_KB_INDEX_PATH'
+
+_IGNORED_CHARS = re.compile(r'[\s\W_]+')
+
+def normalize(text):
+    """ 全角/半角・大文字/小文字をそろえ、空白と記号を取り除く """
+    return _IGNORED_CHARS.sub('', unicodedata.normalize('NFKC', str(text)).lower())
+
+def char_ngrams(text, ngram_range=NGRAM_RANGE):
+    """ 正規化した文字列の文字 n-gram を列挙する（n-gram が作れない短い文字列はそのまま1語とする） """
+    text = normalize(text)
+    low, high = ngram_range
+    grams = [text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1)]
+    if not grams and text:
+        grams = [text]
+    return grams
+
+def _reserve(array, size):
+    """ size 要素以上を持つ配列を返す（足りなければ倍の大きさで確保し直し、増えた部分は0で埋める） """
+    if len(array) >= size:
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class KnowledgeIndex:
+    """
+    Q&A の検索インデックス。
+    重みは sublinear TF（1 + log tf）× IDF のコサイン類似度。IDF は追加・削除のたびに文書頻度から更新し、
+    文書ベクトルのノルムは次の検索時にまとめて計算し直す。
+    """
+
+    def __init__(self, ngram_range=NGRAM_RANGE):
+        self.ngram_range = tuple(ngram_range)
+        self.vocabulary = {}
+        self.entry_ids = []
+        self.questions = []
+        self.answers = []
+        self._positions = {}
+        self._next_id = 0
+        # 行ごとの n-gram（列番号と sublinear TF）。本体の作り直しと保存に使う
+        self._row_columns = []
+        self._row_weights = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._document_frequency = np.zeros(0, dtype=np.int64)
+        self._n_alive = 0
+        # 本体セグメント（CSC: 列 = n-gram ごとの転置リスト）と差分セグメント
+        self._base = sparse.csc_matrix((0, 0))
+        self._base_squared = sparse.csr_matrix((0, 0))
+        self._delta = None
+        self._idf = None
+        self._norms = None
+
+    def __len__(self):
+        return self._n_alive
+
+    def __contains__(self, entry_id):
+        return entry_id in self._positions
+
+    # --- 追加・削除 ---
+
+    def _vectorize(self, text, grow):
+        """ 文字列を (n-gram の列番号, sublinear TF) に変換する。grow=False では未知の n-gram を無視する """
+        columns = []
+        counts = []
+        for gram, count in Counter(char_ngrams(text, self.ngram_range)).items():
+            column = self.vocabulary.get(gram)
+            if column is None:
+                if not grow:
+                    continue
+                column = self.vocabulary[gram] = len(self.vocabulary)
+            columns.append(column)
+            counts.append(count)
+        return np.array(columns, dtype=np.int64), 1.0 + np.log(np.array(counts, dtype=np.float64))
+
+    def add(self, question, answer, entry_id=None):
+        """ Q&A を1件追加して ID を返す。既存の ID を指定した場合は置き換える """
+        if entry_id is None:
+            entry_id = self._next_id
+        if entry_id in self._positions:
+            self.remove(entry_id)
+        if isinstance(entry_id, int):
+            self._next_id = max(self._next_id, entry_id + 1)
+
+        columns, weights = self._vectorize(question, grow=True)
+        position = len(self.entry_ids)
+        self._positions[entry_id] = position
+        self.entry_ids.append(entry_id)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self._row_columns.append(columns)
+        self._row_weights.append(weights)
+        # 配列は倍々で確保し、1件ずつの追加でも全体をコピーし直さないようにする
+        self._alive = _reserve(self._alive, position + 1)
+        self._alive[position] = True
+        self._document_frequency = _reserve(self._document_frequency, len(self.vocabulary))
+        self._document_frequency[columns] += 1
+        self._n_alive += 1
+        self._delta = None
+        self._idf = None
+        return entry_id
+
+    def add_many(self, items):
+        """ (質問, 回答) の組、または {"question", "answer", "id"} のリストをまとめて追加する """
+        ids = []
+        for item in items:
+            if isinstance(item, dict):
+                ids.append(self.add(item['question'], item['answer'], item.get('id')))
+            else:
+                ids.append(self.add(*item))
+        return ids
+
+    def remove(self, entry_id):
+        """ Q&A を削除する（行は検索対象から外すだけで、作り直しの際に詰める） """
+        position = self._positions.pop(entry_id)
+        self._alive[position] = False
+        self._document_frequency[self._row_columns[position]] -= 1
+        self._n_alive -= 1
+        self._idf = None
+
+    # --- セグメントの構築 ---
+
+    def _matrix(self, start, stop):
+        """ 行 start〜stop の sublinear TF 行列（CSC） """
+        lengths = [len(columns) for columns in self._row_columns[start:stop]]
+        rows = np.repeat(np.arange(stop - start), lengths)
+        columns = np.concatenate(self._row_columns[start:stop]) if lengths else np.zeros(0, dtype=np.int64)
+        weights = np.concatenate(self._row_weights[start:stop]) if lengths else np.zeros(0)
+        return sparse.csc_matrix((weights, (rows, columns)), shape=(stop - start, len(self.vocabulary)))
+
+    def _compact(self):
+        """ 削除済みの行を詰め、全件を本体セグメントに統合する """
+        keep = np.flatnonzero(self._alive[:len(self.entry_ids)])
+        self.entry_ids = [self.entry_ids[i] for i in keep]
+        self.questions = [self.questions[i] for i in keep]
+        self.answers = [self.answers[i] for i in keep]
+        self._row_columns = [self._row_columns[i] for i in keep]
+        self._row_weights = [self._row_weights[i] for i in keep]
+        self._positions = {entry_id: i for i, entry_id in enumerate(self.entry_ids)}
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._set_base(self._matrix(0, len(keep)))
+        self._delta = None
+        self._idf = None
+
+    def _set_base(self, base):
+        self._base = base
+        # ノルムの再計算用に、要素を2乗した行列を持っておく
+        self._base_squared = base.multiply(base).tocsr()
+
+    def _refresh(self):
+        """ 検索前に、必要なら本体の作り直し・差分セグメントの構築・IDF とノルムの再計算を行う """
+        n_rows = len(self.entry_ids)
+        n_base = self._base.shape[0]
+        n_dead = n_rows - self._n_alive
+        if n_rows - n_base > MERGE_THRESHOLD or (n_rows and n_dead / n_rows > MAX_DEAD_RATIO):
+            self._compact()
+            n_rows = n_base = len(self.entry_ids)
+        if self._delta is None:
+            self._delta = self._matrix(n_base, n_rows)
+        if self._idf is None:
+            # sklearn の TfidfVectorizer(smooth_idf=True) と同じ IDF
+            document_frequency = self._document_frequency[:len(self.vocabulary)]
+            self._idf = np.log((1.0 + self._n_alive) / (1.0 + document_frequency)) + 1.0
+            squared_idf = self._idf ** 2
+            delta_squared = self._delta.multiply(self._delta).tocsr()
+            self._norms = np.sqrt(np.concatenate([
+                self._base_squared @ squared_idf[:self._base_squared.shape[1]],
+                delta_squared @ squared_idf[:delta_squared.shape[1]],
+            ]))
+            self._norms[self._norms == 0.0] = 1.0
+
+    # --- 検索 ---
+
+    @staticmethod
+    def _segment_scores(segment, columns, weights):
+        """ 転置リスト（CSC の列）を辿り、クエリに含まれる n-gram だけで内積を計算する """
+        in_range = columns < segment.shape[1]
+        columns, weights = columns[in_range], weights[in_range]
+        starts = segment.indptr[columns]
+        stops = segment.indptr[columns + 1]
+        lengths = stops - starts
+        if lengths.sum() == 0:
+            return np.zeros(segment.shape[0])
+        postings = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+        return np.bincount(
+            segment.indices[postings], weights=segment.data[postings] * np.repeat(weights, lengths),
+            minlength=segment.shape[0])
+
+    def search(self, query, k=3, min_score=0.0):
+        """ クエリに近い質問を類似度の高い順に最大 k 件返す（[{"id", "question", "answer", "score"}, ...]） """
+        if self._n_alive == 0:
+            return []
+        self._refresh()
+        columns, weights = self._vectorize(query, grow=False)
+        # 削除済みの Q&A にしか無い n-gram は、作り直したインデックスと同じく未知の n-gram として扱う
+        live = self._document_frequency[columns] > 0
+        columns, weights = columns[live], weights[live]
+        if len(columns) == 0:
+            return []
+        query_weights = weights * self._idf[columns]
+        query_weights /= np.linalg.norm(query_weights)
+        # 文書側の IDF もここで掛ける（行列は TF のまま持ち、IDF の変化で作り直さずに済むようにする）
+        query_weights *= self._idf[columns]
+
+        scores = np.concatenate([
+            self._segment_scores(self._base, columns, query_weights),
+            self._segment_scores(self._delta, columns, query_weights),
+        ]) / self._norms
+        scores[~self._alive[:len(scores)]] = 0.0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            {'id': self.entry_ids[i], 'question': self.questions[i], 'answer': self.answers[i], 'score': float(scores[i])}
+            for i in top if scores[i] > min_score
+        ]
+
+    def answer(self, query, min_score=0.3):
+        """ 最も近い質問の回答を返す。類似度が min_score 以下なら None """
+        hits = self.search(query, k=1, min_score=min_score)
+        return hits[0] if hits else None
+
+    # --- 保存・読み込み ---
+
+    def save(self, path):
+        """ インデックスを .npz に保存する（読み込み時に質問文を分解し直さずに済む） """
+        self._compact()
+        np.savez_compressed(
+            path,
+            format_version=INDEX_FORMAT_VERSION,
+            ngram_range=np.asarray(self.ngram_range),
+            vocabulary=np.asarray(sorted(self.vocabulary, key=self.vocabulary.get), dtype=str),
+            entries=json.dumps({'ids': self.entry_ids, 'questions': self.questions, 'answers': self.answers}, ensure_ascii=False),
+            next_id=self._next_id,
+            indptr=self._base.indptr, indices=self._base.indices, data=self._base.data,
+            n_rows=len(self.entry_ids),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """ save() で保存したインデックスを読み込む """
+        with np.load(path, allow_pickle=False) as stored:
+            if int(stored['format_version']) != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported knowledge index format: {int(stored['format_version'])}")
+            index = cls(tuple(stored['ngram_range'].tolist()))
+            index.vocabulary = {gram: i for i, gram in enumerate(stored['vocabulary'].tolist())}
+            entries = json.loads(str(stored['entries']))
+            index.entry_ids = entries['ids']
+            index.questions = entries['questions']
+            index.answers = entries['answers']
+            index._next_id = int(stored['next_id'])
+            n_rows = int(stored['n_rows'])
+            index._set_base(sparse.csc_matrix(
+                (stored['data'], stored['indices'], stored['indptr']), shape=(n_rows, len(index.vocabulary))))
+
+        index._positions = {entry_id: i for i, entry_id in enumerate(index.entry_ids)}
+        index._alive = np.ones(n_rows, dtype=bool)
+        index._n_alive = n_rows
+        # 行ごとの n-gram は本体の行列から復元する
+        rows = index._base.tocsr()
+        index._row_columns = [rows.indices[rows.indptr[i]:rows.indptr[i + 1]].astype(np.int64) for i in range(n_rows)]
+        index._row_weights = [rows.data[rows.indptr[i]:rows.indptr[i + 1]] for i in range(n_rows)]
+        index._document_frequency = np.bincount(rows.indices, minlength=len(index.vocabulary)).astype(np.int64)
+        return index
+
+    @classmethod
+    def from_dict(cls, knowledge_base):
+        """ {質問: 回答} の辞書からインデックスを作る """
+        index = cls()
+        index.add_many(knowledge_base.items())
+        return index
+
+def load_or_build(knowledge_base, path=None):
+    """ 保存済みのインデックスがあれば読み込み、無ければ knowledge_base（{質問: 回答}）から作成して保存する """
+    path = path or os.environ.get(INDEX_PATH_ENV)
+    if path and os.path.exists(path):
+        return KnowledgeIndex.load(path)
+    index = KnowledgeIndex.from_dict(knowledge_base)
+    if path:
+        index.save(path)
+    return index
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    source_path, index_path = sys.argv[1:3]
+    qa = pd.read_csv(source_path)
+    index = KnowledgeIndex()
+    index.add_many(zip(qa['question'], qa['answer']))
+    index.save(index_path)
+    print(f"{len(index):,} 件の Q&A から {index_path} を作成しました（n-gram {len(index.vocabulary):,} 種類）")
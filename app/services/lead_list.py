@@ -0,0 +1,67 @@
+# app/services/lead_list.py
+#
+# 商談リスト（UI タブ①）の読み込み・一括スコアリング・絞り込み / 並べ替え / ページ分割
+# スコアリングは score_many の1回で済ませ、UI は query_leads で切り出した1ページ分だけを描画する。
+
+import os
+import pandas as pd
+
+from .prediction_service import REQUIRED_KEYS
+
+# 商談リストのファイル（CSV / Parquet）。未設定の場合は UI 側のサンプルデータを使う
+LEADS_PATH_ENV = 'ATLAS_LEADS_PATH'
+
+def leads_source():
+    """ 商談リストのファイルと、その内容が変わったことを検知するためのキー（パス・更新時刻・サイズ）を返す """
+    path = os.environ.get(LEADS_PATH_ENV)
+    if not path:
+        return None
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def read_leads(path):
+    """ 商談リストを CSV / Parquet から読み込む """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def score_leads(leads, service, score_column='score'):
+    """
+    リード全件を score_many でまとめてスコアリングし、score_column を付けた DataFrame を返す。
+    特徴量に欠損がある行やエラーになった行のスコアは NA になる。
+    """
+    missing = [key for key in REQUIRED_KEYS if key not in leads.columns]
+    if missing:
+        raise ValueError(f"Lead list is missing required columns: {missing}")
+
+    scores = pd.Series(pd.NA, index=leads.index, dtype='Int16')
+    complete = ~leads[REQUIRED_KEYS].isna().any(axis=1)
+    records = leads.loc[complete, REQUIRED_KEYS].to_dict('records')
+    results = service.score_many(records)
+    scores[complete] = pd.array([result.get('score', pd.NA) for result in results], dtype='Int16')
+    return leads.assign(**{score_column: scores})
+
+def query_leads(leads, search='', search_columns=(), min_score=None, score_column='score',
+                sort_by=None, ascending=False, page=1, page_size=20):
+    """
+    絞り込み・並べ替えをまとめて行い、指定ページの行だけを返す。
+    戻り値は (ページの DataFrame, 条件に合う件数, ページ数)。
+    """
+    mask = pd.Series(True, index=leads.index)
+    if search:
+        hit = pd.Series(False, index=leads.index)
+        for column in search_columns:
+            hit |= leads[column].astype(str).str.contains(search, case=False, regex=False)
+        mask &= hit
+    if min_score is not None:
+        mask &= (leads[score_column] >= min_score).fillna(False)
+    matched = leads[mask]
+
+    if sort_by is not None:
+        matched = matched.sort_values(sort_by, ascending=ascending, na_position='last', kind='stable')
+
+    n_matches = len(matched)
+    n_pages = max(1, -(-n_matches // page_size))
+    page = min(max(1, page), n_pages)
+    start = (page - 1) * page_size
+    return matched.iloc[start:start + page_size], n_matches, n_pages
@@ -0,0 +1,425 @@
+# app/services/metrics.py
+#
+# プロセス内のカウンター / ヒストグラムと、Prometheus テキスト形式への出力
+# 本番で常時有効にできるよう、記録はロック1回と数回の比較だけで済むようにしている。
+#
+# マルチワーカー構成（serve.py）では ATLAS_METRICS_DIR を指定し、各ワーカーが自分の値を
+# そのディレクトリのメモリマップファイル（metrics_<pid>.db）にも書き込む。
+# /metrics はどのワーカーに届いても全ファイルを合算して返すため、スクレイプ先のワーカーによって値が変わらない。
+# 終了したワーカーのカウンター / ヒストグラムも合計に残る（単調増加が保たれる）。
+
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# レイテンシ用のバケット（秒）: 50µs 〜 10s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# 共有ファイルの形式: 先頭8バイトに使用済みバイト数、以降は
+# [キーの長さ uint32][値の個数 uint32][キー（UTF-8、8バイト境界まで詰める）][値 float64 × 個数] の繰り返し
+_HEADER = struct.Struct('<I4x')
+_ENTRY_HEADER = struct.Struct('<II')
+_VALUE = struct.Struct('<d')
+_PAIR = struct.Struct('<dd')
+_INITIAL_FILE_SIZE = 1 << 16
+
+def _key(name, labelvalues=()):
+    """ 共有ファイル上のキー（メトリクス名とラベル値） """
+    return json.dumps([name, list(labelvalues)], ensure_ascii=False)
+
+def _padded(size):
+    return (size + 7) & ~7
+
+def _read_values(path):
+    """ 共有ファイルから (キー, 値のリスト) を順に返す """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return
+    used = _HEADER.unpack_from(data, 0)[0]
+    position = _HEADER.size
+    while position < used:
+        key_size, n_values = _ENTRY_HEADER.unpack_from(data, position)
+        position += _ENTRY_HEADER.size
+        key = data[position:position + key_size].decode('utf-8')
+        position += _padded(key_size)
+        yield key, list(struct.unpack_from(f'<{n_values}d', data, position))
+        position += 8 * n_values
+
+class _ValueFile:
+    """ 1プロセス分のメトリクスの値を置くメモリマップファイル（他のプロセスからは読むだけ） """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # 確保した順の (キー, 値の個数)。fork 後の子プロセスで同じ位置に確保し直すために使う
+        self._entries = []
+        self._offsets = {}
+        self._open()
+
+    def _open(self):
+        self.path = os.path.join(self.directory, f'metrics_{os.getpid()}.db')
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(_INITIAL_FILE_SIZE)
+        self._mmap = mmap.mmap(self._file.fileno(), _INITIAL_FILE_SIZE)
+        self._used = _HEADER.size
+        _HEADER.pack_into(self._mmap, 0, self._used)
+
+    def allocate(self, key, n_values):
+        """ キーの領域を確保し、値の先頭位置を返す（確保済みならその位置） """
+        with self._lock:
+            offset = self._offsets.get(key)
+            if offset is None:
+                offset = self._append(key, n_values)
+                self._entries.append((key, n_values))
+            return offset
+
+    def _append(self, key, n_values):
+        encoded = key.encode('utf-8')
+        size = _ENTRY_HEADER.size + _padded(len(encoded)) + 8 * n_values
+        if self._used + size > len(self._mmap):
+            self._grow(self._used + size)
+        position = self._used
+        _ENTRY_HEADER.pack_into(self._mmap, position, len(encoded), n_values)
+        self._mmap[position + _ENTRY_HEADER.size:position + _ENTRY_HEADER.size + len(encoded)] = encoded
+        offset = position + _ENTRY_HEADER.size + _padded(len(encoded))
+        # 使用済みバイト数はエントリを書き終えてから更新する（読み手が書きかけのエントリを見ないように）
+        self._used += size
+        _HEADER.pack_into(self._mmap, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+    def _grow(self, required):
+        size = len(self._mmap)
+        while size < required:
+            size *= 2
+        self._file.truncate(size)
+        # 古いマップは閉じない: 同じファイルの共有マップなので、他スレッドが書き込み中でも値は失われない
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def write(self, offset, value):
+        _VALUE.pack_into(self._mmap, offset, value)
+
+    def write_pair(self, offset, first, second):
+        _PAIR.pack_into(self._mmap, offset, first, second)
+
+    def reopen_after_fork(self):
+        """ fork した子プロセス用に自分の pid のファイルを作り、同じ順にキーを確保し直す（値は0から） """
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._open()
+        for key, n_values in self._entries:
+            self._append(key, n_values)
+
+class _Timer:
+    """ with ブロックの所要時間をヒストグラムに記録する """
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value', '_values', '_offset')
+
+    def __init__(self, values=None, key=None):
+        self._lock = threading.Lock()
+        self.value = 0
+        # マルチプロセスモードでの書き込み先（共有ファイルと値の位置）
+        self._values = values
+        self._offset = None if values is None else values.allocate(key, 1)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+            if self._values is not None:
+                self._values.write(self._offset, self.value)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_upper_bounds', 'counts', 'sum', 'count', '_values', '_offset', '_sum_offset')
+
+    def __init__(self, upper_bounds, values=None, key=None):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # 共有ファイル上の並び: [バケットごとの件数..., sum, count]
+        self._values = values
+        self._offset = None if values is None else values.allocate(key, len(self.counts) + 2)
+        self._sum_offset = None if values is None else self._offset + 8 * len(self.counts)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if self._values is not None:
+                self._values.write(self._offset + 8 * index, self.counts[index])
+                self._values.write_pair(self._sum_offset, self.sum, self.count)
+
+    def time(self):
+        return _Timer(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * len(self.counts)
+        self.sum = 0.0
+        self.count = 0
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), values=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = values
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child(())
+
+    def _new_child(self, labelvalues):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """ ラベル値を固定した子メトリクスを返す（ホットパスではモジュール読み込み時に取得しておく） """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child(key)
+        return child
+
+    def render(self, children=None):
+        """ children を渡した場合は、その {ラベル値: 子メトリクス} を出力する（全ワーカーの合算値など） """
+        children = self._children if children is None else children
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for labelvalues, child in sorted(children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def _new_child(self, labelvalues):
+        if self._values is None:
+            return _CounterChild()
+        return _CounterChild(self._values, _key(self.name, labelvalues))
+
+    def _child_from_values(self, values):
+        child = _CounterChild()
+        child.value = _as_number(values[0])
+        return child
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+    def _render_child(self, labelvalues, child):
+        yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}'
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, values=None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, values)
+
+    def _new_child(self, labelvalues):
+        if self._values is None:
+            return _HistogramChild(self.upper_bounds)
+        return _HistogramChild(self.upper_bounds, self._values, _key(self.name, labelvalues))
+
+    def _child_from_values(self, values):
+        child = _HistogramChild(self.upper_bounds)
+        child.counts = [int(value) for value in values[:-2]]
+        child.sum = values[-2]
+        child.count = int(values[-1])
+        return child
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        return self.labels(**labels).time()
+
+    def _render_child(self, labelvalues, child):
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float('inf'),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, labelvalues)
+        yield f'{self.name}_sum{labels} {_format_value(child.sum)}'
+        yield f'{self.name}_count{labels} {child.count}'
+
+def _as_number(value):
+    """ 共有ファイルの float64 を、整数値なら int として出力する """
+    return int(value) if float(value).is_integer() else value
+
+class MetricsRegistry:
+    """
+    メトリクスの登録と出力。multiprocess_dir を指定すると、値をそのディレクトリの
+    プロセスごとのファイルにも書き込み、出力時は全プロセスのファイルを合算する。
+    """
+
+    def __init__(self, multiprocess_dir=None):
+        self._metrics = []
+        self._collectors = []
+        self.multiprocess_dir = multiprocess_dir
+        self._values = None
+        self._publisher = None
+        self._publisher_pid = None
+        self._stop_publishing = threading.Event()
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+            self._values = _ValueFile(multiprocess_dir)
+            # fork した子プロセス（gunicorn のワーカー）は、親の値を引き継がずに自分のファイルへ書き込む
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._values.reopen_after_fork()
+        for metric in self._metrics:
+            for child in metric._children.values():
+                child._reset()
+        self._publisher = None
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames, values=self._values)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets, values=self._values)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """ 出力時に呼ばれ、(名前, 種類, 説明, 値) のリストを返す関数を登録する（キャッシュ統計など） """
+        self._collectors.append(collector)
+
+    def _collect(self):
+        """ 登録された関数を呼び、マルチプロセスモードでは値を自分のファイルにも書き込む """
+        samples = [sample for collector in self._collectors for sample in collector()]
+        if self._values is not None:
+            for name, _, _, value in samples:
+                self._values.write(self._values.allocate(_key(name), 1), value)
+        return samples
+
+    def publish_collectors(self):
+        """ 登録された関数の値を自分のファイルに書き込む（他のワーカーへのスクレイプにも反映させるため） """
+        if self._values is not None:
+            self._collect()
+
+    def start_publishing(self, interval):
+        """ バックグラウンドスレッドで publish_collectors を定期的に呼ぶ（マルチプロセスモードのみ） """
+        if self._values is None or (self._publisher is not None and self._publisher_pid == os.getpid()):
+            return
+        self._stop_publishing = threading.Event()
+
+        def publish():
+            while not self._stop_publishing.wait(interval):
+                self.publish_collectors()
+
+        self._publisher = threading.Thread(target=publish, name='metrics-publisher', daemon=True)
+        self._publisher_pid = os.getpid()
+        self._publisher.start()
+
+    def stop_publishing(self):
+        """ 定期書き込みを止め、ゲージを0にする（終了したワーカーの値が合計に残らないように） """
+        self._stop_publishing.set()
+        if self._publisher is not None and self._publisher_pid == os.getpid():
+            self._publisher.join()
+        self._publisher = None
+        if self._values is not None:
+            for name, metric_type, _, _ in self._collect():
+                if metric_type == 'gauge':
+                    self._values.write(self._values.allocate(_key(name), 1), 0)
+
+    def _aggregate(self):
+        """ 全プロセスのファイルを読み、キーごとに値を合計する """
+        totals = {}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics_*.db')):
+            try:
+                entries = list(_read_values(path))
+            except (OSError, struct.error):
+                # 作成途中 / 削除されたファイルは次回のスクレイプで読む
+                continue
+            for key, values in entries:
+                total = totals.get(key)
+                totals[key] = values if total is None else [a + b for a, b in zip(total, values)]
+        return totals
+
+    def render(self):
+        """ Prometheus テキスト形式（version 0.0.4）で全メトリクスを出力する """
+        samples = self._collect()
+        totals = self._aggregate() if self._values is not None else None
+        lines = []
+        for metric in self._metrics:
+            if totals is None:
+                lines.extend(metric.render())
+                continue
+            children = {}
+            for key, values in totals.items():
+                name, labelvalues = json.loads(key)
+                if name == metric.name:
+                    children[tuple(labelvalues)] = metric._child_from_values(values)
+            lines.extend(metric.render(children))
+        for name, metric_type, documentation, value in samples:
+            if totals is not None:
+                value = _as_number(totals.get(_key(name), [value])[0])
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry(os.environ.get('ATLAS_METRICS_DIR'))
+
+# --- ATLAS API のメトリクス ---
+REQUESTS = REGISTRY.counter('atlas_requests_total', 'Number of HTTP requests.', ['endpoint'])
+ERRORS = REGISTRY.counter('atlas_request_errors_total', 'Number of failed HTTP requests by error type.', ['endpoint', 'error_type'])
+REQUEST_DURATION = REGISTRY.histogram('atlas_request_duration_seconds', 'HTTP request latency.', ['endpoint'])
+STAGE_DURATION = REGISTRY.histogram('atlas_stage_duration_seconds', 'Latency of each scoring stage.', ['stage'])
+SIMULATIONS_PER_REQUEST = REGISTRY.histogram(
+    'atlas_simulations_per_request', 'Number of what-if scenarios scored per customer.',
+    buckets=(1, 2, 3, 5, 10, 100, 1000, 10000, 100000))
+MICROBATCH_SIZE = REGISTRY.histogram(
+    'atlas_microbatch_size', 'Number of /predict requests coalesced into one scoring call.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
@@ -0,0 +1,146 @@
+# app/services/micro_batcher.py
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """
+    同時に届いたリクエストをキューに溜め、最大バッチサイズ / 最大待ち時間のどちらかに達した時点で
+    まとめて1回でスコアリングし、各呼び出し元の Future を解決するディスパッチャー。
+    """
+
+    def __init__(self, score_many, max_batch_size=64, max_wait_ms=2.0, batch_size_histogram=None, validate=None):
+        # score_many: レコードのリストを受け取り、同じ順序で結果のリストを返す関数
+        self.score_many = score_many
+        # validate: レコードを受け取り、問題があればエラーメッセージを返す関数（不正なレコードはキューに積まず ValueError にする）
+        self.validate = validate
+        # 指定された場合はバッチサイズを metrics.Histogram にも記録する（/metrics 出力用）
+        self.batch_size_histogram = batch_size_histogram
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+        # バッチサイズのヒストグラム（上限が2のべき乗のバケット、最後は max_batch_size）
+        self.bucket_bounds = []
+        bound = 1
+        while bound < max_batch_size:
+            self.bucket_bounds.append(bound)
+            bound *= 2
+        self.bucket_bounds.append(max_batch_size)
+        self.bucket_counts = [0] * len(self.bucket_bounds)
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+
+    def _ensure_started(self):
+        # fork 後の子プロセスにはスレッドが引き継がれないため、プロセスごとに起動し直す
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._stopping = False
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, record):
+        """ レコードをキューに積み、スコアリング結果を受け取る Future を返す """
+        future = Future()
+        error = self.validate(record) if self.validate is not None else None
+        if error is not None:
+            future.set_exception(ValueError(error))
+            return future
+        self._ensure_started()
+        self._queue.put((record, future))
+        return future
+
+    def score(self, record, timeout=30.0):
+        """ submit して結果を待つ（リクエストハンドラー用） """
+        return self.submit(record).result(timeout=timeout)
+
+    def _collect(self):
+        """ 最初の1件を待ち、その後は締め切りまでに届いた分を最大バッチサイズまで集める """
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopping = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._collect()
+            if batch is None:
+                break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        records = [record for record, _ in batch]
+        try:
+            results = self.score_many(records)
+        except Exception:
+            # 1件の不正なレコードで同じバッチの他のリクエストまで失敗させないよう、1件ずつ再実行する
+            self.fallbacks += 1
+            for record, future in batch:
+                try:
+                    future.set_result(self.score_many([record])[0])
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        self._observe(len(batch))
+
+    def _observe(self, size):
+        if self.batch_size_histogram is not None:
+            self.batch_size_histogram.observe(size)
+        self.batches += 1
+        self.items += size
+        for i, bound in enumerate(self.bucket_bounds):
+            if size <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def stop(self, timeout=5.0):
+        """ キューに残っている分を処理してからディスパッチャーを止める """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        """ バッチサイズのヒストグラム（累積）と件数を返す """
+        cumulative = 0
+        histogram = []
+        for bound, count in zip(self.bucket_bounds, self.bucket_counts):
+            cumulative += count
+            histogram.append({'le': bound, 'count': cumulative})
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': round(self.items / self.batches, 3) if self.batches else 0.0,
+            'fallbacks': self.fallbacks,
+            'batch_size_histogram': histogram,
+        }
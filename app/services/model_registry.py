@@ -0,0 +1,204 @@
+# app/services/model_registry.py
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import warnings
+import joblib
+
+# models/ 配下のバージョン付き成果物: atlas_model_<version>.pkl と model_columns_<version>.pkl の組
+_MODEL_FILE_PATTERN = re.compile(r'^atlas_model_(.+)\.pkl$')
+# 稼働させるバージョンを固定したい場合は models/CURRENT にバージョン名を1行で書く
+CURRENT_FILE = 'CURRENT'
+
+logger = logging.getLogger(__name__)
+
+def _file_digest(*paths):
+    """ モデルファイルの内容からダイジェスト（SHA-256の先頭12桁）を算出する """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+def _natural_key(version):
+    """ 'v2' < 'v10' となるように数字部分を数値として比較するソートキー """
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', version)]
+
+def _load_artifact(path):
+    """ 可能ならメモリマップで読み込み、fork したワーカー間でページを共有する """
+    with warnings.catch_warnings():
+        # 圧縮されたファイルはメモリマップできず警告が出るだけなので、通常の読み込みと同じ扱いにする
+        warnings.simplefilter('ignore', UserWarning)
+        return joblib.load(path, mmap_mode='r')
+
+class ModelBundle:
+    """ 1つのバージョンのモデルと、それに紐づく推論用オブジェクト一式 """
+
+    def __init__(self, version, model, model_columns, digest, fingerprint):
+        self.version = version
+        self.model = model
+        self.model_columns = model_columns
+        self.digest = digest
+        self.fingerprint = fingerprint
+        # スコアキャッシュなどで使う、同じバージョン名での上書きも区別できる識別子
+        self.model_version = f"{version}-{digest}"
+
+class ModelRegistry:
+    """
+    models/ 配下のバージョン付きモデルを管理するレジストリ。
+    初回利用時に遅延ロードし、再読み込み時は新しいモデルを完全に読み込んでから参照を差し替える。
+    処理中のリクエストは取得済みの ModelBundle を使い続けるため、旧モデルのまま完了する。
+    """
+
+    def __init__(self, models_dir, on_load=None):
+        self.models_dir = models_dir
+        # ModelBundle を受け取り、推論用の付属物（エンコーダーなど）を準備するフック
+        self.on_load = on_load
+        self._active = None
+        self._listeners = []
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._stop_watching = threading.Event()
+
+    def _paths(self, version):
+        return (
+            os.path.join(self.models_dir, f'atlas_model_{version}.pkl'),
+            os.path.join(self.models_dir, f'model_columns_{version}.pkl'),
+        )
+
+    def _fingerprint(self, version):
+        """ ファイルの更新時刻とサイズ（変更検知用） """
+        stats = [os.stat(path) for path in self._paths(version)]
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def versions(self):
+        """ モデルとカラム情報の両方が揃っているバージョンの一覧を返す """
+        found = []
+        for name in os.listdir(self.models_dir):
+            match = _MODEL_FILE_PATTERN.match(name)
+            if match and os.path.exists(self._paths(match.group(1))[1]):
+                found.append(match.group(1))
+        return sorted(found, key=_natural_key)
+
+    def resolve_version(self):
+        """ 稼働させるバージョンを決める（環境変数 > models/CURRENT > 最新のバージョン） """
+        version = os.environ.get('ATLAS_MODEL_VERSION')
+        if not version:
+            current_path = os.path.join(self.models_dir, CURRENT_FILE)
+            if os.path.exists(current_path):
+                with open(current_path, encoding='utf-8') as f:
+                    version = f.read().strip()
+        if not version:
+            available = self.versions()
+            if not available:
+                raise FileNotFoundError(f"No model artifacts found in {self.models_dir}")
+            version = available[-1]
+        return version
+
+    def load(self, version):
+        """ 指定バージョンを読み込んで ModelBundle を作る（稼働中のモデルは差し替えない） """
+        model_path, columns_path = self._paths(version)
+        if not os.path.exists(model_path) or not os.path.exists(columns_path):
+            raise FileNotFoundError(f"Model version '{version}' not found in {self.models_dir}")
+
+        fingerprint = self._fingerprint(version)
+        bundle = ModelBundle(
+            version=version,
+            model=_load_artifact(model_path),
+            model_columns=_load_artifact(columns_path),
+            digest=_file_digest(model_path, columns_path),
+            fingerprint=fingerprint,
+        )
+        if self.on_load is not None:
+            self.on_load(bundle)
+        return bundle
+
+    def current(self):
+        """ 稼働中の ModelBundle を返す。初回呼び出し時にだけ読み込む """
+        bundle = self._active
+        if bundle is None:
+            with self._load_lock:
+                if self._active is None:
+                    self._swap(self.load(self.resolve_version()))
+                bundle = self._active
+        return bundle
+
+    def reload(self, version=None):
+        """ 新しいモデルを読み込んでから、稼働中のモデルをアトミックに差し替える """
+        with self._load_lock:
+            bundle = self.load(version or self.resolve_version())
+            self._swap(bundle)
+        return bundle
+
+    def pin(self, version):
+        """
+        稼働バージョンを models/CURRENT に書き込んで固定し、このプロセスでも差し替える。
+        各ワーカーの監視スレッドも models/CURRENT を見るため、ロールバックが最新版に戻されず、全ワーカーが同じバージョンに揃う。
+        """
+        override = os.environ.get('ATLAS_MODEL_VERSION')
+        if override and override != version:
+            raise ValueError(f"ATLAS_MODEL_VERSION={override} takes precedence over {CURRENT_FILE}; cannot pin '{version}'")
+        with self._load_lock:
+            # 先に読み込んで、存在しない・壊れたバージョンは CURRENT に書かない
+            bundle = self.load(version)
+            current_path = os.path.join(self.models_dir, CURRENT_FILE)
+            tmp_path = f'{current_path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(version + '\n')
+            os.replace(tmp_path, current_path)
+            self._swap(bundle)
+        return bundle
+
+    def add_listener(self, callback):
+        """ モデル差し替え時に新しい ModelBundle を受け取るコールバックを登録する """
+        self._listeners.append(callback)
+
+    def _swap(self, bundle):
+        # 参照の代入は1命令なので、以降のリクエストは新旧どちらか一方のモデルだけを見る
+        self._active = bundle
+        for callback in self._listeners:
+            callback(bundle)
+
+    def is_loaded(self):
+        return self._active is not None
+
+    def check_for_update(self):
+        """ 稼働バージョンの切り替えやファイルの上書きを検知したら再読み込みする """
+        active = self._active
+        if active is None:
+            return False
+        version = self.resolve_version()
+        if version == active.version and self._fingerprint(version) == active.fingerprint:
+            return False
+        self.reload(version)
+        return True
+
+    def start_watching(self, interval):
+        """ バックグラウンドスレッドで models/ を定期的に監視する """
+        # fork 後の子プロセスには監視スレッドが引き継がれないため、プロセスごとに起動する
+        if self._watcher is not None and self._watcher_pid == os.getpid():
+            return
+        self._stop_watching = threading.Event()
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.check_for_update()
+                except Exception:
+                    # 書き込み途中のファイルなどで失敗しても、旧モデルのまま次回に再試行する
+                    logger.exception("Model reload failed; keeping %s", self._active.version if self._active else None)
+
+        self._watcher = threading.Thread(target=watch, name='model-registry-watcher', daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None and self._watcher_pid == os.getpid():
+            self._watcher.join()
+        self._watcher = None
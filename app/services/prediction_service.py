@@ -1,53 +1,216 @@
 # app/services/prediction_service.py
 
-import pandas as pd
-import joblib
+import math
+import sys
+import warnings
+import numpy as np
 import os # osライブラリをインポート
 
+# 学習と同じ前処理（ml/preprocess.py）を使うため、リポジトリのルートを読み込み先に加える
+_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if _ROOT_DIR not in sys.path:
+    sys.path.append(_ROOT_DIR)
+
+from ml.preprocess import FeatureEncoder, REQUIRED_KEYS, NUMERIC_KEYS, CATEGORICAL_KEYS
+from .simulation_engine import SimulationEngine
+from .forest_engine import CompiledForest
+from .score_cache import ScoreCache
+from .model_registry import ModelRegistry
+from .metrics import STAGE_DURATION, SIMULATIONS_PER_REQUEST
+
+# 学習時はDataFrameだったため、NumPy配列を渡すと出るカラム名の警告を抑止
+# （catch_warnings はスレッドセーフでないため、モジュール読み込み時に一度だけ設定する）
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+# 推論バックエンド: 'sklearn'（predict_proba）または 'compiled'（CompiledForest）
+INFERENCE_BACKENDS = ('sklearn', 'compiled')
+
+# 各処理段階のタイマー（ラベル解決をホットパスから外すため、読み込み時に取得しておく）
+_VALIDATE_TIMER = STAGE_DURATION.labels(stage='validate')
+_ENCODE_TIMER = STAGE_DURATION.labels(stage='encode')
+_CACHE_TIMER = STAGE_DURATION.labels(stage='cache')
+_PREDICT_TIMER = STAGE_DURATION.labels(stage='predict_proba')
+_SIMULATION_TIMER = STAGE_DURATION.labels(stage='simulation_expand')
+_SUMMARIZE_TIMER = STAGE_DURATION.labels(stage='simulation_summarize')
+
+# このファイル自身の場所を基準にした models/ フォルダの絶対パス
+MODELS_DIR = os.path.join(_ROOT_DIR, 'models')
+
 class PredictionService:
-    def __init__(self):
-        # --- パス指定を修正 ---
-        # このファイル自身の場所を基準に、モデルファイルへの絶対パスを構築
-        _service_dir = os.path.dirname(__file__)
-        _model_path = os.path.join(_service_dir, '..', '..', 'models', 'atlas_model_v2.pkl')
-        _columns_path = os.path.join(_service_dir, '..', '..', 'models', 'model_columns_v2.pkl')
-        
-        # 学習済みモデルとカラム情報を、絶対パスで読み込む
-        self.model = joblib.load(_model_path)
-        self.model_columns = joblib.load(_columns_path)
+    def __init__(self, backend=None, models_dir=MODELS_DIR):
+        # 推論バックエンドを選択（環境変数 ATLAS_INFERENCE_BACKEND でも指定可能）
+        self.backend = backend or os.environ.get('ATLAS_INFERENCE_BACKEND', 'sklearn')
+        if self.backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend: '{self.backend}'. Choose from {INFERENCE_BACKENDS}")
+
+        # モデルはここでは読み込まず、初回のスコアリング時にレジストリから遅延ロードする
+        self.registry = ModelRegistry(models_dir, on_load=self._prepare_bundle)
+
+        # スコアキャッシュ（ATLAS_SCORE_CACHE_SIZE=0 で無効化）。モデル差し替え時に全件破棄する
+        self.score_cache = ScoreCache(
+            maxsize=int(os.environ.get('ATLAS_SCORE_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('ATLAS_SCORE_CACHE_TTL', 300)),
+        )
+        self.registry.add_listener(lambda bundle: self.score_cache.bind(bundle.model_version))
+
+    def _prepare_bundle(self, bundle):
+        """ 読み込んだモデルごとにエンコーダー等を一度だけコンパイルしておく """
+        bundle.encoder = FeatureEncoder(bundle.model_columns, NUMERIC_KEYS, CATEGORICAL_KEYS)
+        bundle.simulation_engine = SimulationEngine(bundle.encoder)
+        bundle.compiled_forest = CompiledForest.from_sklearn(bundle.model) if self.backend == 'compiled' else None
+
+    @property
+    def model(self):
+        return self.registry.current().model
+
+    @property
+    def model_columns(self):
+        return self.registry.current().model_columns
+
+    @property
+    def model_version(self):
+        return self.registry.current().model_version
+
+    @property
+    def encoder(self):
+        return self.registry.current().encoder
+
+    def _predict_not_delayed(self, bundle, X):
+        """ 特徴量行列から「遅延しない」確率を算出する """
+        with _PREDICT_TIMER.time():
+            # NaN は sklearn では学習時の分岐先へ、コンパイル済みフォレストでは左へ進むため、
+            # バッチの大きさでスコアが変わらないよう、どちらに渡す前にも断る
+            if not np.isfinite(X).all():
+                raise ValueError("Features contain NaN or infinity")
+            # コンパイル済みフォレストは小さいバッチ向け。大きなバッチは sklearn に任せる
+            if bundle.compiled_forest is not None and len(X) <= bundle.compiled_forest.MAX_ROWS:
+                return bundle.compiled_forest.predict_proba(X)[:, 0]
+            return bundle.model.predict_proba(X)[:, 0]
+
+    def _predict_cached(self, bundle, X):
+        """ キャッシュに無い行だけを1回の予測でまとめて算出し、「遅延しない」確率を返す """
+        if self.score_cache.maxsize <= 0:
+            return self._predict_not_delayed(bundle, X)
+        with _CACHE_TIMER.time():
+            keys = [ScoreCache.make_key(bundle.model_version, row) for row in X]
+            cached = self.score_cache.get_many(keys)
+            probability_not_delayed = np.array([np.nan if value is None else value for value in cached])
+            missing = [i for i, value in enumerate(cached) if value is None]
+
+        if missing:
+            predicted = self._predict_not_delayed(bundle, X[missing])
+            probability_not_delayed[missing] = predicted
+            with _CACHE_TIMER.time():
+                self.score_cache.put_many([keys[i] for i in missing], predicted.tolist())
+        return probability_not_delayed
+
+    def validate(self, customer_data):
+        """ 顧客データを検証し、問題があればエラーメッセージを返す（なければNone） """
+        if not isinstance(customer_data, dict):
+            return "Each record must be a JSON object"
+        missing = [key for key in REQUIRED_KEYS if key not in customer_data]
+        if missing:
+            return f"Missing required keys: {missing}"
+        for key in NUMERIC_KEYS:
+            value = customer_data[key]
+            # NaN / 無限大はエンコード後の行列をそのまま通り、推論経路によってスコアが変わるため受け付けない
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                return f"'{key}' must be a number"
+        return None
 
     def get_atlas_score(self, customer_data):
         """ 単一の顧客データからATLASスコアを算出する """
-        df_customer = pd.DataFrame([customer_data])
-        df_customer_dummies = pd.get_dummies(df_customer, columns=['Residence_Type', 'Guarantor', 'Medical_History'], drop_first=True)
-        df_customer_processed = df_customer_dummies.reindex(columns=self.model_columns, fill_value=0)
-        
-        probability_not_delayed = self.model.predict_proba(df_customer_processed)[:, 0]
+        # リクエストの途中でモデルが差し替わっても、最初に取得したモデルで最後まで処理する
+        bundle = self.registry.current()
+        with _ENCODE_TIMER.time():
+            customer_features = bundle.encoder.encode_one(customer_data).reshape(1, -1)
+
+        probability_not_delayed = self._predict_cached(bundle, customer_features)
         return int(probability_not_delayed[0] * 100)
 
-    def run_simulations(self, base_customer_data):
-        """ What-Ifシミュレーションを実行し、結果を辞書で返す """
-        
-        base_score = self.get_atlas_score(base_customer_data)
-        results = {
-            'base_case': {
-                'score': base_score,
-                'data': base_customer_data
-            }
-        }
-        
+    def score_many(self, records):
+        """
+        複数の顧客データをまとめてエンコードし、1回の predict_proba でスコアを算出する。
+        入力と同じ順序で {'score': int} または {'error': str} のリストを返す。
+        """
+        results = [None] * len(records)
+        valid_indices = []
+        with _VALIDATE_TIMER.time():
+            for i, record in enumerate(records):
+                error = self.validate(record)
+                if error is None:
+                    valid_indices.append(i)
+                else:
+                    results[i] = {'error': error}
+
+        if valid_indices:
+            bundle = self.registry.current()
+            with _ENCODE_TIMER.time():
+                customer_features = bundle.encoder.encode_many([records[i] for i in valid_indices])
+            probability_not_delayed = self._predict_cached(bundle, customer_features)
+            for i, probability in zip(valid_indices, probability_not_delayed):
+                results[i] = {'score': int(probability * 100)}
+
+        return results
+
+    def _simulation_scenarios(self, base_customer_data):
+        """ What-Ifシミュレーションのシナリオ（名前とデータの組）を列挙する """
+        scenarios = [('base_case', base_customer_data)]
+
         if base_customer_data.get('Guarantor') == 'No':
             sim1_data = base_customer_data.copy()
             sim1_data['Guarantor'] = 'Yes'
-            sim1_score = self.get_atlas_score(sim1_data)
-            results['simulation_guarantor'] = {'score': sim1_score, 'data': sim1_data}
-            
+            scenarios.append(('simulation_guarantor', sim1_data))
+
         if base_customer_data.get('Other_Debt_JPY_10k', 0) > 0:
             sim2_data = base_customer_data.copy()
             sim2_data['Other_Debt_JPY_10k'] = 0
-            sim2_score = self.get_atlas_score(sim2_data)
-            results['simulation_no_debt'] = {'score': sim2_score, 'data': sim2_data}
-            
+            scenarios.append(('simulation_no_debt', sim2_data))
+
+        return scenarios
+
+    def run_simulations(self, base_customer_data):
+        """ What-Ifシミュレーションを実行し、結果を辞書で返す """
+        return self.run_simulations_many([base_customer_data])[0]
+
+    def run_simulations_many(self, customers):
+        """
+        複数顧客のWhat-Ifシミュレーションを実行する。
+        全顧客の基準ケースと各シミュレーションを1つの行列にまとめ、1回の予測でスコアリングする。
+        """
+        with _SIMULATION_TIMER.time():
+            scenario_lists = [self._simulation_scenarios(customer) for customer in customers]
+            all_data = [data for scenarios in scenario_lists for _, data in scenarios]
+        for scenarios in scenario_lists:
+            SIMULATIONS_PER_REQUEST.observe(len(scenarios))
+
+        bundle = self.registry.current()
+        with _ENCODE_TIMER.time():
+            customer_features = bundle.encoder.encode_many(all_data)
+        probability_not_delayed = iter(self._predict_cached(bundle, customer_features))
+        return [
+            {name: {'score': int(next(probability_not_delayed) * 100), 'data': data} for name, data in scenarios}
+            for scenarios in scenario_lists
+        ]
+
+    def simulate(self, base_customer_data, grid=None, perturbations=None):
+        """
+        宣言的なグリッド / 個別シナリオを展開し、1回のモデル呼び出しでまとめてスコアリングする。
+        感度カーブと各特徴量の限界効果を含む辞書を返す。
+        """
+        error = self.validate(base_customer_data)
+        if error is not None:
+            raise ValueError(error)
+
+        bundle = self.registry.current()
+        with _SIMULATION_TIMER.time():
+            matrix, plan = bundle.simulation_engine.expand(base_customer_data, grid, perturbations)
+        SIMULATIONS_PER_REQUEST.observe(len(matrix))
+        probability_not_delayed = self._predict_not_delayed(bundle, matrix)
+        with _SUMMARIZE_TIMER.time():
+            results = bundle.simulation_engine.summarize(probability_not_delayed, plan)
+        results['model_version'] = bundle.model_version
+        results['base_case']['data'] = base_customer_data
         return results
 
 # シングルトンインスタンスを作成
@@ -0,0 +1,97 @@
+# app/services/score_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+class ScoreCache:
+    """
+    モデルのバージョンとエンコード済み特徴量ベクトルをキーにした、上限件数付き LRU + TTL のスコアキャッシュ。
+    bind() で紐づけるバージョンが変わると全エントリを破棄する。
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(model_version, row):
+        """ エンコード済みの1行を正規化したキーにする（-0.0 と 0.0 を同一視する） """
+        # 差し替え直前に処理中だったリクエストが旧モデルのスコアを書き込んでも、新モデルでは参照されない
+        return (model_version, (row + 0.0).tobytes())
+
+    def bind(self, model_version):
+        """ キャッシュを指定バージョンのモデルに紐づける。バージョンが変わった場合は全件破棄する """
+        with self._lock:
+            if model_version != self.model_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.model_version = model_version
+
+    def get_many(self, keys):
+        """ キーのリストに対応する値のリストを返す（未登録・期限切れはNone） """
+        if self.maxsize <= 0:
+            self.misses += len(keys)
+            return [None] * len(keys)
+
+        now = self.clock()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values.append(entry[0])
+        return values
+
+    def put_many(self, keys, values):
+        """ キーと値をまとめて登録し、上限を超えた分は古いものから追い出す """
+        if self.maxsize <= 0:
+            return
+
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ キャッシュサイズ調整用の統計情報を返す """
+        lookups = self.hits + self.misses
+        return {
+            'model_version': self.model_version,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,157 @@
+# app/services/simulation_engine.py
+
+import math
+
+import numpy as np
+
+# 1リクエストでスコアリングする行数の上限（グリッド + 個別シナリオ）
+MAX_SIMULATION_ROWS = 100_000
+
+class SimulationEngine:
+    """
+    宣言的なグリッド / 個別シナリオ（perturbations）を1つの特徴量行列に展開し、
+    1回のモデル呼び出し結果から感度カーブと各特徴量の限界効果を集計する。
+    """
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def _axis_length(self, key, spec):
+        """ グリッド1軸分の値の数（range 指定は値を作る前に num の範囲を確認する） """
+        if isinstance(spec, dict):
+            if key not in dict(self.encoder.numeric):
+                raise ValueError(f"Range spec is only allowed for numeric features: '{key}'")
+            try:
+                num = int(spec['num'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Range spec for '{key}' requires numeric 'start', 'stop' and 'num'")
+            if num <= 0 or num > MAX_SIMULATION_ROWS:
+                raise ValueError(f"Range spec 'num' for '{key}' must be between 1 and {MAX_SIMULATION_ROWS}")
+            return num
+        if isinstance(spec, list):
+            return len(spec)
+        raise ValueError(f"Grid values for '{key}' must be a list or a range spec")
+
+    def _axis_values(self, key, spec):
+        """ グリッド1軸分の値リストを作る（リスト、または start/stop/num 指定） """
+        if isinstance(spec, dict):
+            try:
+                start, stop, num = float(spec['start']), float(spec['stop']), int(spec['num'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Range spec for '{key}' requires numeric 'start', 'stop' and 'num'")
+            if not (math.isfinite(start) and math.isfinite(stop)):
+                raise ValueError(f"Range spec for '{key}' requires finite 'start' and 'stop'")
+            values = np.linspace(start, stop, num).tolist()
+        elif isinstance(spec, list):
+            values = spec
+        else:
+            raise ValueError(f"Grid values for '{key}' must be a list or a range spec")
+
+        if not values:
+            raise ValueError(f"Grid values for '{key}' must not be empty")
+        self._check_values(key, values, 'Grid values')
+        if key not in self.encoder.categorical and len(set(values)) != len(values):
+            raise ValueError(f"Grid values for '{key}' must be unique")
+        return values
+
+    def _check_values(self, key, values, label):
+        """ グリッド / 個別シナリオの値の型を確認する（カテゴリ変数は文字列、数値変数は数値） """
+        if key in self.encoder.categorical:
+            if not all(isinstance(value, str) for value in values):
+                raise ValueError(f"{label} for '{key}' must be strings")
+        else:
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+                       for value in values):
+                raise ValueError(f"{label} for '{key}' must be finite numbers")
+
+    def _check_key(self, key):
+        if key not in self.encoder.categorical and key not in dict(self.encoder.numeric):
+            raise ValueError(f"Unknown feature: '{key}'")
+
+    def expand(self, base_customer_data, grid=None, perturbations=None):
+        """
+        基準顧客・個別シナリオ・グリッドを1つの行列に展開する。
+        行の並びは [基準, 個別シナリオ..., グリッド(直積, C順)...]。
+        """
+        grid = grid or {}
+        perturbations = perturbations or []
+        if not isinstance(grid, dict):
+            raise ValueError("'grid' must be an object of feature -> values")
+        if not isinstance(perturbations, list) or not all(isinstance(p, dict) for p in perturbations):
+            raise ValueError("'perturbations' must be a list of objects")
+
+        # 値を作る前に行数を見積もり、上限を超える指定はメモリを確保せずに断る
+        n_grid = 1 if grid else 0
+        for key, spec in grid.items():
+            self._check_key(key)
+            n_grid *= self._axis_length(key, spec)
+        n_rows = 1 + len(perturbations) + n_grid
+        if n_rows > MAX_SIMULATION_ROWS:
+            raise ValueError(f"Simulation too large: {n_rows} rows (max {MAX_SIMULATION_ROWS})")
+
+        axes = {key: self._axis_values(key, spec) for key, spec in grid.items()}
+        for changes in perturbations:
+            for key, value in changes.items():
+                self._check_key(key)
+                self._check_values(key, [value], 'Perturbation values')
+
+        shape = tuple(len(values) for values in axes.values())
+
+        # 基準行を一度だけエンコードし、全行に複製してから差分だけを書き換える
+        matrix = np.tile(self.encoder.encode_one(base_customer_data), (n_rows, 1))
+
+        for i, changes in enumerate(perturbations, start=1):
+            for key, value in changes.items():
+                self.encoder.assign(matrix[i:i + 1], key, value)
+
+        if axes:
+            grid_block = matrix[1 + len(perturbations):]
+            indices = np.indices(shape).reshape(len(shape), -1)
+            for (key, values), index in zip(axes.items(), indices):
+                self.encoder.assign(grid_block, key, np.asarray(values, dtype=object)[index])
+
+        plan = {'perturbations': perturbations, 'axes': axes, 'shape': shape}
+        return matrix, plan
+
+    def summarize(self, probability_not_delayed, plan):
+        """ 1回分の予測結果を、基準スコア・個別シナリオ・グリッド/カーブ/限界効果に分解する """
+        scores = probability_not_delayed * 100
+        base_score = int(scores[0])
+        results = {'base_case': {'score': base_score}}
+
+        perturbations = plan['perturbations']
+        results['perturbations'] = [
+            {'changes': changes, 'score': int(score), 'delta': int(score) - base_score}
+            for changes, score in zip(perturbations, scores[1:1 + len(perturbations)])
+        ]
+
+        axes = plan['axes']
+        if not axes:
+            return results
+
+        grid_scores = scores[1 + len(perturbations):].reshape(plan['shape'])
+        curves = {}
+        marginal_effects = {}
+        for axis, (key, values) in enumerate(axes.items()):
+            other_axes = tuple(a for a in range(len(axes)) if a != axis)
+            curve = grid_scores.mean(axis=other_axes) if other_axes else grid_scores
+            curves[key] = {'values': values, 'scores': np.round(curve, 2).tolist()}
+
+            if key in self.encoder.categorical:
+                # カテゴリ変数: 各値での平均スコアと基準スコアの差
+                marginal_effects[key] = {value: round(float(score) - base_score, 2) for value, score in zip(values, curve)}
+            elif len(values) >= 2:
+                # 数値変数: グリッド全体で平均した、1単位あたりのスコア変化
+                gradient = np.gradient(grid_scores, np.asarray(values, dtype=float), axis=axis)
+                marginal_effects[key] = round(float(gradient.mean()), 6)
+            else:
+                marginal_effects[key] = None
+
+        results['grid'] = {
+            'features': list(axes),
+            'axes': axes,
+            'scores': grid_scores.astype(int).tolist(),
+        }
+        results['curves'] = curves
+        results['marginal_effects'] = marginal_effects
+        return results
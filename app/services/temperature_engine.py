@@ -0,0 +1,244 @@
+# app/services/temperature_engine.py
+#
+# 継続フォローリスト（UI タブ④）の顧客温度計
+# 料金ページの閲覧・電話・メール開封などの接触イベントから、顧客ごとの「熱意」を時間減衰付きの合計として保持する。
+#   熱意(t) = Σ 重み_i × exp(-λ (t - t_i))     （λ = ln2 / 半減期。イベントが無い期間はそのまま冷めていく）
+# これを時刻に依存しないキー log_heat = ln Σ 重み_i × exp(λ t_i) として保存すると、
+#   ・新しいイベントの反映は log_heat ← logaddexp(log_heat, ln 重み + λ t) の O(1) の更新で済み
+#   ・どの時刻でも 熱意(t) = exp(log_heat - λ t) なので、温度の高い順 = log_heat の大きい順になる
+# ため、log_heat のインデックスだけで「今いちばん熱い / 冷めている顧客 N 人」を全件を読まずに取り出せる。
+# 保存先は SQLite（ATLAS_TEMPERATURE_DB_PATH。未設定の場合はメモリ上）で、イベントはまとめて1トランザクションで反映する。
+
+import itertools
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DB_PATH_ENV = 'ATLAS_TEMPERATURE_DB_PATH'
+# 熱意が半分になるまでの日数（変更すると保存済みの log_heat と整合しなくなるため、DB ごとに固定する）
+HALF_LIFE_DAYS = 14.0
+# イベント種別ごとの重み（熱意への寄与）
+EVENT_WEIGHTS = {
+    'page_view': 3.0,
+    'email_open': 3.0,
+    'email_click': 8.0,
+    'pricing_page_view': 15.0,
+    'call': 20.0,
+    'meeting': 30.0,
+    'inquiry': 40.0,
+}
+# 担当者との接触とみなすイベント（「最終接触から」の表示に使う）
+CONTACT_EVENTS = ('call', 'meeting', 'inquiry')
+# 熱意を 0〜100 点の温度に変換する尺度（熱意がこの値のとき約63点）
+TEMPERATURE_SCALE = 50.0
+# 1トランザクションで反映するイベント数
+BATCH_SIZE = 50_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customer_temperature (
+    customer_id TEXT PRIMARY KEY,
+    customer_name TEXT,
+    log_heat REAL NOT NULL,
+    event_count INTEGER NOT NULL,
+    last_event_at REAL NOT NULL,
+    last_event_type TEXT NOT NULL,
+    last_contact_at REAL,
+    last_pricing_view_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_customer_temperature_log_heat ON customer_temperature (log_heat);
+CREATE TABLE IF NOT EXISTS temperature_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# 集約済みのイベントを既存の値に重ねる（SET の右辺はすべて更新前の値を参照する）
+_UPSERT = """
+INSERT INTO customer_temperature
+    (customer_id, customer_name, log_heat, event_count, last_event_at, last_event_type, last_contact_at, last_pricing_view_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (customer_id) DO UPDATE SET
+    customer_name = COALESCE(excluded.customer_name, customer_name),
+    log_heat = logaddexp(log_heat, excluded.log_heat),
+    event_count = event_count + excluded.event_count,
+    last_event_type = CASE WHEN excluded.last_event_at >= last_event_at THEN excluded.last_event_type ELSE last_event_type END,
+    last_event_at = MAX(last_event_at, excluded.last_event_at),
+    last_contact_at = MAX(COALESCE(last_contact_at, excluded.last_contact_at), COALESCE(excluded.last_contact_at, last_contact_at)),
+    last_pricing_view_at = MAX(COALESCE(last_pricing_view_at, excluded.last_pricing_view_at),
+                               COALESCE(excluded.last_pricing_view_at, last_pricing_view_at))
+"""
+
+_COLUMNS = ['customer_id', 'customer_name', 'log_heat', 'event_count', 'last_event_at', 'last_event_type',
+            'last_contact_at', 'last_pricing_view_at']
+
+def _logaddexp(a, b):
+    return float(np.logaddexp(a, b))
+
+def _to_epoch(values):
+    """ UNIX 秒（数値）または日時（文字列 / datetime）を UNIX 秒の float 配列にする """
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(np.float64).to_numpy()
+    timestamps = pd.to_datetime(values, utc=True)
+    return (timestamps - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+
+def _batches(events, batch_size):
+    """ DataFrame / dict のイテラブルを batch_size 行ずつの DataFrame に分ける """
+    if isinstance(events, pd.DataFrame):
+        for start in range(0, len(events), batch_size):
+            yield events.iloc[start:start + batch_size]
+        return
+    events = iter(events)
+    while True:
+        records = list(itertools.islice(events, batch_size))
+        if not records:
+            return
+        yield pd.DataFrame(records)
+
+def follow_up_insight(temperature, days_since_event, days_since_pricing_view):
+    """ 温度と直近の行動から、次の一手のヒントを返す """
+    if temperature >= 50 and days_since_pricing_view is not None and days_since_pricing_view <= 7:
+        return "料金ページを閲覧済。**再アプローチの好機！**"
+    if temperature >= 50:
+        return "関心が高まっています。**早めの連絡を推奨。**"
+    if days_since_event >= 21:
+        return "アクセスが途絶えています。**冷却期間を推奨。**"
+    return "反応が落ち着いています。**情報提供で関係を維持しましょう。**"
+
+class TemperatureEngine:
+    """ 接触イベントをまとめて取り込み、顧客ごとの時間減衰付きの熱意を SQLite に保持する """
+
+    def __init__(self, path=None, half_life_days=HALF_LIFE_DAYS, event_weights=EVENT_WEIGHTS):
+        self.path = path or os.environ.get(DB_PATH_ENV) or ':memory:'
+        self.half_life_days = half_life_days
+        self.decay_rate = math.log(2) / (half_life_days * 86400.0)
+        self.event_weights = dict(event_weights)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.create_function('logaddexp', 2, _logaddexp, deterministic=True)
+        if self.path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA cache_size=-65536')
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._check_half_life()
+
+    def _check_half_life(self):
+        """ log_heat は半減期に依存するため、DB 作成時の半減期と異なる設定では開かない """
+        row = self._conn.execute("SELECT value FROM temperature_meta WHERE key = 'half_life_days'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO temperature_meta VALUES ('half_life_days', ?)", (repr(self.half_life_days),))
+        elif float(row[0]) != self.half_life_days:
+            raise ValueError(f"{self.path} was built with half_life_days={row[0]}, not {self.half_life_days}")
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM customer_temperature').fetchone()[0]
+
+    def ingest(self, events, batch_size=BATCH_SIZE):
+        """
+        接触イベントを取り込み、反映した件数を返す。
+        events は customer_id / event_type / occurred_at（UNIX 秒または日時）と、任意で customer_name / weight を持つ
+        DataFrame か dict のイテラブル。weight を省略したイベントには event_type の既定の重みを使う。
+        """
+        total = 0
+        for batch in _batches(events, batch_size):
+            total += self._ingest_batch(batch)
+        return total
+
+    def _ingest_batch(self, batch):
+        """ バッチ内のイベントを顧客ごとに1行へ集約してから、まとめて upsert する """
+        missing = [key for key in ('customer_id', 'event_type', 'occurred_at') if key not in batch.columns]
+        if missing:
+            raise ValueError(f"Events are missing required fields: {missing}")
+        frame = pd.DataFrame({
+            'customer_id': batch['customer_id'].astype(str).to_numpy(),
+            'customer_name': batch['customer_name'].to_numpy() if 'customer_name' in batch.columns else None,
+            'event_type': batch['event_type'].astype(str).to_numpy(),
+            'occurred_at': _to_epoch(batch['occurred_at']),
+        })
+        weights = frame['event_type'].map(self.event_weights)
+        if 'weight' in batch.columns:
+            weights = pd.Series(batch['weight'].to_numpy(dtype=np.float64), index=frame.index).fillna(weights)
+        unknown = frame.loc[weights.isna(), 'event_type'].unique().tolist()
+        if unknown:
+            raise ValueError(f"Unknown event types without 'weight': {unknown}")
+        if (weights <= 0).any():
+            raise ValueError("Event weights must be positive (silence is represented by decay)")
+
+        # log-sum-exp を顧客ごとに計算する（最大値を引いてから exp を取り、桁あふれを防ぐ）
+        frame['term'] = np.log(weights.to_numpy(dtype=np.float64)) + self.decay_rate * frame['occurred_at'].to_numpy()
+        # 主キー順に upsert すると B-tree の同じページへの書き込みがまとまり、大きな DB でも速い
+        grouped = frame.groupby('customer_id', sort=True)
+        frame['shifted'] = np.exp(frame['term'] - grouped['term'].transform('max'))
+        frame['contact_at'] = frame['occurred_at'].where(frame['event_type'].isin(CONTACT_EVENTS))
+        frame['pricing_at'] = frame['occurred_at'].where(frame['event_type'] == 'pricing_page_view')
+        latest = frame.loc[grouped['occurred_at'].idxmax(), ['customer_id', 'event_type']].set_index('customer_id')['event_type']
+        rows = grouped.agg(
+            customer_name=('customer_name', 'last'),
+            max_term=('term', 'max'),
+            total=('shifted', 'sum'),
+            event_count=('term', 'size'),
+            last_event_at=('occurred_at', 'max'),
+            last_contact_at=('contact_at', 'max'),
+            last_pricing_view_at=('pricing_at', 'max'),
+        )
+        rows['log_heat'] = rows['max_term'] + np.log(rows['total'])
+        rows['last_event_type'] = latest
+        rows = rows.reset_index()[_COLUMNS].astype(object)
+        rows = rows.where(rows.notna(), None)
+
+        with self._lock, self._conn:
+            self._conn.executemany(_UPSERT, rows.itertuples(index=False, name=None))
+        return len(frame)
+
+    def _frame(self, rows, now):
+        """ 保存値を、時刻 now 時点の熱意・温度と経過日数に変換する """
+        df = pd.DataFrame(rows, columns=_COLUMNS)
+        heat = np.exp(df['log_heat'].to_numpy(dtype=np.float64) - self.decay_rate * now)
+        df['heat'] = heat
+        df['temperature'] = np.rint(100.0 * -np.expm1(-heat / TEMPERATURE_SCALE)).astype(int)
+        for column, days in (('last_event_at', 'days_since_event'), ('last_contact_at', 'days_since_contact'),
+                             ('last_pricing_view_at', 'days_since_pricing_view')):
+            df[days] = (now - pd.to_numeric(df[column])) / 86400.0
+        df['insight'] = [
+            follow_up_insight(t, e, None if pd.isna(p) else p)
+            for t, e, p in zip(df['temperature'], df['days_since_event'], df['days_since_pricing_view'])
+        ]
+        return df
+
+    def ranking(self, n=10, hottest=True, now=None):
+        """ 時刻 now（既定: 現在）で温度が高い（hottest=False なら低い）順に n 人を返す。log_heat のインデックスで上位だけを読む """
+        now = time.time() if now is None else now
+        order = 'DESC' if hottest else 'ASC'
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(_COLUMNS)} FROM customer_temperature ORDER BY log_heat {order} LIMIT ?', (n,)).fetchall()
+        return self._frame(rows, now)
+
+    def get(self, customer_ids, now=None):
+        """ 指定した顧客の現在の温度を返す（イベントの無い顧客は含まれない） """
+        now = time.time() if now is None else now
+        customer_ids = [str(customer_id) for customer_id in customer_ids]
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(_COLUMNS)} FROM customer_temperature WHERE customer_id IN ({", ".join("?" * len(customer_ids))})',
+                customer_ids).fetchall()
+        return self._frame(rows, now)
+
+if __name__ == '__main__':
+    # python temperature_engine.py events.csv temperature.db
+    events_path, db_path = sys.argv[1:3]
+    engine = TemperatureEngine(db_path)
+    n_events = 0
+    for chunk in pd.read_csv(events_path, chunksize=BATCH_SIZE):
+        n_events += engine.ingest(chunk)
+    print(f"{n_events:,} 件のイベントを取り込みました（顧客 {len(engine):,} 人）")
+    print(engine.ranking(10)[['customer_id', 'customer_name', 'temperature', 'insight']].to_string(index=False))
@@ -0,0 +1,229 @@
+# bench/run_benchmarks.py
+#
+# スコアリング・シミュレーション・学習の各経路のベンチマーク
+#   python bench/run_benchmarks.py                  # 計測して bench/results/ に保存し、baseline と比較
+#   python bench/run_benchmarks.py --save-baseline  # 計測結果を bench/baseline.json として保存
+#   python bench/run_benchmarks.py --quick          # 件数を減らした短時間版
+#   python bench/run_benchmarks.py --baseline ci/baseline.json   # 別の baseline と比較（ATLAS_BENCH_BASELINE でも指定可能）
+#
+# bench/baseline.json はリポジトリに含めている計測結果で、計測したマシンの情報を meta に持つ。
+# 実行環境の meta（platform / cpu_count / python）が baseline と異なる場合は比較の前に警告を出す。
+# CI では同じランナーで --save-baseline した結果をキャッシュしておき、--baseline で渡して比較する。
+#
+# スコアキャッシュは無効にして計測する（同じ顧客の繰り返しでキャッシュに当たると実処理を測れないため）
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'app'))
+os.environ.setdefault('ATLAS_SCORE_CACHE_SIZE', '0')
+warnings.filterwarnings('ignore', category=UserWarning)
+
+from bench.synthetic import synthetic_customers, synthetic_training_frame
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+# 計測環境の違いとして比較する meta の項目
+HARDWARE_KEYS = ('platform', 'cpu_count', 'python')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+def measure(fn, repeat, warmup=1, items=1):
+    """ fn を repeat 回実行し、1回あたりの所要時間（ミリ秒）の統計を返す """
+    for _ in range(warmup):
+        fn()
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    timings_ms = timings * 1000.0
+    return {
+        'repeat': repeat,
+        'items': items,
+        'mean_ms': float(timings_ms.mean()),
+        'min_ms': float(timings_ms.min()),
+        'p50_ms': float(np.percentile(timings_ms, 50)),
+        'p95_ms': float(np.percentile(timings_ms, 95)),
+        'p99_ms': float(np.percentile(timings_ms, 99)),
+        'items_per_sec': float(items * repeat / timings.sum()),
+    }
+
+def bench_service(results, backend, args):
+    from services.prediction_service import PredictionService
+
+    service = PredictionService(backend=backend)
+    customers = synthetic_customers(max(args.batch_sizes), seed=1)
+    single = customers[0]
+
+    results[f'{backend}.get_atlas_score'] = measure(lambda: service.get_atlas_score(single), args.repeat)
+    results[f'{backend}.run_simulations'] = measure(lambda: service.run_simulations(single), args.repeat)
+    for size in args.batch_sizes:
+        batch = customers[:size]
+        repeat = max(3, min(args.repeat, 100_000 // size))
+        results[f'{backend}.score_many[{size}]'] = measure(lambda: service.score_many(batch), repeat, items=size)
+
+def bench_flask(results, args):
+    from main import app
+
+    client = app.test_client()
+    customers = synthetic_customers(args.requests, seed=2)
+    client.post('/predict', json=customers[0])
+
+    timings = np.empty(len(customers))
+    start_all = time.perf_counter()
+    for i, customer in enumerate(customers):
+        start = time.perf_counter()
+        response = client.post('/predict', json=customer)
+        timings[i] = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict failed: {response.get_json()}")
+    elapsed = time.perf_counter() - start_all
+
+    timings_ms = timings * 1000.0
+    results['flask./predict'] = {
+        'repeat': len(customers),
+        'items': 1,
+        'mean_ms': float(timings_ms.mean()),
+        'min_ms': float(timings_ms.min()),
+        'p50_ms': float(np.percentile(timings_ms, 50)),
+        'p95_ms': float(np.percentile(timings_ms, 95)),
+        'p99_ms': float(np.percentile(timings_ms, 99)),
+        'items_per_sec': float(len(customers) / elapsed),
+    }
+
+def bench_train(results, args):
+    from ml.train import train_model
+
+    for scale in args.train_scales:
+        df_full = synthetic_training_frame(14 * scale, seed=3)
+        with tempfile.TemporaryDirectory() as output_dir:
+            results[f'train_model[{len(df_full)}]'] = measure(
+                lambda: train_model(df_full, output_dir=output_dir), repeat=1, warmup=0, items=len(df_full))
+
+def bench_assign(results, args):
+    import pandas as pd
+    from services.assignment_service import assign_leads
+
+    rng = np.random.default_rng(4)
+    specialties = ['若年層・単身者', '主婦・ファミリー層', '高価格帯・経営者']
+    attributes = np.array(['32歳/フリーランス', '45歳/主婦', '28歳/会社員(IT)', '55歳/自営業(飲食)'])
+    for n_leads, n_reps in args.assign_sizes:
+        scores = rng.integers(0, 100, n_leads)
+        lead_attributes = rng.choice(attributes, n_leads)
+        reps = pd.DataFrame({'specialty': rng.choice(specialties, n_reps), 'base_rate': rng.uniform(0.3, 0.6, n_reps)})
+        capacity = -(-n_leads // n_reps)
+        results[f'assign_leads[{n_leads}x{n_reps}]'] = measure(
+            lambda: assign_leads(scores, lead_attributes, reps, capacity), repeat=3, warmup=0, items=n_leads)
+
+def compare(results, baseline, threshold):
+    """ baseline と p50 を比較し、threshold 倍を超えて遅くなったものを回帰として返す """
+    regressions = []
+    print(f"\n{'benchmark':<40}{'p50 (ms)':>14}{'baseline':>14}{'ratio':>10}")
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            print(f"{name:<40}{result['p50_ms']:>14.3f}{'-':>14}{'-':>10}")
+            continue
+        ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else float('inf')
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{name:<40}{result['p50_ms']:>14.3f}{base['p50_ms']:>14.3f}{ratio:>10.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+def hardware_mismatch(meta, baseline_meta):
+    """ baseline と計測環境が異なる meta の項目を (項目, 今回, baseline) のリストで返す """
+    return [(key, meta.get(key), baseline_meta.get(key)) for key in HARDWARE_KEYS if meta.get(key) != baseline_meta.get(key)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATLAS スコアリング/学習ベンチマーク")
+    parser.add_argument('--quick', action='store_true', help="件数を減らした短時間版を実行する")
+    parser.add_argument('--repeat', type=int, default=200, help="単発計測の繰り返し回数")
+    parser.add_argument('--requests', type=int, default=1000, help="/predict に送るリクエスト数")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000, 10_000, 1_000_000])
+    parser.add_argument('--train-scales', type=int, nargs='+', default=[1, 100, 1000],
+                        help="シードデータ（14件）に対する学習データの倍率")
+    parser.add_argument('--backends', nargs='+', default=['sklearn', 'compiled'])
+    parser.add_argument('--assign-sizes', type=lambda size: tuple(map(int, size.split('x'))), nargs='+',
+                        default=[(1000, 10), (50_000, 200)], help="担当者割り当ての規模（リード数x担当者数）")
+    parser.add_argument('--only', nargs='+', choices=['service', 'flask', 'train', 'assign'],
+                        default=['service', 'flask', 'train', 'assign'])
+    parser.add_argument('--threshold', type=float, default=1.2, help="回帰とみなす p50 の悪化倍率")
+    parser.add_argument('--baseline', default=os.environ.get('ATLAS_BENCH_BASELINE', BASELINE_PATH),
+                        help="比較 / 保存に使う baseline（既定: ATLAS_BENCH_BASELINE または bench/baseline.json）")
+    parser.add_argument('--save-baseline', action='store_true', help="結果を --baseline のパスに保存する")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat = 20
+        args.requests = 100
+        args.batch_sizes = [1, 100, 10_000]
+        args.train_scales = [1, 100]
+        args.assign_sizes = [(1000, 10), (10_000, 50)]
+    return args
+
+def main():
+    args = parse_args()
+    results = {}
+    if 'service' in args.only:
+        for backend in args.backends:
+            bench_service(results, backend, args)
+    if 'flask' in args.only:
+        bench_flask(results, args)
+    if 'train' in args.only:
+        bench_train(results, args)
+    if 'assign' in args.only:
+        bench_assign(results, args)
+
+    import sklearn
+    report = {
+        'meta': {
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'args': {key: value for key, value in vars(args).items() if key not in ('save_baseline', 'baseline')},
+        },
+        'results': results,
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    result_path = os.path.join(RESULTS_DIR, f"bench_{dt.datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {result_path}")
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for key, current, expected in hardware_mismatch(report['meta'], baseline.get('meta', {})):
+            print(f"警告: 計測環境が baseline と異なります（{key}: {current} / baseline: {expected}）。比較は参考値です")
+        regressions = compare(results, baseline, args.threshold)
+    else:
+        print(f"baseline がありません: {args.baseline}（--save-baseline で作成すると、次回から回帰を検出します）")
+        compare(results, {}, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"baseline を更新しました: {args.baseline}")
+
+    if regressions:
+        print(f"\n性能回帰を検出しました: {regressions}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# bench/synthetic.py
+#
+# ベンチマーク用の合成データ生成
+# ml/train.py のシードデータ（14件）をリサンプリングし、数値項目にノイズを加えて任意の件数に拡大する
+
+import numpy as np
+import pandas as pd
+
+RESIDENCE_TYPES = ['Own_House', 'Rental', 'Family_House', 'Company_House']
+MEDICAL_HISTORIES = ['なし', '高血圧', '糖尿病']
+
+def synthetic_training_frame(n_rows, seed=0):
+    """ load_seed_data() と同じカラム構成の学習用DataFrameを n_rows 件生成する """
+    from ml.train import load_seed_data
+
+    rng = np.random.default_rng(seed)
+    seed_df = load_seed_data()
+    df = seed_df.iloc[rng.integers(0, len(seed_df), n_rows)].reset_index(drop=True)
+
+    df['申込番号'] = np.arange(1, n_rows + 1)
+    df['Age'] = np.clip(df['Age'] + rng.integers(-3, 4, n_rows), 20, 80)
+    df['Years_at_Work'] = np.clip(df['Years_at_Work'] + rng.integers(-2, 3, n_rows), 0, 45)
+    df['Annual_Income_JPY_10k'] = (df['Annual_Income_JPY_10k'] * rng.normal(1.0, 0.1, n_rows)).round().astype(int)
+    df['Other_Debt_JPY_10k'] = (df['Other_Debt_JPY_10k'] * rng.normal(1.0, 0.2, n_rows)).clip(lower=0).round().astype(int)
+    return df
+
+def synthetic_customers(n_rows, seed=0):
+    """ /predict に送る形式の顧客データ（辞書）のリストを n_rows 件生成する """
+    rng = np.random.default_rng(seed)
+    columns = {
+        'Age': rng.integers(20, 70, n_rows).tolist(),
+        'Residence_Type': rng.choice(RESIDENCE_TYPES, n_rows).tolist(),
+        'Years_at_Work': rng.integers(0, 40, n_rows).tolist(),
+        'Annual_Income_JPY_10k': rng.integers(200, 1500, n_rows).tolist(),
+        'Other_Debt_JPY_10k': (rng.integers(0, 300, n_rows) * (rng.random(n_rows) < 0.7)).tolist(),
+        'Guarantor': rng.choice(['Yes', 'No'], n_rows).tolist(),
+        'Medical_History': rng.choice(MEDICAL_HISTORIES, n_rows).tolist(),
+        'Payment_Rate': np.round(rng.uniform(0.6, 1.0, n_rows), 3).tolist(),
+    }
+    return pd.DataFrame(columns).to_dict('records')
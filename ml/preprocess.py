@@ -0,0 +1,190 @@
+# ml/preprocess.py
+#
+# 学習（ml/train.py）と推論（app/services/prediction_service.py）で共有する前処理
+# 特徴量の定義・カテゴリのエンコード・Payment_Rate とラベルの算出・大きなファイルのチャンク読み込み
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# 予測に必要な入力キーとカテゴリ変数
+REQUIRED_KEYS = ['Age', 'Residence_Type', 'Years_at_Work', 'Annual_Income_JPY_10k', 'Other_Debt_JPY_10k', 'Guarantor', 'Medical_History', 'Payment_Rate']
+NUMERIC_KEYS = ['Age', 'Years_at_Work', 'Annual_Income_JPY_10k', 'Other_Debt_JPY_10k', 'Payment_Rate']
+CATEGORICAL_KEYS = ['Residence_Type', 'Guarantor', 'Medical_History']
+
+# カテゴリ変数の水準（先頭が基準カテゴリで、get_dummies(drop_first=True) と同じくカラムを持たない）
+CATEGORY_LEVELS = {
+    'Residence_Type': ['Company_House', 'Family_House', 'Own_House', 'Rental'],
+    'Guarantor': ['No', 'Yes'],
+    'Medical_History': ['なし', '糖尿病', '高血圧'],
+}
+
+# 学習データのカラム
+ID_COLUMN = '申込番号'
+LABEL_COLUMN = 'is_delayed'
+APPLICANT_COLUMNS = [ID_COLUMN] + [key for key in REQUIRED_KEYS if key != 'Payment_Rate']
+PAYMENT_COLUMNS = [ID_COLUMN, 'Claim_Count', 'Payment_Count']
+
+def merge_category_levels(values_by_key, category_levels=CATEGORY_LEVELS):
+    """
+    既定の水準に、学習データに現れた新しい値を追加した水準を返す。
+    基準カテゴリ（先頭）は既定のまま固定し、新しい値は既定の水準の後ろに並べる（既存のカラム位置を変えない）。
+    """
+    merged = {}
+    for key in CATEGORICAL_KEYS:
+        known = list(category_levels[key])
+        new_values = sorted(str(value) for value in values_by_key.get(key, ()) if str(value) not in known)
+        merged[key] = known + new_values
+    return merged
+
+def scan_category_levels(path, chunksize, category_levels=CATEGORY_LEVELS):
+    """ 学習ファイルのカテゴリ列だけをチャンク単位で読み、データに現れた値を含む水準を返す """
+    seen = {key: set() for key in CATEGORICAL_KEYS}
+    for chunk in iter_chunks(path, chunksize, CATEGORICAL_KEYS):
+        for key in CATEGORICAL_KEYS:
+            seen[key].update(chunk[key].dropna().unique())
+    return merge_category_levels(seen, category_levels)
+
+def build_model_columns(category_levels=CATEGORY_LEVELS):
+    """ 学習・推論で使う特徴量カラムの並び（数値 → 各カテゴリの基準以外の水準） """
+    columns = list(NUMERIC_KEYS)
+    for key in CATEGORICAL_KEYS:
+        columns.extend(f"{key}_{level}" for level in category_levels[key][1:])
+    return pd.Index(columns)
+
+class FeatureEncoder:
+    """
+    model_columns から一度だけコンパイルする特徴量エンコーダー。
+    pandas の get_dummies を使わず、各カテゴリ値を直接カラム位置に対応付けて NumPy 配列を埋める。
+    """
+
+    def __init__(self, model_columns, numeric_keys=NUMERIC_KEYS, categorical_keys=CATEGORICAL_KEYS):
+        self.columns = list(model_columns)
+        self.n_features = len(self.columns)
+        offsets = {column: i for i, column in enumerate(self.columns)}
+
+        # 数値特徴量: (キー, カラム位置)
+        self.numeric = [(key, offsets[key]) for key in numeric_keys if key in offsets]
+
+        # カテゴリ特徴量: キー -> {値: カラム位置}
+        # 学習時に drop_first で落ちた基準カテゴリや未知の値は対応表に無く、全て0のままになる
+        self.categorical = {}
+        for key in categorical_keys:
+            prefix = f"{key}_"
+            self.categorical[key] = {
+                column[len(prefix):]: i for i, column in enumerate(self.columns)
+                if column.startswith(prefix)
+            }
+
+    def encode_one(self, record, out=None):
+        """ 単一の顧客データを1行の特徴量ベクトルに変換する """
+        row = np.zeros(self.n_features) if out is None else out
+        for key, offset in self.numeric:
+            row[offset] = record[key]
+        for key, value_offsets in self.categorical.items():
+            offset = value_offsets.get(record[key])
+            if offset is not None:
+                row[offset] = 1.0
+        return row
+
+    def encode_many(self, records):
+        """ 顧客データのリストを特徴量行列に変換する（カラム単位でまとめて書き込む） """
+        n_rows = len(records)
+        matrix = np.zeros((n_rows, self.n_features))
+        for key, offset in self.numeric:
+            matrix[:, offset] = np.fromiter((record[key] for record in records), dtype=np.float64, count=n_rows)
+        for key, value_offsets in self.categorical.items():
+            self._set_categorical(matrix, value_offsets, (record[key] for record in records))
+        return matrix
+
+    def encode_frame(self, df, dtype=np.float64, category_levels=None):
+        """
+        DataFrame（学習データのチャンクなど）を特徴量行列に変換する。カテゴリは列ごとに一括で対応付ける。
+        category_levels を渡した場合、その水準に無い値（基準カテゴリとして扱われてしまう値）があれば警告する。
+        """
+        matrix = np.zeros((len(df), self.n_features), dtype=dtype)
+        for key, offset in self.numeric:
+            matrix[:, offset] = df[key].to_numpy(dtype=dtype)
+        for key, value_offsets in self.categorical.items():
+            offsets = df[key].map(value_offsets).to_numpy(dtype=np.float64)
+            hit = ~np.isnan(offsets)
+            matrix[np.flatnonzero(hit), offsets[hit].astype(np.intp)] = 1.0
+            if category_levels is not None and not hit.all():
+                self._warn_unmapped(key, df[key][~hit], category_levels[key])
+        return matrix
+
+    @staticmethod
+    def _warn_unmapped(key, values, levels):
+        unmapped = values[values.notna() & ~values.isin(levels)]
+        if len(unmapped):
+            counts = unmapped.value_counts()
+            warnings.warn(
+                f"'{key}' has {len(unmapped):,} values not in {levels}, encoded as the base category "
+                f"'{levels[0]}': {counts.head(10).to_dict()}", stacklevel=3)
+
+    def assign(self, matrix, key, values):
+        """ 特徴量行列の指定キーを、行ごとの値（またはスカラー）でまとめて書き換える """
+        if key in self.categorical:
+            value_offsets = self.categorical[key]
+            matrix[:, list(value_offsets.values())] = 0.0
+            values = np.broadcast_to(np.asarray(values, dtype=object), (matrix.shape[0],))
+            self._set_categorical(matrix, value_offsets, values)
+        else:
+            offset = dict(self.numeric)[key]
+            matrix[:, offset] = values
+        return matrix
+
+    @staticmethod
+    def _set_categorical(matrix, value_offsets, values):
+        """ 行ごとのカテゴリ値に対応するカラムに1を立てる（対応表に無い値は何もしない） """
+        offsets = np.fromiter((value_offsets.get(value, -1) for value in values), dtype=np.intp, count=matrix.shape[0])
+        hit = offsets >= 0
+        matrix[np.flatnonzero(hit), offsets[hit]] = 1.0
+
+def compute_payment_rate(df):
+    """ 支払い率（支払回数 / 請求回数）。請求実績が無い場合は 1.0 とする """
+    return (df['Payment_Count'] / df['Claim_Count']).fillna(1.0)
+
+def label_delayed(df):
+    """ 遅延ラベル。is_delayed 列があればそれを使い、無ければ支払回数が請求回数に満たない申込を遅延とする """
+    if LABEL_COLUMN in df.columns:
+        return df[LABEL_COLUMN].astype(np.int8)
+    return (df['Payment_Count'] < df['Claim_Count']).astype(np.int8)
+
+def prepare_training_frame(df_applicants, df_payments=None):
+    """
+    申込データに支払い実績（申込番号で集計済み）を結合し、Payment_Rate とラベルを付けたDataFrameを返す。
+    df_applicants に Claim_Count / Payment_Count が含まれる場合は df_payments を省略できる。
+    """
+    df = df_applicants
+    if df_payments is not None:
+        df = df.join(df_payments, on=ID_COLUMN)
+    df = df.assign(Payment_Rate=compute_payment_rate(df))
+    return df, label_delayed(df)
+
+def iter_chunks(path, chunksize, columns=None):
+    """ CSV / Parquet を chunksize 行ずつ DataFrame で読み込むジェネレーター（必要なカラムだけを読む） """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [column for column in columns if column in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        usecols = None if columns is None else (lambda column: column in columns)
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+
+def aggregate_payments(path, chunksize):
+    """ 支払い履歴ファイルを申込番号ごとの請求回数・支払回数の合計に集約する（チャンクごとに集計して結合） """
+    partials = []
+    for chunk in iter_chunks(path, chunksize, PAYMENT_COLUMNS):
+        partials.append(chunk.groupby(ID_COLUMN)[['Claim_Count', 'Payment_Count']].sum())
+        # 部分集計が溜まりすぎないよう、適宜まとめ直す
+        if len(partials) >= 16:
+            partials = [pd.concat(partials).groupby(level=0).sum()]
+    if not partials:
+        return pd.DataFrame(columns=['Claim_Count', 'Payment_Count'])
+    return pd.concat(partials).groupby(level=0).sum()
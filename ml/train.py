@@ -1,17 +1,27 @@
 # ml/train.py
 
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 import joblib
-import os
 
-def train_model():
+# `python ml/train.py` で直接実行した場合も ml パッケージを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.preprocess import (
+    APPLICANT_COLUMNS, CATEGORICAL_KEYS, LABEL_COLUMN, FeatureEncoder, aggregate_payments,
+    build_model_columns, iter_chunks, merge_category_levels, prepare_training_frame, scan_category_levels,
+)
+
+def load_seed_data():
     """
-    データからAIモデルを学習し、models/ フォルダに保存する関数
+    学習用のシードデータ（14件の申込と支払い実績）を、結合・ラベル付け済みのDataFrameで返す関数
     """
-    print("モデルの学習を開始します...")
-
-    # --- データの準備 ---
     base_data = {
         '申込番号': [3, 4, 5, 6, 7, 28, 35, 41, 48, 51, 55, 60, 65, 70],
         'Age': [46, 48, 51, 34, 54, 30, 40, 25, 50, 60, 28, 39, 45, 58],
@@ -31,29 +41,111 @@ def train_model():
     df_new = pd.DataFrame(new_data)
     df_full = pd.merge(df, df_new, on='申込番号')
     delayed_ids = [7, 28, 41, 48, 51, 55, 65]
-    df_full['is_delayed'] = df_full['申込番号'].apply(lambda x: 1 if x in delayed_ids else 0)
-
-    # --- 特徴量の作成 ---
-    df_full['Payment_Rate'] = (df_full['Payment_Count'] / df_full['Claim_Count']).fillna(1.0)
-    
-    X = df_full.drop(columns=['申込番号', 'is_delayed', 'Claim_Count', 'Payment_Count'])
-    y = df_full['is_delayed']
-    
-    X_dummies = pd.get_dummies(X, columns=['Residence_Type', 'Guarantor', 'Medical_History'], drop_first=True)
-    
-    # --- モデル学習 ---
-    model = RandomForestClassifier(random_state=42)
-    model.fit(X_dummies, y)
-    
-    # --- モデルの保存 ---
+    df_full['is_delayed'] = df_full['申込番号'].isin(delayed_ids).astype(int)
+    return df_full
+
+def fit_model(X, y, n_estimators=100, n_jobs=-1, max_samples=None):
+    """ ランダムフォレストを学習する（木は n_jobs 並列で構築する） """
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs, max_samples=max_samples)
+    model.fit(X, y)
+    # 推論時は単一行のリクエストが中心で、並列化のオーバーヘッドの方が大きいため1スレッドに戻して保存する
+    model.n_jobs = None
+    return model
+
+def save_model(model, model_columns, output_dir='models', version='v2'):
+    """ モデルとカラム情報を models/ フォルダに保存する """
     # modelsフォルダがなければ作成
-    if not os.path.exists('models'):
-        os.makedirs('models')
-        
-    joblib.dump(model, 'models/atlas_model_v2.pkl')
-    joblib.dump(X_dummies.columns, 'models/model_columns_v2.pkl')
-    
-    print("モデル『atlas_model_v2.pkl』が models/ フォルダに保存されました。")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    joblib.dump(model, os.path.join(output_dir, f'atlas_model_{version}.pkl'))
+    joblib.dump(model_columns, os.path.join(output_dir, f'model_columns_{version}.pkl'))
+
+    print(f"モデル『atlas_model_{version}.pkl』が {output_dir}/ フォルダに保存されました。")
+
+def train_model(df_full=None, output_dir='models', version='v2', n_jobs=-1):
+    """
+    データからAIモデルを学習し、models/ フォルダに保存する関数
+    df_full を省略した場合はシードデータで学習する
+    """
+    print("モデルの学習を開始します...")
+
+    # --- データの準備 ---
+    if df_full is None:
+        df_full = load_seed_data()
+
+    # --- 特徴量の作成（推論と同じ ml.preprocess のエンコーダーを使う） ---
+    df_features, y = prepare_training_frame(df_full)
+    # カテゴリの水準はデータから作る（既定に無い値も基準カテゴリに潰さず、カラムを追加する）
+    category_levels = merge_category_levels({key: df_features[key].dropna().unique() for key in CATEGORICAL_KEYS})
+    model_columns = build_model_columns(category_levels)
+    X = FeatureEncoder(model_columns).encode_frame(df_features, dtype=np.float32, category_levels=category_levels)
+
+    # --- モデル学習・保存 ---
+    model = fit_model(X, y.to_numpy(), n_jobs=n_jobs)
+    save_model(model, model_columns, output_dir, version)
+    return model
+
+def train_from_files(applicants_path, payments_path=None, chunksize=500_000, output_dir='models', version='v2',
+                     n_estimators=100, n_jobs=-1, max_samples=None, work_dir=None):
+    """
+    大きな申込データ / 支払い履歴（CSV または Parquet）をチャンク単位で読み込んで学習する関数
+    各チャンクは float32 の特徴量行列に変換して作業ファイルに追記し、学習はメモリマップ経由で行うため、
+    メモリに載るのは集計済みの支払い実績と1チャンク分のデータだけで済む。
+    """
+    print("モデルの学習を開始します（チャンク読み込み）...")
+    payments = aggregate_payments(payments_path, chunksize) if payments_path else None
+
+    # 特徴量のカラムを決めるため、先にカテゴリ列だけを読んで水準を集める
+    category_levels = scan_category_levels(applicants_path, chunksize)
+    model_columns = build_model_columns(category_levels)
+    encoder = FeatureEncoder(model_columns)
+    columns = APPLICANT_COLUMNS + [LABEL_COLUMN] + ([] if payments is not None else ['Claim_Count', 'Payment_Count'])
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        features_path = os.path.join(tmp_dir, 'features.f32')
+        labels = []
+        n_rows = 0
+        with open(features_path, 'wb') as features_file:
+            for chunk in iter_chunks(applicants_path, chunksize, columns):
+                df_features, y = prepare_training_frame(chunk, payments)
+                features = encoder.encode_frame(df_features, dtype=np.float32, category_levels=category_levels)
+                features_file.write(features.tobytes())
+                labels.append(y.to_numpy())
+                n_rows += len(df_features)
+                print(f"  {n_rows:,} 件を読み込みました")
+
+        if n_rows == 0:
+            raise ValueError(f"No training rows found in {applicants_path}")
+        X = np.memmap(features_path, dtype=np.float32, mode='r', shape=(n_rows, encoder.n_features))
+        y = np.concatenate(labels)
+
+        model = fit_model(X, y, n_estimators=n_estimators, n_jobs=n_jobs, max_samples=max_samples)
+        del X
+
+    save_model(model, model_columns, output_dir, version)
+    return model
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATLAS モデルの学習")
+    parser.add_argument('--applicants', help="申込データ（CSV / Parquet）。省略時はシードデータで学習する")
+    parser.add_argument('--payments', help="支払い履歴（申込番号, Claim_Count, Payment_Count。CSV / Parquet）")
+    parser.add_argument('--chunksize', type=int, default=500_000, help="1回に読み込む行数")
+    parser.add_argument('--version', default='v2', help="保存するモデルのバージョン名")
+    parser.add_argument('--output-dir', default='models')
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--n-jobs', type=int, default=-1, help="木を並列に構築するプロセス数（-1 で全コア）")
+    parser.add_argument('--max-samples', type=float, help="各木のブートストラップに使う行の割合（大規模データ向け）")
+    parser.add_argument('--work-dir', help="特徴量の作業ファイルを置くディレクトリ")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    train_model()
\ No newline at end of file
+    args = parse_args()
+    if args.applicants:
+        train_from_files(
+            args.applicants, args.payments, chunksize=args.chunksize, output_dir=args.output_dir,
+            version=args.version, n_estimators=args.n_estimators, n_jobs=args.n_jobs,
+            max_samples=args.max_samples, work_dir=args.work_dir,
+        )
+    else:
+        train_model(output_dir=args.output_dir, version=args.version, n_jobs=args.n_jobs)
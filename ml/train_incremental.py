@@ -0,0 +1,157 @@
+# ml/train_incremental.py
+#
+# 商談結果の記録ストア（app/services/capture_store.py）を使った夜間の追加学習
+#   python ml/train_incremental.py                      # 前回以降の商談結果で、成約モデルに木を追加する
+#   python ml/train_incremental.py --trees-per-run 30 --max-trees 300
+#
+# 学習するのは商談が成約するかどうかを予測する「成約モデル」で、与信スコア（/predict）の ATLAS モデルとは別の成果物
+# （models/deal/deal_model_<version>.pkl と deal_model_columns_<version>.pkl）として保存する。
+# 商談の結果は返済の遅延とは別の事象のため、ATLAS モデル（is_delayed）や models/CURRENT には一切触れない。
+# 学習ラベルは capture_store.OUTCOME_LABELS（見送り → 0、成約 → 1）。
+#
+# 全データで作り直す代わりに、前回の実行以降に追記された記録（capture_id > watermark）だけを読み込み、
+# 既存の成約モデルに warm_start で新しい木を追加する（既存の木はそのまま残す）。
+# 木の数が max_trees を超えた分は古い木から外すため、モデルの大きさと推論時間は一定に保たれ、
+# 古い傾向は徐々に新しい商談結果で置き換わっていく。1回の処理量は前回以降の記録の件数だけで決まる。
+# 成約モデルがまだ無い初回は、その時点の記録から trees_per_run 本の木で作る。
+
+import argparse
+import os
+import re
+import sys
+
+import joblib
+import numpy as np
+
+# `python ml/train_incremental.py` で直接実行した場合も ml / app パッケージを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.preprocess import CATEGORICAL_KEYS, REQUIRED_KEYS, FeatureEncoder, build_model_columns, merge_category_levels
+from ml.train import fit_model
+from app.services.capture_store import OUTCOME_LABELS, CaptureStore
+from app.services.model_registry import _natural_key
+
+# 成約モデルの保存先（models/ 直下に置くと ATLAS モデルのレジストリと紛らわしいため、サブディレクトリに分ける）
+DEAL_MODEL_SUBDIR = 'deal'
+_DEAL_MODEL_FILE_PATTERN = re.compile(r'^deal_model_(?!columns_)(.+)\.pkl$')
+FIRST_VERSION = 'v1'
+
+def next_version(version):
+    """ 'v2' -> 'v3' のように末尾の数字を1つ進めたバージョン名（数字が無ければ '-2' を付ける） """
+    match = re.match(r'^(.*?)(\d+)$', version)
+    if match is None:
+        return f'{version}-2'
+    return f'{match.group(1)}{int(match.group(2)) + 1}'
+
+def deal_model_paths(deal_dir, version):
+    """ 成約モデルのバージョンに対応する (モデル, カラム情報) のファイルパス """
+    return (os.path.join(deal_dir, f'deal_model_{version}.pkl'),
+            os.path.join(deal_dir, f'deal_model_columns_{version}.pkl'))
+
+def latest_deal_version(deal_dir):
+    """ 保存済みの成約モデルのうち最新のバージョン名（まだ無ければ None） """
+    try:
+        names = os.listdir(deal_dir)
+    except FileNotFoundError:
+        return None
+    versions = [match.group(1) for match in map(_DEAL_MODEL_FILE_PATTERN.match, names) if match]
+    return max(versions, key=_natural_key) if versions else None
+
+def save_deal_model(model, model_columns, deal_dir, version):
+    """ 成約モデルとカラム情報を保存する """
+    os.makedirs(deal_dir, exist_ok=True)
+    model_path, columns_path = deal_model_paths(deal_dir, version)
+    joblib.dump(model, model_path)
+    joblib.dump(model_columns, columns_path)
+
+def build_model_columns_from(captures):
+    """ 初回の学習用に、記録に現れたカテゴリの水準からカラムを作る """
+    records = [features for features in captures['features'] if all(features.get(key) is not None for key in REQUIRED_KEYS)]
+    return build_model_columns(merge_category_levels({key: [record[key] for record in records] for key in CATEGORICAL_KEYS}))
+
+def build_training_rows(captures, model_columns):
+    """ 記録を特徴量行列とラベルに変換する。特徴量が欠けている記録は除外し、(X, y, 除外件数) を返す """
+    complete = [
+        i for i, features in enumerate(captures['features'])
+        if all(features.get(key) is not None for key in REQUIRED_KEYS)
+    ]
+    records = [captures['features'].iloc[i] for i in complete]
+    X = FeatureEncoder(model_columns).encode_many(records).astype(np.float32)
+    y = captures['outcome'].iloc[complete].map(OUTCOME_LABELS).to_numpy(dtype=np.int64)
+    return X, y, len(captures) - len(complete)
+
+def add_trees(model, X, y, n_trees, max_trees, n_jobs=-1):
+    """ 既存の成約モデルに X, y で学習した n_trees 本の木を追加し、max_trees を超えた分は古い木から外す """
+    n_existing = len(model.estimators_)
+    model.set_params(warm_start=True, n_estimators=n_existing + n_trees, n_jobs=n_jobs)
+    model.fit(X, y)
+    if len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    # 推論時は1スレッドに戻して保存する（ml/train.py の fit_model と同じ）
+    model.n_jobs = None
+    return model
+
+def run(capture_path=None, models_dir='models', base_version=None, version=None, trees_per_run=20,
+        max_trees=300, min_rows=20, n_jobs=-1):
+    """ 前回以降の商談結果で成約モデルを追加学習し、保存したバージョン名を返す（学習しなかった場合は None） """
+    store = CaptureStore(capture_path)
+    # 書き込みに失敗して退避されていた記録も、読み込む前に DB へ戻しておく
+    store.replay_fallback()
+    watermark = store.training_watermark()
+    captures = store.read_since(watermark)
+    if len(captures) == 0:
+        print(f"新しい商談結果はありません（取り込み済み: capture_id {watermark} まで）")
+        return None
+
+    deal_dir = os.path.join(models_dir, DEAL_MODEL_SUBDIR)
+    base_version = base_version or latest_deal_version(deal_dir)
+    if base_version is None:
+        model = None
+        model_columns = build_model_columns_from(captures)
+    else:
+        model_path, columns_path = deal_model_paths(deal_dir, base_version)
+        model = joblib.load(model_path)
+        model_columns = joblib.load(columns_path)
+
+    X, y, n_skipped = build_training_rows(captures, model_columns)
+    print(f"capture_id {watermark + 1}〜{captures['capture_id'].max()}: {len(y):,} 件を読み込みました（特徴量の欠損で除外 {n_skipped:,} 件）")
+    # 件数が少ない、または片方の結果しか無い場合は学習せず、次回に持ち越す（watermark は進めない）
+    if len(y) < min_rows or len(np.unique(y)) < len(OUTCOME_LABELS):
+        print(f"学習に必要な記録が揃っていないため、次回に持ち越します（最低 {min_rows} 件・成約と見送りの両方が必要）")
+        return None
+
+    if model is None:
+        version = version or FIRST_VERSION
+        model = fit_model(X, y, n_estimators=trees_per_run, n_jobs=n_jobs)
+    else:
+        if list(model.classes_) != sorted(OUTCOME_LABELS.values()):
+            raise ValueError(f"Deal model {base_version} has classes {list(model.classes_)}, expected {sorted(OUTCOME_LABELS.values())}")
+        version = version or next_version(base_version)
+        add_trees(model, X, y, trees_per_run, max_trees, n_jobs=n_jobs)
+    save_deal_model(model, model_columns, deal_dir, version)
+
+    # モデルを保存してから watermark を進める（途中で落ちた場合は次回同じ記録から学習し直す）
+    store.record_training_run(int(captures['capture_id'].max()), len(y), base_version or '', version)
+    if base_version is None:
+        print(f"成約モデル {version}（{len(model.estimators_)} 本）を作成し、{deal_dir}/ に保存しました")
+    else:
+        print(f"成約モデル {base_version} に {trees_per_run} 本の木を追加し、{version}（{len(model.estimators_)} 本）として保存しました")
+    return version
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="商談結果による成約モデルの追加学習")
+    parser.add_argument('--captures', help="商談結果の記録ストア（既定: ATLAS_CAPTURE_DB_PATH または data/captures.db）")
+    parser.add_argument('--models-dir', default='models', help="成約モデルは <models-dir>/deal/ に保存する")
+    parser.add_argument('--base-version', help="追加学習の元にするバージョン（既定: 最新の成約モデル）")
+    parser.add_argument('--version', help="保存するバージョン名（既定: 元のバージョンの次の番号）")
+    parser.add_argument('--trees-per-run', type=int, default=20, help="1回の実行で追加する木の数")
+    parser.add_argument('--max-trees', type=int, default=300, help="モデルに残す木の上限（超えた分は古い木から外す）")
+    parser.add_argument('--min-rows', type=int, default=20, help="学習に必要な最低件数（未満の場合は次回に持ち越す）")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="木を並列に構築するプロセス数（-1 で全コア）")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    run(args.captures, args.models_dir, args.base_version, args.version, args.trees_per_run,
+        args.max_trees, args.min_rows, args.n_jobs)
@@ -2,6 +2,14 @@ import streamlit as st
 import pandas as pd
 import time
 import random
+import math
+from app.services.lead_list import leads_source, read_leads, score_leads, query_leads
+from app.services.assignment_service import assign_leads, conversion_matrix
+from app.services.knowledge_index import load_or_build
+from app.services.keyword_detector import SuggestionEngine
+from app.services.temperature_engine import TemperatureEngine
+from app.services.capture_store import CaptureStore
+from ml.preprocess import REQUIRED_KEYS
 
 # --- Streamlit Appの基本設定 ---
 st.set_page_config(layout="wide", page_title="AI重政 最終デモ")
@@ -13,7 +21,15 @@ def get_mock_master_data():
     leads = pd.DataFrame({
         "customer_name": ["田中 圭様", "鈴木 一恵様", "高橋 誠様", "伊藤 沙織様"],
         "customer_attributes": ["32歳/フリーランス", "45歳/主婦", "28歳/会社員(IT)", "55歳/自営業(飲食)"],
-        "customer_score": [68, 75, 85, 62],
+        # 顧客スコアは保存せず、以下の特徴量から ATLAS モデルで算出する
+        "Age": [32, 45, 28, 55],
+        "Residence_Type": ["Rental", "Own_House", "Rental", "Own_House"],
+        "Years_at_Work": [3, 0, 5, 20],
+        "Annual_Income_JPY_10k": [450, 300, 600, 700],
+        "Other_Debt_JPY_10k": [80, 0, 0, 150],
+        "Guarantor": ["No", "Yes", "No", "No"],
+        "Medical_History": ["なし", "なし", "なし", "高血圧"],
+        "Payment_Rate": [0.95, 1.0, 1.0, 0.9],
     })
     # 担当者リスト
     sales_reps = pd.DataFrame({
@@ -23,21 +39,118 @@ def get_mock_master_data():
     })
     # ② 商談コックピット用のデータ
     conversation_flow = [
-        {"speaker": "お客様", "line": "子供が生まれたばかりで、安全な車を探しているんです。", "ai_suggestion": "お客様のニーズ（Why）をヒアリング中です..."},
-        {"speaker": "お客様", "line": "ただ、フリーランスなので、将来の収入に少し不安があって…。初期費用はかけたくないんですよね。", "ai_suggestion": "【検知: `安全`, `不安`, `初期費用`】\n\nお客様は**安全性**と**初期費用**を気にされています。**共感**を示しつつ、**初期費用ゼロ**のプランを提示して不安を解消してください。"},
-        {"speaker": "担当者", "line": "（AIの提案に基づき）お子様のお誕生おめでとうございます！…", "ai_suggestion": "お客様の反応を観察してください..."},
-        {"speaker": "お客様", "line": "え、初期費用ゼロ！ぜひお願いします。ちなみに、納車まではどれくらいかかりますか？", "ai_suggestion": "【検知: `初期費用ゼロ`, `嬉しい`, `納期`】\n\n**ポジティブな反応**です！次に**納期（スピード感）**が重要因子になっています。即納可能な車両を提示しましょう。"},
+        {"speaker": "お客様", "line": "子供が生まれたばかりで、安全な車を探しているんです。"},
+        {"speaker": "お客様", "line": "ただ、フリーランスなので、将来の収入に少し不安があって…。初期費用はかけたくないんですよね。"},
+        {"speaker": "担当者", "line": "（AIの提案に基づき）お子様のお誕生おめでとうございます！…"},
+        {"speaker": "お客様", "line": "え、初期費用ゼロ！ぜひお願いします。ちなみに、納車まではどれくらいかかりますか？"},
     ]
     tezawari_tags = ["#価格に敏感", "#納期を重視", "#家族のために安全性を求めている", "#クルマに詳しい", "#とにかく乗りたい気持ちが強い"]
     knowledge_base = {
         "類似顧客の成功例は？": "はい。過去の類似フリーランス顧客15名中8名が成約しています。",
         "このお客様の最大の懸念点は？": "分析によると、このお客様の最大の懸念は『初期費用』です。次に『納期の速さ』を重視される傾向があります。"
     }
-    # ④ 継続フォローリスト
-    following_leads = pd.DataFrame({ "customer_name": ["渡辺 徹様", "山本 裕子様"], "last_contact": ["15日前", "28日前"], "thermometer_after": [70, 30], "ai_insight": ["料金ページを閲覧済。**再アプローチの好機！**", "アクセスが途絶えています。**冷却期間を推奨。**"] })
-    return leads, sales_reps, conversation_flow, tezawari_tags, knowledge_base, following_leads
+    # ④ 継続フォローリスト用の接触イベント（何日前に発生したか）
+    following_events = pd.DataFrame({
+        "customer_id": ["F001"] * 5 + ["F002"] * 2,
+        "customer_name": ["渡辺 徹様"] * 5 + ["山本 裕子様"] * 2,
+        "event_type": ["call", "email_open", "pricing_page_view", "pricing_page_view", "page_view", "call", "page_view"],
+        "days_ago": [15, 6, 3, 1, 1, 28, 26],
+    })
+    return leads, sales_reps, conversation_flow, tezawari_tags, knowledge_base, following_events
+
+@st.cache_resource
+def get_prediction_service():
+    """ モデルは全セッションで1度だけ読み込む """
+    from app.services.prediction_service import prediction_service
+    return prediction_service
+
+@st.cache_data(show_spinner="顧客スコアを算出しています…")
+def load_scored_leads(source, model_version):
+    """ 商談リストを一括スコアリングする（リードの集合 source とモデルのバージョンが同じ間はキャッシュを使う） """
+    leads = read_leads(source[0]) if source else get_mock_master_data()[0]
+    return score_leads(leads, get_prediction_service(), score_column="customer_score")
+
+@st.cache_data(show_spinner="担当者を割り当てています…")
+def load_assignment(source, model_version, reps, capacity):
+    """ 受け入れ上限の範囲で総期待成約数が最大になるよう、商談リスト全件を担当者に割り当てる """
+    leads = load_scored_leads(source, model_version)
+    return assign_leads(leads["customer_score"], leads["customer_attributes"], reps, capacity)
+
+@st.cache_resource
+def get_knowledge_index():
+    """ AI重政チャットの検索インデックス（ATLAS_KB_INDEX_PATH に保存済みのものがあれば読み込む） """
+    return load_or_build(get_mock_master_data()[4])
+
+@st.cache_resource
+def get_suggestion_engine():
+    """ リアルタイム・サジェストのキーワード辞書は全セッションで1度だけ構築する """
+    return SuggestionEngine()
+
+@st.cache_resource
+def get_temperature_engine():
+    """ 顧客温度の DB（ATLAS_TEMPERATURE_DB_PATH が未設定の場合は、サンプルの接触イベントを取り込んだメモリ上の DB） """
+    engine = TemperatureEngine()
+    if len(engine) == 0:
+        events = get_mock_master_data()[5]
+        engine.ingest(events.assign(occurred_at=time.time() - events["days_ago"] * 86400))
+    return engine
+
+@st.cache_resource
+def get_capture_store():
+    """ 商談結果の記録ストア（ATLAS_CAPTURE_DB_PATH。書き込みはバックグラウンドでまとめて行う） """
+    return CaptureStore()
+
+def record_outcome(outcome):
+    """ 商談結果を確定し、最初の1回だけ手触りタグ・チャット履歴とともに記録ストアへ追記する（画面は書き込みを待たない） """
+    if st.session_state.final_status == "商談中":
+        customer = st.session_state.current_customer.to_dict()
+        captured = {
+            "outcome": outcome,
+            "features": {key: customer[key] for key in REQUIRED_KEYS},
+            "customer_id": st.session_state.current_customer.name,
+            "customer_name": customer["customer_name"],
+            "rep_name": st.session_state.current_rep["rep_name"],
+            "score": None if pd.isna(customer["customer_score"]) else customer["customer_score"],
+            "model_version": prediction_service.model_version,
+            "tags": st.session_state.tezawari_log,
+            "chat": st.session_state.chat_history,
+        }
+        get_capture_store().record(**captured)
+        st.session_state.captured = captured
+    st.session_state.final_status = outcome
 
-leads_df, reps_df, conversation_flow, tezawari_tags, knowledge_base, following_df = get_mock_master_data()
+# 文字起こしが届く単位（音声認識の結果が数文字ずつ届く想定）
+TRANSCRIPT_CHUNK_SIZE = 8
+
+def feed_conversation(step):
+    """ 表示済みの会話のうち未処理のお客様の発話を、チャンクに分けてキーワード検出に流す """
+    session = st.session_state.suggestion_session
+    while st.session_state.fed_step < step:
+        turn = conversation_flow[st.session_state.fed_step]
+        st.session_state.fed_step += 1
+        if turn["speaker"] != "お客様":
+            st.session_state.latest_keywords, st.session_state.latest_suggestions = [], []
+            continue
+        line, detected, fired = turn["line"], [], []
+        for start in range(0, len(line), TRANSCRIPT_CHUNK_SIZE):
+            end_of_utterance = start + TRANSCRIPT_CHUNK_SIZE >= len(line)
+            result = session.feed(line[start:start + TRANSCRIPT_CHUNK_SIZE], end_of_utterance)
+            detected += [match["keyword"] for match in result["keywords"]]
+            fired += result["suggestions"]
+        st.session_state.latest_keywords, st.session_state.latest_suggestions = list(dict.fromkeys(detected)), fired
+
+def reset_suggestions():
+    st.session_state.suggestion_session = get_suggestion_engine().session()
+    st.session_state.fed_step = 0
+    st.session_state.latest_keywords, st.session_state.latest_suggestions = [], []
+
+# 並び順の選択肢: 表示名 -> (カラム, 昇順か)
+SORT_OPTIONS = {"スコアが高い順": ("customer_score", False), "スコアが低い順": ("customer_score", True), "名前順": ("customer_name", True)}
+
+_, reps_df, conversation_flow, tezawari_tags, _, _ = get_mock_master_data()
+prediction_service = get_prediction_service()
+prediction_service.registry.check_for_update()
+leads_df = load_scored_leads(leads_source(), prediction_service.model_version)
 
 # --- アプリケーションの描画開始 ---
 st.title("🧠 AI重政：商談成約率 最大化システム")
@@ -49,6 +162,7 @@ if 'tezawari_log' not in st.session_state: st.session_state.tezawari_log = []
 if 'chat_history' not in st.session_state: st.session_state.chat_history = []
 if 'final_status' not in st.session_state: st.session_state.final_status = "商談中"
 if 'selected_reps' not in st.session_state: st.session_state.selected_reps = {}
+if 'suggestion_session' not in st.session_state: reset_suggestions()
 
 # --- 4 Tabs ---
 tab1, tab2, tab3, tab4 = st.tabs(["**① 新規商談リスト**", "**② 商談コックピット**", "**③ 商談サマリーと学習**", "**④ 継続フォローリスト**"])
@@ -56,46 +170,72 @@ tab1, tab2, tab3, tab4 = st.tabs(["**① 新規商談リスト**", "**② 商談
 # --- Tab 1: AI Matching ---
 with tab1:
     st.header("今日の新規商談リスト（AIマッチング）")
-    for index, lead in leads_df.iterrows():
+    f1, f2, f3, f4, f5 = st.columns([2, 1, 1, 1, 1])
+    search = f1.text_input("🔍 名前・属性で検索", key="lead_search")
+    min_score = f2.slider("最低スコア", 0, 100, 0, key="lead_min_score")
+    sort_by, ascending = SORT_OPTIONS[f3.selectbox("並び順", list(SORT_OPTIONS), key="lead_sort")]
+    page_size = f4.selectbox("表示件数", [10, 20, 50], key="lead_page_size")
+    capacity = f5.number_input("担当者あたりの上限件数", min_value=1, value=max(1, math.ceil(len(leads_df) / len(reps_df))), key="rep_capacity")
+    assignment = load_assignment(leads_source(), prediction_service.model_version, reps_df, capacity)
+    st.caption(f"🤖 AI割り当て: 期待成約数 合計 {assignment['total_expected_conversions']:.1f} 件 / "
+               + " / ".join(f"{name} {load} 件" for name, load in zip(reps_df['rep_name'], assignment['rep_loads'])))
+
+    # 絞り込み・並べ替えはまとめて行い、描画するのは表示中のページの行だけにする
+    page_df, n_matches, n_pages = query_leads(
+        leads_df, search, ["customer_name", "customer_attributes"], min_score or None, "customer_score",
+        sort_by, ascending, st.session_state.get("lead_page", 1), page_size)
+    if st.session_state.get("lead_page", 1) > n_pages:
+        st.session_state.lead_page = n_pages
+    p1, p2 = st.columns([1, 4])
+    p1.number_input("ページ", min_value=1, max_value=n_pages, key="lead_page")
+    p2.caption(f"{n_matches:,} 件中 {len(page_df):,} 件を表示（全 {n_pages} ページ）")
+
+    for index, lead in page_df.iterrows():
         st.divider()
-        if "フリーランス" in lead['customer_attributes'] or "会社員" in lead['customer_attributes']: recommended_rep_index = 0
-        elif "主婦" in lead['customer_attributes']: recommended_rep_index = 1
-        else: recommended_rep_index = 2
-        
+        position = leads_df.index.get_loc(index)
+        recommended_rep_index = assignment['assigned'][position]
+        customer_score = lead['customer_score']
+        # この顧客と各担当者の期待成約率（割り当てと同じ計算）
+        conversion_rates = conversion_matrix(
+            [customer_score], assignment['lead_segments'][position:position + 1], reps_df['base_rate'], assignment['rep_segments'])[0]
+
         if index not in st.session_state.selected_reps:
-            st.session_state.selected_reps[index] = reps_df.iloc[recommended_rep_index]['rep_name']
-        
+            # 上限で割り当てられなかった顧客は、期待成約率が最も高い担当者を仮に表示する
+            default_rep_index = recommended_rep_index if recommended_rep_index >= 0 else int(conversion_rates.argmax())
+            st.session_state.selected_reps[index] = reps_df.iloc[default_rep_index]['rep_name']
+
         selected_rep_name = st.session_state.selected_reps[index]
         selected_rep = reps_df[reps_df['rep_name'] == selected_rep_name].iloc[0]
-
-        compatibility_score = 1.2 if recommended_rep_index == selected_rep.name else 0.8
-        final_conversion_rate = lead['customer_score'] * selected_rep['base_rate'] * compatibility_score / 50 
+        final_conversion_rate = None if pd.isna(customer_score) else conversion_rates[selected_rep.name]
 
         col1, col2, col3, col4, col5 = st.columns([2, 0.5, 1.5, 2, 1.5])
         with col1:
             st.subheader(f"👤 {lead['customer_name']}")
             st.write(f"**属性:** {lead['customer_attributes']}")
-            st.metric("顧客スコア", f"{lead['customer_score']} 点")
+            st.metric("顧客スコア", "-" if pd.isna(customer_score) else f"{customer_score} 点")
         col2.write("<br><br><div style='font-size: 3rem; text-align: center;'>→</div>", unsafe_allow_html=True)
         with col3:
             st.subheader("予測成約率")
-            st.metric("", f"{final_conversion_rate:.1%}")
+            st.metric("", "-" if final_conversion_rate is None else f"{final_conversion_rate:.1%}")
             st.caption("顧客スコアと担当者相性から算出")
         with col4:
             st.subheader("🤝 担当者")
             if recommended_rep_index == selected_rep.name:
                 st.write(f"**AI推奨:** **{selected_rep_name}**")
+            elif recommended_rep_index < 0:
+                st.write(f"**未割り当て（上限超過）:** **{selected_rep_name}**")
             else:
                 st.write(f"**手動選択:** **{selected_rep_name}**")
             st.info(f"**得意領域:** {selected_rep['specialty']}")
         with col5:
             st.selectbox(
                 "担当者を変更", reps_df['rep_name'], index=int(selected_rep.name), key=f"rep_select_{index}",
-                on_change=lambda: st.session_state.update(selected_reps={**st.session_state.selected_reps, index: st.session_state[f"rep_select_{index}"]}))
+                on_change=lambda index=index: st.session_state.update(selected_reps={**st.session_state.selected_reps, index: st.session_state[f"rep_select_{index}"]}))
             if st.button(f"この商談を開始", key=f"start_{index}"):
                 st.session_state.current_customer = lead
                 st.session_state.current_rep = selected_rep
                 st.session_state.conversation_step = 0
+                reset_suggestions()
                 st.session_state.tezawari_log = []
                 st.session_state.final_status = "商談中"
                 st.session_state.chat_history = [{"role": "assistant", "content": f"**{lead['customer_name']}**（担当: {selected_rep_name}）との商談を開始します。"}]
@@ -119,8 +259,17 @@ with tab2:
                 else: conversation_log.markdown(f"💼 **担当者:** {conversation_flow[i]['line']}")
             st.write("**🤖 AI重政からのリアルタイム・サジェスト**")
             ai_suggestion_area = st.container(height=150, border=True)
-            current_suggestion = conversation_flow[st.session_state.conversation_step]['ai_suggestion'] if st.session_state.conversation_step < len(conversation_flow) else "商談を終了してください。下のボタンから結果を登録できます。"
-            ai_suggestion_area.success(current_suggestion)
+            feed_conversation(st.session_state.conversation_step)
+            suggestions = st.session_state.latest_suggestions
+            if suggestions:
+                detected = ", ".join(f"`{keyword}`" for keyword in st.session_state.latest_keywords)
+                ai_suggestion_area.success(f"【検知: {detected}】\n\n" + "\n\n".join(s["message"] for s in suggestions))
+            elif st.session_state.conversation_step == 0:
+                ai_suggestion_area.success("お客様のニーズ（Why）をヒアリング中です...")
+            elif st.session_state.conversation_step < len(conversation_flow):
+                ai_suggestion_area.success("お客様の反応を観察してください...")
+            if st.session_state.conversation_step >= len(conversation_flow):
+                ai_suggestion_area.info("商談を終了してください。下のボタンから結果を登録できます。")
             
             # 【バグ修正点】ボタンの表示ロジックを、if/elseで明確に分離
             st.divider()
@@ -136,11 +285,11 @@ with tab2:
                     st.session_state.clear()
                     st.rerun()
                 if c2.button("✅ 商談成立", type="primary"):
-                    st.session_state.final_status = "成約"
+                    record_outcome("成約")
                     st.toast("おめでとうございます！タブ③でサマリーを確認できます。")
                     st.rerun()
                 if c3.button("⏹️ 今回は見送り"):
-                    st.session_state.final_status = "見送り"
+                    record_outcome("見送り")
                     st.toast("残念…このデータは次に活かされます。タブ③へどうぞ。")
                     st.rerun()
 
@@ -155,7 +304,13 @@ with tab2:
                 with chat_area.chat_message(message["role"]): st.markdown(message["content"])
             if prompt := st.chat_input("（例：類似顧客の成功例は？）"):
                 st.session_state.chat_history.append({"role": "user", "content": prompt})
-                response = knowledge_base.get(prompt, "申し訳ありません、その質問にはまだお答えできません。")
+                hit = get_knowledge_index().answer(prompt)
+                if hit is None:
+                    response = "申し訳ありません、その質問にはまだお答えできません。"
+                elif hit["question"] == prompt:
+                    response = hit["answer"]
+                else:
+                    response = f"{hit['answer']}\n\n（近い質問:「{hit['question']}」 類似度 {hit['score']:.0%}）"
                 st.session_state.chat_history.append({"role": "assistant", "content": response})
                 st.rerun()
 
@@ -167,15 +322,23 @@ with tab3:
     else:
         st.subheader(f"商談結果： **{st.session_state.final_status}**")
         st.success("以下のデータパッケージが生成され、今晩のAIの学習に活用されます。")
+        captured = st.session_state.get("captured")
+        if captured is not None:
+            st.json(captured)
 
 with tab4:
     st.header("🔥 継続フォローリスト（顧客温度計）")
+    c1, c2 = st.columns(2)
+    order = c1.radio("並び順", ["熱い順", "冷めている順"], horizontal=True)
+    top_n = c2.slider("表示件数", 5, 50, 10, step=5)
+    following_df = get_temperature_engine().ranking(top_n, hottest=order == "熱い順")
     for index, lead in following_df.iterrows():
         st.divider()
         col1, col2, col3 = st.columns([1.5, 1, 2])
         col1.subheader(f"👤 {lead['customer_name']}")
-        col1.write(f"最終接触から: **{lead['last_contact']}**")
-        col2.metric("熱意スコア", f"{lead['thermometer_after']} 点")
-        if lead['thermometer_after'] > 50: col3.success(f"🤖 **AIインサイト:** {lead['ai_insight']}")
-        else: col3.warning(f"🤖 **AIインサイト:** {lead['ai_insight']}")
+        last_contact = "接触なし" if pd.isna(lead['days_since_contact']) else f"{int(lead['days_since_contact'])}日前"
+        col1.write(f"最終接触から: **{last_contact}**")
+        col2.metric("熱意スコア", f"{lead['temperature']} 点")
+        if lead['temperature'] > 50: col3.success(f"🤖 **AIインサイト:** {lead['insight']}")
+        else: col3.warning(f"🤖 **AIインサイト:** {lead['insight']}")
 
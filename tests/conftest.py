@@ -0,0 +1,12 @@
+# tests/conftest.py
+#
+# リポジトリのルートから ml / app パッケージを読み込めるようにする（pytest をどのディレクトリから実行しても同じ）
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+MODELS_DIR = os.path.join(ROOT_DIR, 'models')
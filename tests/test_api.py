@@ -0,0 +1,83 @@
+# tests/test_api.py
+#
+# Flask の API が不正な入力を 500 やおかしなスコアにせず、/predict/batch と同じメッセージの 400 で返すことを確認する
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+CUSTOMER = {
+    'Age': 35, 'Residence_Type': 'Rental', 'Years_at_Work': 5, 'Annual_Income_JPY_10k': 500,
+    'Other_Debt_JPY_10k': 50, 'Guarantor': 'No', 'Medical_History': 'なし', 'Payment_Rate': 0.9,
+}
+
+@pytest.fixture(scope='module')
+def main():
+    # app/main.py は app/ から `services.*` を読み込む（本番の起動方法と同じ）
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'app'))
+    try:
+        import main
+        yield main
+    finally:
+        sys.path.remove(os.path.join(ROOT_DIR, 'app'))
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+def test_predict_returns_scores(client):
+    response = client.post('/predict', json=CUSTOMER)
+    assert response.status_code == 200
+    assert 0 <= response.get_json()['base_case']['score'] <= 100
+
+@pytest.mark.parametrize('value', ['abc', None, True, float('nan'), float('inf')])
+def test_predict_rejects_non_numeric_values(client, value):
+    expected = client.post('/predict/batch', json=[dict(CUSTOMER, Age=value)]).get_json()['results'][0]['error']
+    response = client.post('/predict', json=dict(CUSTOMER, Age=value))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == expected == "'Age' must be a number"
+
+def test_predict_rejects_missing_keys(client):
+    customer = dict(CUSTOMER)
+    del customer['Age']
+    assert client.post('/predict', json=customer).status_code == 400
+    assert client.post('/predict', json=[CUSTOMER]).status_code == 400
+
+def test_predict_rejects_invalid_values_on_micro_batch_path(main, client, monkeypatch):
+    calls = []
+    batcher = main.MicroBatcher(
+        lambda records: calls.append(records) or main.prediction_service.run_simulations_many(records),
+        max_wait_ms=1, validate=main.prediction_service.validate,
+    )
+    monkeypatch.setattr(main, 'micro_batcher', batcher)
+    try:
+        response = client.post('/predict', json=dict(CUSTOMER, Payment_Rate=float('nan')))
+        assert response.status_code == 400
+        assert response.get_json()['error'] == "'Payment_Rate' must be a number"
+        assert client.post('/predict', json=CUSTOMER).status_code == 200
+    finally:
+        batcher.stop()
+    assert len(calls) == 1
+
+def test_import_does_not_create_cockpit_db(tmp_path):
+    path = tmp_path / 'cockpit_sessions.db'
+    env = dict(os.environ, ATLAS_SUGGESTION_DB_PATH=str(path))
+    subprocess.run([sys.executable, '-c', 'import main'], cwd=os.path.join(ROOT_DIR, 'app'), env=env, check=True)
+    assert not path.exists()
+
+def test_cockpit_db_is_opened_on_first_request(main, client, tmp_path, monkeypatch):
+    path = tmp_path / 'cockpit_sessions.db'
+    monkeypatch.setenv('ATLAS_SUGGESTION_DB_PATH', str(path))
+    monkeypatch.setattr(main, '_suggestion_sessions', None)
+    assert not path.exists()
+    response = client.post('/cockpit/sessions')
+    assert response.status_code == 201
+    assert path.exists()
+    session_id = response.get_json()['session_id']
+    assert client.delete(f'/cockpit/sessions/{session_id}').status_code == 200
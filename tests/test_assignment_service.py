@@ -0,0 +1,55 @@
+# tests/test_assignment_service.py
+#
+# 担当者割り当ての最適性と、/assign のリードごとのエラーを確認する
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.assignment_service import assign_leads, assign_records, conversion_matrix, segment_leads, segment_reps
+
+REPS = pd.DataFrame({
+    'rep_name': ['佐藤さん', '鈴木さん'],
+    'specialty': ['主婦・ファミリー層', '若年層・単身者'],
+    'base_rate': [0.5, 0.5],
+})
+
+def brute_force_total(scores, attributes, reps, capacity):
+    """ 全ての割り当て（未割り当てを含む）を列挙した総期待成約数の最大値 """
+    value = conversion_matrix(np.asarray(scores, dtype=float), segment_leads(attributes), reps['base_rate'], segment_reps(reps['specialty']))
+    best = 0.0
+    for assignment in itertools.product(range(-1, len(reps)), repeat=len(scores)):
+        loads = np.bincount([rep for rep in assignment if rep >= 0], minlength=len(reps))
+        if (loads <= capacity).all():
+            best = max(best, sum(value[i, rep] for i, rep in enumerate(assignment) if rep >= 0))
+    return best
+
+def test_fractional_scores_do_not_collide():
+    # score * セグメント数 + セグメント のキーでは 70 と 211/3 が同じグループになっていた
+    result = assign_leads([70, 211 / 3], ['主婦', 'フリーランス'], REPS, np.array([1, 1]))
+    assert result['total_expected_conversions'] == pytest.approx(1.684)
+    assert result['assigned'].tolist() == [0, 1]
+
+def test_matches_brute_force_on_random_leads():
+    rng = np.random.default_rng(0)
+    attributes = ['45歳/主婦', '32歳/フリーランス', '55歳/自営業']
+    for _ in range(20):
+        scores = np.round(rng.uniform(0, 100, 5), 1)
+        scores[rng.random(5) < 0.2] = np.nan
+        lead_attributes = list(rng.choice(attributes, 5))
+        capacity = rng.integers(0, 4, len(REPS))
+        result = assign_leads(scores, lead_attributes, REPS, capacity)
+        assert result['total_expected_conversions'] == pytest.approx(brute_force_total(scores, lead_attributes, REPS, capacity))
+        assert (result['rep_loads'] <= capacity).all()
+
+def test_non_numeric_score_is_a_per_lead_error():
+    leads = [{'score': 'abc'}, {'score': 70, 'attributes': '主婦'}, {'score': True}, 'lead']
+    result = assign_records(leads, REPS.to_dict('records'), capacity=1)
+    assignments = result['assignments']
+    assert assignments[0] == {'error': "'score' must be a number"}
+    assert assignments[1]['rep_name'] == '佐藤さん'
+    assert assignments[2] == {'error': "'score' must be a number"}
+    assert 'error' in assignments[3]
+    assert result['rep_loads'] == {'佐藤さん': 1, '鈴木さん': 0}
@@ -0,0 +1,147 @@
+# tests/test_bulk_score.py
+#
+# 一括スコアリングを途中で止めてから再開した結果が、一度に最後まで実行した結果と一致することと、
+# 設定の異なる / 壊れたマニフェストでは再開しないことを確認する
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT_DIR
+
+# app/bulk_score.py は app/ から `services.*` を読み込む（CLI として実行した場合と同じ）
+# 読み込み時にスコアキャッシュを無効にする環境変数を設定するため、他のテストに残らないよう元に戻す
+_cache_size = os.environ.get('ATLAS_SCORE_CACHE_SIZE')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'app'))
+import bulk_score  # noqa: E402
+if _cache_size is None:
+    del os.environ['ATLAS_SCORE_CACHE_SIZE']
+
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+N_ROWS = 230
+CHUNKSIZE = 20
+
+@pytest.fixture(scope='module', autouse=True)
+def bulk_environment():
+    # run() は ATLAS_MODEL_VERSION を書き換えるため、このモジュールの終了時に元に戻す
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('ATLAS_SCORE_CACHE_SIZE', '0')
+        patch.delenv('ATLAS_MODEL_VERSION', raising=False)
+        yield
+
+@pytest.fixture(autouse=True)
+def pinned_model_version(monkeypatch):
+    monkeypatch.delenv('ATLAS_MODEL_VERSION', raising=False)
+
+@pytest.fixture(scope='module')
+def input_path(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        '申込番号': np.arange(N_ROWS),
+        'Age': rng.integers(20, 70, N_ROWS).astype(float),
+        'Residence_Type': rng.choice(['Own_House', 'Rental', 'Family_House', 'Company_House'], N_ROWS),
+        'Years_at_Work': rng.integers(0, 30, N_ROWS),
+        'Annual_Income_JPY_10k': rng.uniform(200, 1500, N_ROWS).round(),
+        'Other_Debt_JPY_10k': rng.choice([0, 50, 120], N_ROWS),
+        'Guarantor': rng.choice(['Yes', 'No'], N_ROWS),
+        'Medical_History': rng.choice(['なし', '高血圧', '糖尿病'], N_ROWS),
+        'Payment_Rate': rng.uniform(0.5, 1.0, N_ROWS),
+    })
+    # 欠損値の行はエラーとして出力される
+    df.loc[[3, 77, 150], 'Age'] = np.nan
+    path = tmp_path_factory.mktemp('input') / 'customers.csv'
+    df.to_csv(path, index=False)
+    return str(path)
+
+def read_output(output_dir, fmt='parquet'):
+    parts = sorted(name for name in os.listdir(output_dir) if name.startswith('part-') and name.endswith(fmt))
+    read = pd.read_parquet if fmt == 'parquet' else pd.read_csv
+    return pd.concat([read(os.path.join(output_dir, name)) for name in parts], ignore_index=True)
+
+def interrupt_after(monkeypatch, n_chunks):
+    """ 入力を n_chunks チャンク読んだところで Ctrl+C されたことにする """
+    iter_chunks = bulk_score.iter_chunks
+
+    def interrupted(*args, **kwargs):
+        for index, chunk in enumerate(iter_chunks(*args, **kwargs)):
+            if index == n_chunks:
+                raise KeyboardInterrupt
+            yield chunk
+
+    monkeypatch.setattr(bulk_score, 'iter_chunks', interrupted)
+
+@pytest.fixture(scope='module')
+def full_run(bulk_environment, input_path, tmp_path_factory):
+    output_dir = str(tmp_path_factory.mktemp('full'))
+    manifest = bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=2, simulate=True)
+    os.environ.pop('ATLAS_MODEL_VERSION', None)
+    return manifest, read_output(output_dir)
+
+def test_full_run(full_run):
+    manifest, output = full_run
+    assert manifest['finished']
+    assert len(manifest['completed']) == -(-N_ROWS // CHUNKSIZE)
+    assert len(output) == N_ROWS
+    assert list(output['申込番号']) == list(range(N_ROWS))
+    assert output['error'].notna().sum() == 3
+    assert output['atlas_score'].isna().sum() == 3
+
+@pytest.mark.parametrize('n_chunks', [0, 1, 5])
+def test_resume_after_interrupt_matches_full_run(input_path, tmp_path, monkeypatch, full_run, n_chunks):
+    output_dir = str(tmp_path / 'out')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, n_chunks)
+        with pytest.raises(KeyboardInterrupt):
+            bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=2, simulate=True)
+    with open(os.path.join(output_dir, bulk_score.MANIFEST_NAME), encoding='utf-8') as f:
+        interrupted = json.load(f)
+    assert not interrupted['finished']
+    assert len(interrupted['completed']) <= n_chunks
+
+    manifest = bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=2, simulate=True)
+    assert manifest['finished']
+    assert manifest['completed'] == full_run[0]['completed']
+    pd.testing.assert_frame_equal(read_output(output_dir), full_run[1])
+
+def test_resume_rescores_chunks_whose_part_file_is_missing(input_path, tmp_path, full_run):
+    output_dir = str(tmp_path / 'out')
+    bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=1, simulate=True)
+    os.remove(bulk_score._part_path(output_dir, 4, 'parquet'))
+    manifest = bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=1, simulate=True)
+    assert manifest['completed'] == full_run[0]['completed']
+    pd.testing.assert_frame_equal(read_output(output_dir), full_run[1])
+
+def test_mismatched_manifest_is_not_resumed(input_path, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=1)
+    with pytest.raises(SystemExit, match='chunksize'):
+        bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE * 2, workers=1)
+    with pytest.raises(SystemExit, match='simulate'):
+        bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE, workers=1, simulate=True)
+
+    # --restart で前回の部分ファイルを消してからやり直す
+    manifest = bulk_score.run(input_path, output_dir, chunksize=CHUNKSIZE * 2, workers=1, restart=True)
+    assert len(manifest['completed']) == -(-N_ROWS // (CHUNKSIZE * 2))
+    assert len(read_output(output_dir)) == N_ROWS
+
+@pytest.mark.parametrize('content', ['{"completed": {"0": {"rows"', '[]', '{"chunksize": 20}', '\udcff'])
+def test_corrupted_manifest_is_not_resumed(input_path, tmp_path, content):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    (output_dir / bulk_score.MANIFEST_NAME).write_bytes(content.encode('utf-8', 'surrogateescape'))
+    with pytest.raises(SystemExit, match='--restart'):
+        bulk_score.run(input_path, str(output_dir), chunksize=CHUNKSIZE, workers=1)
+    manifest = bulk_score.run(input_path, str(output_dir), chunksize=CHUNKSIZE, workers=1, restart=True)
+    assert manifest['finished']
+
+def test_csv_output(input_path, tmp_path, full_run):
+    output_dir = str(tmp_path / 'out')
+    bulk_score.run(input_path, output_dir, fmt='csv', chunksize=CHUNKSIZE, workers=1)
+    output = read_output(output_dir, 'csv')
+    assert len(output) == N_ROWS
+    assert list(output['atlas_score'].astype('Int16')) == list(full_run[1]['atlas_score'])
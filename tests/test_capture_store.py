@@ -0,0 +1,89 @@
+# tests/test_capture_store.py
+#
+# 商談結果の記録ストアで、書き込みに失敗したバッチが退避用セグメントに残り、後で二重にならずに DB へ戻ることを確認する
+
+import os
+import sqlite3
+
+import pytest
+
+from app.services import capture_store
+from app.services.capture_store import CaptureStore
+
+FEATURES = {'Age': 40, 'Residence_Type': 'Own_House', 'Guarantor': 'No'}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_store.time, 'sleep', lambda seconds: None)
+    store = CaptureStore(str(tmp_path / 'captures.db'), flush_interval=0.01)
+    yield store
+    store.close()
+
+def break_writes(monkeypatch, store):
+    """ 書き込み用の接続だけを失敗させる（戻すときは monkeypatch.undo） """
+    def failing_connect():
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(store, '_connect', failing_connect)
+
+def test_records_are_written(store):
+    for outcome in ('成約', '見送り'):
+        store.record(outcome, FEATURES, customer_id=1, tags=['価格重視'], chat=[{'role': 'user', 'content': 'こんにちは'}])
+    assert store.flush()
+    captures = store.read_since(0)
+    assert list(captures['outcome']) == ['成約', '見送り']
+    assert captures['features'].iloc[0] == FEATURES
+    assert captures['tags'].iloc[0] == ['価格重視']
+    assert store.stats()['written'] == 2
+
+def test_failed_batches_are_spilled_and_replayed(store, monkeypatch):
+    break_writes(monkeypatch, store)
+    store.record('成約', FEATURES, customer_id='A')
+    store.record('見送り', FEATURES, customer_id='B')
+    assert store.flush()
+    stats = store.stats()
+    assert stats['spilled'] == 2 and stats['dropped'] == 0 and 'locked' in stats['last_error']
+    assert len(os.listdir(store.fallback_dir)) == 1
+
+    # 次に書き込めたバッチのあとで、退避していた分も DB に戻る
+    monkeypatch.undo()
+    store.record('成約', FEATURES, customer_id='C')
+    assert store.flush()
+    assert sorted(store.read_since(0)['customer_id']) == ['A', 'B', 'C']
+    assert store.stats()['replayed'] == 2
+    assert os.listdir(store.fallback_dir) == []
+
+def test_replay_is_idempotent(store, monkeypatch):
+    break_writes(monkeypatch, store)
+    store.record('成約', FEATURES, customer_id='A')
+    assert store.flush()
+    monkeypatch.undo()
+    segment = os.path.join(store.fallback_dir, os.listdir(store.fallback_dir)[0])
+    with open(segment, encoding='utf-8') as f:
+        content = f.read()
+
+    assert store.replay_fallback() == 1
+    # 削除の前に落ちてセグメントが残っていた場合も、二重には追記しない
+    with open(segment, 'w', encoding='utf-8') as f:
+        f.write(content)
+    assert store.replay_fallback() == 0
+    assert list(store.read_since(0)['customer_id']) == ['A']
+    assert not os.path.exists(segment)
+
+def test_new_store_replays_leftover_segments(tmp_path, store, monkeypatch):
+    break_writes(monkeypatch, store)
+    store.record('成約', FEATURES, customer_id='A')
+    assert store.flush()
+    monkeypatch.undo()
+    store.close()
+
+    reopened = CaptureStore(store.path)
+    try:
+        reopened.record('見送り', FEATURES, customer_id='B')
+        assert reopened.flush()
+        assert sorted(reopened.read_since(0)['customer_id']) == ['A', 'B']
+    finally:
+        reopened.close()
+
+def test_rejects_unknown_outcomes(store):
+    with pytest.raises(ValueError):
+        store.record('保留', FEATURES)
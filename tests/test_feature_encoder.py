@@ -0,0 +1,87 @@
+# tests/test_feature_encoder.py
+#
+# FeatureEncoder と従来の pandas の経路（get_dummies(drop_first=True) + reindex）の一致を確認する
+
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import MODELS_DIR
+from ml.preprocess import CATEGORICAL_KEYS, CATEGORY_LEVELS, NUMERIC_KEYS, FeatureEncoder
+
+# モデルは DataFrame で学習しているため、NumPy 配列を渡した場合の警告は無視する（推論時と同じ）
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+# 学習データに無い値（基準カテゴリより前 / 後に並ぶもの、型の違うもの）
+UNKNOWN_VALUES = {
+    'Residence_Type': ['AAA_House', 'Zzz', 'Other'],
+    'Guarantor': ['Maybe', 'yes', 'A'],
+    'Medical_History': ['あり', '喘息', 'None'],
+}
+
+@pytest.fixture(scope='module')
+def model_columns():
+    return joblib.load(os.path.join(MODELS_DIR, 'model_columns_v2.pkl'))
+
+@pytest.fixture(scope='module')
+def model():
+    return joblib.load(os.path.join(MODELS_DIR, 'atlas_model_v2.pkl'))
+
+def random_records(n, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for _ in range(n):
+        record = {
+            'Age': int(rng.integers(18, 80)),
+            'Years_at_Work': float(rng.integers(0, 40)),
+            'Annual_Income_JPY_10k': float(rng.uniform(100, 2000)),
+            'Other_Debt_JPY_10k': float(rng.choice([0.0, rng.uniform(0, 500)])),
+            'Payment_Rate': float(rng.uniform(0, 1)),
+        }
+        for key in CATEGORICAL_KEYS:
+            choices = CATEGORY_LEVELS[key] + UNKNOWN_VALUES[key]
+            record[key] = choices[rng.integers(len(choices))]
+        records.append(record)
+    # get_dummies(drop_first=True) は行に現れた最初の水準を落とすため、基準カテゴリを必ず含めておく
+    for key in CATEGORICAL_KEYS:
+        records[0][key] = CATEGORY_LEVELS[key][0]
+    return records
+
+def pandas_features(records, model_columns):
+    """ FeatureEncoder 導入前の推論経路（get_dummies(drop_first=True) してからモデルのカラムに合わせる） """
+    df = pd.get_dummies(pd.DataFrame(records), columns=CATEGORICAL_KEYS, drop_first=True)
+    return df.reindex(columns=model_columns, fill_value=0)
+
+def test_encode_many_matches_get_dummies(model_columns):
+    records = random_records(3000)
+    expected = pandas_features(records, model_columns).to_numpy(dtype=np.float64)
+    actual = FeatureEncoder(model_columns).encode_many(records)
+    np.testing.assert_array_equal(actual, expected)
+
+def test_encode_one_matches_encode_many(model_columns):
+    records = random_records(200, seed=1)
+    encoder = FeatureEncoder(model_columns)
+    rows = np.vstack([encoder.encode_one(record) for record in records])
+    np.testing.assert_array_equal(rows, encoder.encode_many(records))
+
+def test_encode_frame_matches_encode_many(model_columns):
+    records = random_records(500, seed=2)
+    encoder = FeatureEncoder(model_columns)
+    np.testing.assert_array_equal(encoder.encode_frame(pd.DataFrame(records)), encoder.encode_many(records))
+
+def test_unknown_and_base_categories_are_all_zero(model_columns):
+    encoder = FeatureEncoder(model_columns)
+    records = random_records(1, seed=3)
+    records.append({**records[0], **{key: UNKNOWN_VALUES[key][0] for key in CATEGORICAL_KEYS}})
+    matrix = encoder.encode_many(records)
+    categorical = [i for i, column in enumerate(model_columns) if column not in NUMERIC_KEYS]
+    assert not matrix[:, categorical].any()
+
+def test_scores_are_bit_identical(model, model_columns):
+    records = random_records(3000, seed=4)
+    expected = model.predict_proba(pandas_features(records, model_columns))
+    actual = model.predict_proba(FeatureEncoder(model_columns).encode_many(records))
+    np.testing.assert_array_equal(actual, expected)
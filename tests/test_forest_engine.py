@@ -0,0 +1,83 @@
+# tests/test_forest_engine.py
+#
+# CompiledForest が sklearn の predict_proba と誤差 1e-12 以内で一致することを確認する
+
+import os
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from conftest import MODELS_DIR
+from app.services.forest_engine import CompiledForest
+from app.services.prediction_service import PredictionService
+
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+TOLERANCE = 1e-12
+
+def assert_matches(model, X):
+    expected = model.predict_proba(X)
+    actual = CompiledForest.from_sklearn(model).predict_proba(X)
+    assert actual.shape == expected.shape
+    assert np.max(np.abs(actual - expected)) <= TOLERANCE
+
+def test_saved_model_matches_predict_proba():
+    model = joblib.load(os.path.join(MODELS_DIR, 'atlas_model_v2.pkl'))
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    X = np.column_stack([
+        rng.integers(18, 80, n_rows),
+        rng.integers(0, 40, n_rows),
+        rng.uniform(100, 2000, n_rows),
+        rng.uniform(0, 500, n_rows),
+        rng.uniform(0, 1, n_rows),
+        rng.integers(0, 2, (n_rows, model.n_features_in_ - 5)),
+    ]).astype(np.float64)
+    assert_matches(model, X)
+
+@pytest.mark.parametrize('n_rows', [1, 7, CompiledForest.CHUNK_ROWS + 1, 3000])
+def test_batch_sizes_across_chunk_boundaries(n_rows):
+    rng = np.random.default_rng(1)
+    X_train = rng.normal(size=(400, 6))
+    y_train = (X_train[:, 0] + rng.normal(scale=0.5, size=400) > 0).astype(int)
+    model = RandomForestClassifier(n_estimators=30, random_state=0).fit(X_train, y_train)
+    assert_matches(model, rng.normal(size=(n_rows, 6)))
+
+def test_multiclass_and_threshold_ties():
+    # 閾値ちょうどの値（float32 への丸めで判定が変わりうる値）を含める
+    rng = np.random.default_rng(2)
+    X_train = rng.integers(0, 5, size=(300, 4)).astype(np.float64)
+    y_train = rng.integers(0, 3, size=300)
+    model = RandomForestClassifier(n_estimators=20, max_depth=6, random_state=0).fit(X_train, y_train)
+    X = np.vstack([X_train, X_train + 0.5, rng.normal(2, 2, size=(200, 4))])
+    assert_matches(model, X)
+
+def test_rejects_wrong_feature_count():
+    rng = np.random.default_rng(3)
+    model = RandomForestClassifier(n_estimators=3, random_state=0).fit(rng.normal(size=(50, 3)), rng.integers(0, 2, 50))
+    with pytest.raises(ValueError):
+        CompiledForest.from_sklearn(model).predict_proba(np.zeros((2, 4)))
+
+@pytest.mark.filterwarnings('ignore:overflow encountered in cast')
+@pytest.mark.parametrize('value', [np.nan, np.inf, 1e300])
+def test_rejects_non_finite_values(value):
+    # sklearn は欠損値を学習時の分岐先へ送るが、CompiledForest はその情報を持たないため、推論経路で結果を変えずに断る
+    rng = np.random.default_rng(4)
+    model = RandomForestClassifier(n_estimators=3, random_state=0).fit(rng.normal(size=(50, 3)), rng.integers(0, 2, 50))
+    X = rng.normal(size=(4, 3))
+    X[2, 1] = value
+    with pytest.raises(ValueError):
+        CompiledForest.from_sklearn(model).predict_proba(X)
+
+@pytest.mark.parametrize('backend', ['sklearn', 'compiled'])
+def test_service_rejects_nan_features_for_every_batch_size(backend, monkeypatch):
+    monkeypatch.delenv('ATLAS_MODEL_VERSION', raising=False)
+    service = PredictionService(backend=backend, models_dir=MODELS_DIR)
+    bundle = service.registry.current()
+    X = np.zeros((CompiledForest.MAX_ROWS + 1, len(bundle.model_columns)))
+    X[0, 0] = np.nan
+    for n_rows in (1, CompiledForest.MAX_ROWS + 1):
+        with pytest.raises(ValueError):
+            service._predict_not_delayed(bundle, X[:n_rows])
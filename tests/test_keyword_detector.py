@@ -0,0 +1,109 @@
+# tests/test_keyword_detector.py
+#
+# キーワード照合と、ワーカー間で共有する商談セッションストアを確認する
+
+import random
+import threading
+
+import pytest
+
+from app.services.keyword_detector import (
+    DEFAULT_RULES, KeywordAutomaton, SuggestionEngine, SuggestionSessionStore, normalize,
+)
+
+def brute_force(keywords, text):
+    matches = set()
+    for index, keyword in enumerate(keywords):
+        start = text.find(keyword)
+        while start >= 0:
+            matches.add((index, start + len(keyword)))
+            start = text.find(keyword, start + 1)
+    return matches
+
+def test_automaton_matches_brute_force_across_chunks():
+    rng = random.Random(0)
+    keywords = ['ab', 'abc', 'bca', 'c', 'aab', 'cab', 'bb']
+    automaton = KeywordAutomaton(keywords)
+    for _ in range(50):
+        text = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 60)))
+        state, offset, matches = 0, 0, []
+        while offset < len(text):
+            chunk = text[offset:offset + rng.randint(1, 5)]
+            found, state = automaton.scan(chunk, state, offset)
+            matches.extend(found)
+            offset += len(chunk)
+        assert set(matches) == brute_force(automaton.keywords, text)
+        assert len(matches) == len(set(matches))
+
+def transcript_chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+TEXT = '実は初期費用が心配で、納期もどれくらいかかりますか。家族の安全も大事です。初期費用'
+
+def test_session_fires_each_rule_once():
+    session = SuggestionEngine().session()
+    fired = [s['rule'] for chunk in transcript_chunks(TEXT, 2) for s in session.feed(chunk)['suggestions']]
+    assert fired == ['initial_cost', 'anxiety', 'delivery', 'safety']
+
+@pytest.fixture
+def workers(tmp_path):
+    """ 同じファイルを参照する2つのストア（別々のワーカープロセスに相当） """
+    path = str(tmp_path / 'sessions.db')
+    engine = SuggestionEngine()
+    return (SuggestionSessionStore(engine, path, poll_interval=0.01),
+            SuggestionSessionStore(SuggestionEngine(), path, poll_interval=0.01))
+
+def test_store_continues_session_on_any_worker(workers):
+    session_id = workers[0].create()
+    reference = SuggestionEngine().session()
+    for i, chunk in enumerate(transcript_chunks(TEXT, 3)):
+        # キーワードがチャンクの境目で分かれても、別のワーカーで続きを照合できる
+        assert workers[i % 2].feed(session_id, chunk) == reference.feed(chunk)
+    assert workers[1].exists(session_id)
+    assert workers[0].feed('missing', 'x') is None
+
+def test_sse_listener_receives_events_from_other_workers(workers):
+    session_id = workers[0].create()
+    received = []
+
+    def listen():
+        for event, data, event_id in workers[1].listen(session_id, heartbeat=0.05):
+            if event != 'heartbeat':
+                received.append((event_id, data['rule']))
+
+    listener = threading.Thread(target=listen)
+    listener.start()
+    for chunk in transcript_chunks(TEXT, 4):
+        workers[0].feed(session_id, chunk)
+    assert workers[0].close(session_id)
+    listener.join(5)
+    assert not listener.is_alive()
+    assert [rule for _, rule in received] == ['initial_cost', 'anxiety', 'delivery', 'safety']
+    assert not workers[1].exists(session_id)
+    assert not workers[1].close(session_id)
+
+def test_listener_resumes_after_last_event_id(workers):
+    session_id = workers[0].create()
+    for chunk in transcript_chunks(TEXT, 4):
+        workers[0].feed(session_id, chunk)
+    workers[0].close(session_id)
+    events = list(workers[1].listen(session_id))
+    assert len(events) == 4
+    assert [data['rule'] for _, data, _ in workers[1].listen(session_id, last_event_id=events[1][2])] == ['delivery', 'safety']
+
+def test_changed_rules_restart_matching(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    old = SuggestionSessionStore(SuggestionEngine(), path)
+    session_id = old.create()
+    old.feed(session_id, '初期')
+    rules = DEFAULT_RULES + [{'id': 'price', 'keywords': ['値段'], 'priority': 1, 'message': '価格'}]
+    new = SuggestionSessionStore(SuggestionEngine(rules), path)
+    # ルールが変わるとノード番号を引き継げないため、途中まで一致していたキーワードは検出しない
+    assert new.feed(session_id, '費用の値段')['keywords'] == [{'keyword': normalize('値段'), 'start': 5, 'end': 7}]
+
+def test_expired_sessions_are_removed(tmp_path):
+    store = SuggestionSessionStore(SuggestionEngine(), str(tmp_path / 'sessions.db'), ttl=-1.0)
+    session_id = store.create()
+    assert store.feed(session_id, '初期費用') is None
+    store.create()
+    assert not store.exists(session_id)
@@ -0,0 +1,104 @@
+# tests/test_knowledge_index.py
+#
+# ナレッジベース検索の追加・削除・本体への統合・保存/読み込みで、検索結果が作り直した場合と一致することを確認する
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.services import knowledge_index
+from app.services.knowledge_index import KnowledgeIndex, char_ngrams
+
+QA = [
+    ('初期費用はかかりますか？', '初期費用はゼロです。'),
+    ('頭金は必要ですか', '頭金なしでご契約いただけます。'),
+    ('納車までどれくらいかかりますか', '最短で2週間です。'),
+    ('途中で解約できますか？', '解約金がかかります。'),
+    ('保険は含まれていますか', '任意保険は別途です。'),
+    ('メンテナンス費用は？', '月額料金に含まれています。'),
+    ('走行距離の制限はありますか', '月1,500kmまでです。'),
+    ('審査にはどれくらい時間がかかりますか', '最短で即日です。'),
+]
+QUERIES = ['初期費用', '納車はいつ', '解約したい', '審査の時間', '費用がかかる', '保険について', 'まったく関係ない']
+
+def expected_scores(index, query):
+    """ 生きている Q&A だけで sklearn の TF-IDF（sublinear TF, smooth IDF, L2 正規化）を作り直したコサイン類似度 """
+    # 置き換えた ID は削除済みの行と新しい行の両方に現れるため、後の（生きている）行の質問を使う
+    ids = [entry_id for entry_id in dict.fromkeys(index.entry_ids) if entry_id in index]
+    questions = {entry_id: question for entry_id, question in zip(index.entry_ids, index.questions)}
+    vectorizer = TfidfVectorizer(analyzer=char_ngrams, sublinear_tf=True)
+    documents = vectorizer.fit_transform([questions[entry_id] for entry_id in ids])
+    scores = (documents @ vectorizer.transform([query]).T).toarray().ravel()
+    return dict(zip(ids, scores))
+
+def assert_matches_rebuilt(index):
+    for query in QUERIES:
+        expected = expected_scores(index, query)
+        hits = index.search(query, k=len(index) + 10)
+        actual = {hit['id']: hit['score'] for hit in hits}
+        for entry_id, score in expected.items():
+            assert actual.get(entry_id, 0.0) == pytest.approx(score, abs=1e-12)
+        # 削除済みの Q&A は返さない
+        assert set(actual) <= set(expected)
+
+def build(qa=QA):
+    index = KnowledgeIndex()
+    index.add_many(qa)
+    return index
+
+def test_search_matches_sklearn_tfidf():
+    assert_matches_rebuilt(build())
+
+def test_remove_and_replace():
+    index = build()
+    index.remove(0)
+    index.remove(3)
+    index.add('初期費用について教えて', 'ゼロです。', entry_id=1)
+    assert 0 not in index and 1 in index
+    assert len(index) == len(QA) - 2
+    assert_matches_rebuilt(index)
+    hit = index.answer('初期費用について教えて')
+    assert hit['id'] == 1 and hit['answer'] == 'ゼロです。'
+
+def test_compaction_keeps_results(monkeypatch):
+    monkeypatch.setattr(knowledge_index, 'MERGE_THRESHOLD', 2)
+    index = build(QA[:3])
+    index.search('初期費用')
+    for question, answer in QA[3:]:
+        index.add(question, answer)
+        assert_matches_rebuilt(index)
+    for entry_id in (1, 2, 4):
+        index.remove(entry_id)
+        assert_matches_rebuilt(index)
+    # 削除済みの行が MAX_DEAD_RATIO を超えたら詰めて本体に統合されている
+    assert len(index.entry_ids) == len(index)
+    assert index._base.shape[0] == len(index)
+
+def test_save_and_load_round_trip(tmp_path):
+    index = build()
+    index.remove(2)
+    index.add('支払い方法は？', '口座振替です。')
+    path = tmp_path / 'kb_index.npz'
+    index.save(path)
+
+    loaded = KnowledgeIndex.load(path)
+    assert loaded.entry_ids == index.entry_ids
+    assert len(loaded) == len(index)
+    for query in QUERIES:
+        assert loaded.search(query, k=5) == index.search(query, k=5)
+    assert_matches_rebuilt(loaded)
+
+    # 読み込んだインデックスにも追加・削除でき、ID は続きから振られる
+    new_id = loaded.add('キャンセル料は？', '契約前なら無料です。')
+    assert new_id == max(index.entry_ids) + 1
+    loaded.remove(0)
+    assert_matches_rebuilt(loaded)
+
+def test_load_or_build_saves_once(tmp_path):
+    path = str(tmp_path / 'kb_index.npz')
+    built = knowledge_index.load_or_build(dict(QA), path)
+    loaded = knowledge_index.load_or_build({}, path)
+    assert len(loaded) == len(built) == len(QA)
+    np.testing.assert_allclose(
+        [hit['score'] for hit in loaded.search('初期費用', k=3)],
+        [hit['score'] for hit in built.search('初期費用', k=3)])
@@ -0,0 +1,105 @@
+# tests/test_lead_list.py
+#
+# 商談リストの一括スコアリングと、絞り込み・並べ替え（同点の順序を含む）・ページ分割、空のリストの扱いを確認する
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.lead_list import LEADS_PATH_ENV, leads_source, query_leads, read_leads, score_leads
+from app.services.prediction_service import REQUIRED_KEYS
+
+LEAD = {
+    'Age': 35, 'Residence_Type': 'Rental', 'Years_at_Work': 5, 'Annual_Income_JPY_10k': 500,
+    'Other_Debt_JPY_10k': 50, 'Guarantor': 'No', 'Medical_History': 'なし', 'Payment_Rate': 0.9,
+}
+
+class FakeService:
+    """ 年収をそのままスコアにする（呼び出し回数も記録する） """
+
+    def __init__(self):
+        self.calls = []
+
+    def score_many(self, records):
+        self.calls.append(records)
+        return [{'score': int(record['Annual_Income_JPY_10k'])} if record['Age'] >= 0 else {'error': 'bad'}
+                for record in records]
+
+def make_leads(incomes, names=None):
+    names = names or [f'顧客{i}' for i in range(len(incomes))]
+    return pd.DataFrame([dict(LEAD, Annual_Income_JPY_10k=income, name=name) for income, name in zip(incomes, names)])
+
+def test_score_leads_scores_in_one_call():
+    leads = make_leads([50, 80, 20])
+    leads.loc[1, 'Guarantor'] = None
+    leads.loc[2, 'Age'] = -1
+    service = FakeService()
+    scored = score_leads(leads, service)
+    assert len(service.calls) == 1 and len(service.calls[0]) == 2
+    assert scored['score'].dtype == 'Int16'
+    assert scored['score'].tolist() == [50, pd.NA, pd.NA]
+    # 元の DataFrame は変更しない
+    assert 'score' not in leads.columns
+
+def test_score_leads_requires_columns():
+    with pytest.raises(ValueError, match='Payment_Rate'):
+        score_leads(make_leads([50]).drop(columns=['Payment_Rate']), FakeService())
+
+def test_score_leads_empty_input():
+    leads = pd.DataFrame(columns=REQUIRED_KEYS + ['name'])
+    scored = score_leads(leads, FakeService())
+    assert scored.empty and 'score' in scored.columns
+    page, n_matches, n_pages = query_leads(scored, search='顧客', search_columns=['name'], min_score=10, sort_by='score')
+    assert page.empty and n_matches == 0 and n_pages == 1
+
+def test_score_leads_with_all_rows_incomplete():
+    leads = make_leads([50, 60])
+    leads['Age'] = np.nan
+    assert score_leads(leads, FakeService())['score'].isna().all()
+
+def test_sort_is_stable_for_ties_and_puts_missing_scores_last():
+    leads = score_leads(make_leads([70, 40, 70, 90, 40, -1]), FakeService())
+    leads.loc[5, 'score'] = pd.NA
+    page, _, _ = query_leads(leads, sort_by='score', ascending=False, page_size=10)
+    # 同点のリードは元の並び順を保つ
+    assert page.index.tolist() == [3, 0, 2, 1, 4, 5]
+    page, _, _ = query_leads(leads, sort_by='score', ascending=True, page_size=10)
+    assert page.index.tolist() == [1, 4, 0, 2, 3, 5]
+
+def test_filters_and_pages():
+    leads = score_leads(make_leads(list(range(0, 100, 2)), names=[f'{"田中" if i % 3 == 0 else "佐藤"}{i}' for i in range(50)]),
+                        FakeService())
+    page, n_matches, n_pages = query_leads(leads, search='田中', search_columns=['name'], min_score=30,
+                                           sort_by='score', page=2, page_size=5)
+    expected = leads[leads['name'].str.contains('田中') & (leads['score'] >= 30)].sort_values('score', ascending=False)
+    assert n_matches == len(expected)
+    assert n_pages == -(-len(expected) // 5)
+    assert page.index.tolist() == expected.index[5:10].tolist()
+
+    # 範囲外のページ番号は最初 / 最後のページに丸める
+    assert query_leads(leads, page=0, page_size=20)[0].index.tolist() == list(range(20))
+    assert query_leads(leads, page=99, page_size=20)[0].index.tolist() == list(range(40, 50))
+
+def test_search_is_case_insensitive_and_literal():
+    leads = make_leads([10, 20, 30], names=['ABC (株)', 'abc', 'xyz'])
+    page, n_matches, _ = query_leads(leads, search='abc', search_columns=['name'])
+    assert n_matches == 2
+    page, n_matches, _ = query_leads(leads, search='(株', search_columns=['name'])
+    assert page.index.tolist() == [0]
+
+def test_min_score_excludes_missing_scores():
+    leads = score_leads(make_leads([10, 50, 90]), FakeService())
+    leads.loc[2, 'score'] = pd.NA
+    assert query_leads(leads, min_score=40)[0].index.tolist() == [1]
+
+def test_leads_source_and_read(tmp_path, monkeypatch):
+    monkeypatch.delenv(LEADS_PATH_ENV, raising=False)
+    assert leads_source() is None
+    path = tmp_path / 'leads.parquet'
+    make_leads([10, 20]).to_parquet(path)
+    monkeypatch.setenv(LEADS_PATH_ENV, str(path))
+    source = leads_source()
+    assert source[0] == str(path)
+    pd.testing.assert_frame_equal(read_leads(source[0]), make_leads([10, 20]))
+    make_leads([10, 20, 30]).to_parquet(path)
+    assert leads_source() != source
@@ -0,0 +1,94 @@
+# tests/test_metrics.py
+#
+# /metrics の出力と、マルチプロセスモードでのワーカー間の合算を確認する
+
+import os
+
+import pytest
+
+from app.services.metrics import MetricsRegistry
+
+def sample(text, prefix):
+    """ 出力から prefix で始まる行の値を返す """
+    for line in text.splitlines():
+        if line.startswith(prefix + ' '):
+            return float(line.split()[-1])
+    return None
+
+def run_in_child(fn):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            fn()
+        finally:
+            os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+def test_in_process_render():
+    registry = MetricsRegistry()
+    requests = registry.counter('t_requests_total', 'Requests.', ['endpoint'])
+    latency = registry.histogram('t_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    requests.inc(endpoint='predict')
+    requests.inc(2, endpoint='predict')
+    latency.observe(0.5)
+    registry.register_collector(lambda: [('t_entries', 'gauge', 'Entries.', 7)])
+    text = registry.render()
+    assert sample(text, 't_requests_total{endpoint="predict"}') == 3
+    assert sample(text, 't_latency_seconds_bucket{le="0.1"}') == 0
+    assert sample(text, 't_latency_seconds_bucket{le="1.0"}') == 1
+    assert sample(text, 't_latency_seconds_bucket{le="+Inf"}') == 1
+    assert sample(text, 't_latency_seconds_sum') == 0.5
+    assert sample(text, 't_entries') == 7
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_multiprocess_values_are_summed_across_workers(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    requests = registry.counter('t_requests_total', 'Requests.', ['endpoint'])
+    latency = registry.histogram('t_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    entries = {'value': 0}
+    registry.register_collector(lambda: [('t_entries', 'gauge', 'Entries.', entries['value'])])
+    requests.inc(endpoint='predict')
+
+    def worker():
+        # 親プロセスで記録した1件は引き継がない
+        requests.inc(2, endpoint='predict')
+        requests.inc(endpoint='simulate')
+        latency.observe(0.05)
+        latency.observe(5.0)
+        entries['value'] = 4
+        registry.publish_collectors()
+
+    run_in_child(worker)
+    run_in_child(worker)
+    assert len(list(tmp_path.glob('metrics_*.db'))) == 3
+
+    text = registry.render()
+    assert sample(text, 't_requests_total{endpoint="predict"}') == 5
+    assert sample(text, 't_requests_total{endpoint="simulate"}') == 2
+    assert sample(text, 't_latency_seconds_bucket{le="0.1"}') == 2
+    assert sample(text, 't_latency_seconds_bucket{le="+Inf"}') == 4
+    assert sample(text, 't_latency_seconds_count') == 4
+    assert sample(text, 't_latency_seconds_sum') == pytest.approx(10.1)
+    assert sample(text, 't_entries') == 8
+
+    # 終了したワーカーのゲージは0になり、カウンターは合計に残る
+    def exiting_worker():
+        requests.inc(endpoint='predict')
+        entries['value'] = 4
+        registry.publish_collectors()
+        registry.stop_publishing()
+
+    run_in_child(exiting_worker)
+    text = registry.render()
+    assert sample(text, 't_requests_total{endpoint="predict"}') == 6
+    assert sample(text, 't_entries') == 8
+
+def test_multiprocess_file_grows_with_many_label_values(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    requests = registry.counter('t_requests_total', 'Requests.', ['endpoint'])
+    for i in range(3000):
+        requests.inc(i, endpoint=f'endpoint_{i}')
+    text = registry.render()
+    assert sample(text, 't_requests_total{endpoint="endpoint_2999"}') == 2999
+    assert sample(text, 't_requests_total{endpoint="endpoint_1"}') == 1
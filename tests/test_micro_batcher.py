@@ -0,0 +1,80 @@
+# tests/test_micro_batcher.py
+#
+# マイクロバッチのまとめ方と、バッチ全体が失敗した場合の1件ずつの再実行を確認する
+
+import threading
+
+import pytest
+
+from app.services.micro_batcher import MicroBatcher
+
+def test_concurrent_submissions_are_batched():
+    calls = []
+    release = threading.Event()
+
+    def score_many(records):
+        calls.append(list(records))
+        release.wait(5)
+        return [record * 10 for record in records]
+
+    batcher = MicroBatcher(score_many, max_batch_size=8, max_wait_ms=50)
+    try:
+        futures = [batcher.submit(i) for i in range(8)]
+        release.set()
+        assert [future.result(5) for future in futures] == [i * 10 for i in range(8)]
+    finally:
+        batcher.stop()
+    assert sum(len(call) for call in calls) == 8
+    assert batcher.stats()['items'] == 8
+    assert batcher.stats()['fallbacks'] == 0
+
+def test_failed_batch_falls_back_to_single_records():
+    calls = []
+
+    def score_many(records):
+        calls.append(list(records))
+        if 'bad' in records:
+            raise ValueError('bad record')
+        return [len(record) for record in records]
+
+    batcher = MicroBatcher(score_many, max_batch_size=4, max_wait_ms=200)
+    try:
+        futures = [batcher.submit(record) for record in ['a', 'bad', 'ccc', 'dd']]
+        assert futures[0].result(5) == 1
+        with pytest.raises(ValueError, match='bad record'):
+            futures[1].result(5)
+        assert futures[2].result(5) == 3
+        assert futures[3].result(5) == 2
+    finally:
+        batcher.stop()
+
+    # 最初にまとめて1回、失敗後に1件ずつ4回
+    assert calls[0] == ['a', 'bad', 'ccc', 'dd']
+    assert calls[1:] == [['a'], ['bad'], ['ccc'], ['dd']]
+    stats = batcher.stats()
+    assert stats['fallbacks'] == 1
+    assert stats['batches'] == 1
+    assert stats['items'] == 4
+
+def test_stop_drains_queue():
+    batcher = MicroBatcher(lambda records: records, max_batch_size=2, max_wait_ms=1)
+    futures = [batcher.submit(i) for i in range(5)]
+    batcher.stop()
+    assert [future.result(0) for future in futures] == list(range(5))
+
+def test_invalid_records_are_rejected_before_queueing():
+    calls = []
+
+    def score_many(records):
+        calls.append(list(records))
+        return records
+
+    batcher = MicroBatcher(score_many, max_wait_ms=1, validate=lambda record: None if record >= 0 else 'negative')
+    try:
+        rejected = batcher.submit(-1)
+        with pytest.raises(ValueError, match='negative'):
+            rejected.result(0)
+        assert batcher.score(3) == 3
+    finally:
+        batcher.stop()
+    assert calls == [[3]]
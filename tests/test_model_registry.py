@@ -0,0 +1,80 @@
+# tests/test_model_registry.py
+#
+# モデルレジストリの稼働バージョンの決め方と、管理者によるロールバックが監視スレッドに戻されないことを確認する
+
+import logging
+import os
+import shutil
+
+import pytest
+
+from conftest import MODELS_DIR
+from app.services.model_registry import CURRENT_FILE, ModelRegistry
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv('ATLAS_MODEL_VERSION', raising=False)
+    for version in ('v2', 'v3'):
+        shutil.copy(os.path.join(MODELS_DIR, 'atlas_model_v2.pkl'), tmp_path / f'atlas_model_{version}.pkl')
+        shutil.copy(os.path.join(MODELS_DIR, 'model_columns_v2.pkl'), tmp_path / f'model_columns_{version}.pkl')
+    return str(tmp_path)
+
+def test_latest_version_is_active_by_default(models_dir):
+    registry = ModelRegistry(models_dir)
+    assert registry.versions() == ['v2', 'v3']
+    assert registry.current().version == 'v3'
+    assert not registry.check_for_update()
+
+def test_pinned_rollback_survives_check_for_update(models_dir):
+    registry = ModelRegistry(models_dir)
+    other_worker = ModelRegistry(models_dir)
+    assert registry.current().version == 'v3'
+    assert other_worker.current().version == 'v3'
+
+    assert registry.pin('v2').version == 'v2'
+    with open(os.path.join(models_dir, CURRENT_FILE), encoding='utf-8') as f:
+        assert f.read().strip() == 'v2'
+    # 監視スレッドの定期チェックでも最新版に戻らない
+    assert not registry.check_for_update()
+    assert registry.current().version == 'v2'
+    # 他のワーカーも models/CURRENT を見て同じバージョンに揃う
+    assert other_worker.check_for_update()
+    assert other_worker.current().version == 'v2'
+
+def test_unpinned_reload_is_undone_by_watcher(models_dir):
+    # reload() はこのプロセスだけの一時的な差し替え（固定するには pin() を使う）
+    registry = ModelRegistry(models_dir)
+    registry.reload('v2')
+    assert registry.check_for_update()
+    assert registry.current().version == 'v3'
+
+def test_pin_rejects_missing_version(models_dir):
+    registry = ModelRegistry(models_dir)
+    with pytest.raises(FileNotFoundError):
+        registry.pin('v9')
+    assert not os.path.exists(os.path.join(models_dir, CURRENT_FILE))
+
+def test_pin_conflicting_with_env_override(models_dir, monkeypatch):
+    monkeypatch.setenv('ATLAS_MODEL_VERSION', 'v3')
+    registry = ModelRegistry(models_dir)
+    with pytest.raises(ValueError):
+        registry.pin('v2')
+    assert registry.pin('v3').version == 'v3'
+
+def test_watcher_logs_reload_failures(models_dir, caplog):
+    registry = ModelRegistry(models_dir)
+    registry.current()
+    os.remove(os.path.join(models_dir, 'model_columns_v3.pkl'))
+    with open(os.path.join(models_dir, CURRENT_FILE), 'w', encoding='utf-8') as f:
+        f.write('v3\n')
+    with caplog.at_level(logging.ERROR, logger='app.services.model_registry'):
+        registry.start_watching(0.01)
+        try:
+            for _ in range(200):
+                if caplog.records:
+                    break
+                registry._stop_watching.wait(0.01)
+        finally:
+            registry.stop_watching()
+    assert 'Model reload failed' in caplog.records[0].getMessage()
+    assert registry.current().version == 'v3'
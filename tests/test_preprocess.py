@@ -0,0 +1,47 @@
+# tests/test_preprocess.py
+#
+# 学習時のカテゴリ水準の決め方と、水準に無い値の警告を確認する
+
+import warnings
+
+import pytest
+
+from ml.preprocess import (
+    CATEGORY_LEVELS, FeatureEncoder, build_model_columns, merge_category_levels, scan_category_levels,
+)
+from ml.train import load_seed_data
+
+def test_new_values_are_appended_after_known_levels():
+    levels = merge_category_levels({'Residence_Type': ['Rental', 'Dormitory', 'Boat'], 'Medical_History': ['喘息']})
+    assert levels['Residence_Type'] == CATEGORY_LEVELS['Residence_Type'] + ['Boat', 'Dormitory']
+    assert levels['Medical_History'] == CATEGORY_LEVELS['Medical_History'] + ['喘息']
+    assert levels['Guarantor'] == CATEGORY_LEVELS['Guarantor']
+    # 既存のカラムの並びは変わらず、新しい水準のカラムが追加される
+    columns = list(build_model_columns(levels))
+    assert 'Residence_Type_Dormitory' in columns and 'Medical_History_喘息' in columns
+    assert [column for column in columns if column in build_model_columns()] == list(build_model_columns())
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet'])
+def test_scan_category_levels_reads_chunks(tmp_path, suffix):
+    df = load_seed_data()
+    df.loc[13, 'Residence_Type'] = 'Dormitory'
+    path = str(tmp_path / f'applicants{suffix}')
+    if suffix == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        pytest.importorskip('pyarrow')
+        df.to_parquet(path)
+    levels = scan_category_levels(path, chunksize=4)
+    assert levels['Residence_Type'][-1] == 'Dormitory'
+
+def test_encode_frame_warns_on_values_outside_levels():
+    df = load_seed_data().assign(Payment_Rate=1.0)
+    df.loc[0, 'Medical_History'] = '喘息'
+    encoder = FeatureEncoder(build_model_columns())
+    with pytest.warns(UserWarning, match="'Medical_History' has 1 values"):
+        encoder.encode_frame(df, category_levels=CATEGORY_LEVELS)
+    # 基準カテゴリや欠損は警告しない
+    df.loc[0, 'Medical_History'] = None
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        encoder.encode_frame(df, category_levels=CATEGORY_LEVELS)
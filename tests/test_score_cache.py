@@ -0,0 +1,109 @@
+# tests/test_score_cache.py
+#
+# スコアキャッシュの LRU / TTL と、モデル差し替え時の全件破棄を確認する
+
+import os
+import shutil
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from conftest import MODELS_DIR
+from app.services.prediction_service import PredictionService
+from app.services.score_cache import ScoreCache
+
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+CUSTOMER = {
+    'Age': 35, 'Residence_Type': 'Rental', 'Years_at_Work': 5, 'Annual_Income_JPY_10k': 500,
+    'Other_Debt_JPY_10k': 50, 'Guarantor': 'No', 'Medical_History': 'なし', 'Payment_Rate': 0.9,
+}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_key_treats_negative_zero_as_zero():
+    assert ScoreCache.make_key('v', np.array([-0.0, 1.0])) == ScoreCache.make_key('v', np.array([0.0, 1.0]))
+
+def test_bind_to_new_version_clears_entries():
+    cache = ScoreCache(maxsize=10)
+    cache.bind('v2-aaa')
+    cache.put_many(['a', 'b'], [0.1, 0.2])
+    cache.bind('v2-aaa')
+    assert cache.get_many(['a']) == [0.1]
+    cache.bind('v3-bbb')
+    assert cache.get_many(['a', 'b']) == [None, None]
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['model_version'] == 'v3-bbb'
+
+def test_ttl_expiry_and_lru_eviction():
+    clock = FakeClock()
+    cache = ScoreCache(maxsize=2, ttl=10.0, clock=clock)
+    cache.put_many(['a', 'b'], [1, 2])
+    cache.get_many(['a'])
+    cache.put_many(['c'], [3])
+    # 'b' が最も長く参照されていないため追い出される
+    assert cache.get_many(['a', 'b', 'c']) == [1, None, 3]
+    clock.now = 10.0
+    assert cache.get_many(['a', 'c']) == [None, None]
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 2
+
+def test_disabled_cache_never_stores():
+    cache = ScoreCache(maxsize=0)
+    cache.put_many(['a'], [1])
+    assert cache.get_many(['a']) == [None]
+
+@pytest.fixture
+def models_dir(tmp_path):
+    for name in ('atlas_model_v2.pkl', 'model_columns_v2.pkl'):
+        shutil.copy(os.path.join(MODELS_DIR, name), tmp_path / name)
+    return tmp_path
+
+def save_constant_model(models_dir, version, label):
+    """ どの入力にも同じクラスを返すモデル（差し替え後のスコアが必ず変わるようにする） """
+    model_columns = joblib.load(os.path.join(models_dir, 'model_columns_v2.pkl'))
+    X = np.zeros((4, len(model_columns)))
+    y = np.array([0, 1, 0, 1])
+    model = RandomForestClassifier(n_estimators=2, random_state=0).fit(X, y)
+    model.classes_ = np.array([0, 1])
+    for estimator in model.estimators_:
+        estimator.tree_.value[:] = np.array([1.0, 0.0]) if label == 0 else np.array([0.0, 1.0])
+    joblib.dump(model, os.path.join(models_dir, f'atlas_model_{version}.pkl'))
+    joblib.dump(model_columns, os.path.join(models_dir, f'model_columns_{version}.pkl'))
+
+@pytest.mark.parametrize('backend', ['sklearn', 'compiled'])
+def test_reload_invalidates_cached_scores(models_dir, monkeypatch, backend):
+    monkeypatch.delenv('ATLAS_MODEL_VERSION', raising=False)
+    service = PredictionService(backend=backend, models_dir=str(models_dir))
+    service.registry.reload('v2')
+    first = service.get_atlas_score(CUSTOMER)
+    assert service.get_atlas_score(CUSTOMER) == first
+    assert service.score_cache.stats()['hits'] == 1
+
+    save_constant_model(models_dir, 'v3', label=1)
+    service.registry.reload('v3')
+    assert service.score_cache.stats()['size'] == 0
+    assert service.get_atlas_score(CUSTOMER) == 0
+    assert service.score_many([CUSTOMER])[0] == {'score': 0}
+
+def test_overwritten_version_gets_new_cache_key(models_dir, monkeypatch):
+    monkeypatch.delenv('ATLAS_MODEL_VERSION', raising=False)
+    save_constant_model(models_dir, 'v3', label=0)
+    service = PredictionService(models_dir=str(models_dir))
+    service.registry.reload('v3')
+    assert service.get_atlas_score(CUSTOMER) == 100
+    old_version = service.model_version
+
+    # 同じバージョン名で上書きしても、ファイルの内容が変われば別のモデルとして扱う
+    save_constant_model(models_dir, 'v3', label=1)
+    service.registry.reload('v3')
+    assert service.model_version != old_version
+    assert service.get_atlas_score(CUSTOMER) == 0
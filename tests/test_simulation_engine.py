@@ -0,0 +1,66 @@
+# tests/test_simulation_engine.py
+#
+# シミュレーションのグリッド / 個別シナリオの展開と、上限を超える指定を値を作る前に断ることを確認する
+
+import os
+import time
+
+import joblib
+import numpy as np
+import pytest
+
+from conftest import MODELS_DIR
+from ml.preprocess import CATEGORICAL_KEYS, NUMERIC_KEYS, FeatureEncoder
+from app.services.simulation_engine import MAX_SIMULATION_ROWS, SimulationEngine
+
+BASE = {
+    'Age': 40, 'Residence_Type': 'Own_House', 'Years_at_Work': 10, 'Annual_Income_JPY_10k': 600,
+    'Other_Debt_JPY_10k': 0, 'Guarantor': 'No', 'Medical_History': 'なし', 'Payment_Rate': 1.0,
+}
+
+@pytest.fixture(scope='module')
+def engine():
+    model_columns = joblib.load(os.path.join(MODELS_DIR, 'model_columns_v2.pkl'))
+    return SimulationEngine(FeatureEncoder(model_columns, NUMERIC_KEYS, CATEGORICAL_KEYS))
+
+def test_expand_rows(engine):
+    grid = {'Age': {'start': 20, 'stop': 60, 'num': 5}, 'Guarantor': ['No', 'Yes']}
+    matrix, plan = engine.expand(BASE, grid, [{'Age': 30}])
+    assert matrix.shape[0] == 1 + 1 + 5 * 2
+    assert plan['shape'] == (5, 2)
+    assert plan['axes']['Age'] == [20.0, 30.0, 40.0, 50.0, 60.0]
+    # 行の並びは [基準, 個別シナリオ, グリッド(C順)]
+    np.testing.assert_array_equal(matrix[1], engine.encoder.encode_one(dict(BASE, Age=30)))
+    np.testing.assert_array_equal(matrix[2 + 2 * 2 + 1], engine.encoder.encode_one(dict(BASE, Age=40, Guarantor='Yes')))
+
+@pytest.mark.parametrize('grid', [
+    {'Age': {'start': 0, 'stop': 1, 'num': 20_000_000}},
+    {'Age': {'start': 0, 'stop': 1, 'num': 10**30}},
+    {'Age': {'start': 0, 'stop': 1, 'num': 1000}, 'Years_at_Work': {'start': 0, 'stop': 40, 'num': 1000}},
+    {'Age': {'start': 0, 'stop': 1, 'num': 1000}, 'Years_at_Work': list(range(101))},
+])
+def test_rejects_grids_over_limit_without_building_them(engine, grid):
+    started = time.perf_counter()
+    with pytest.raises(ValueError):
+        engine.expand(BASE, grid)
+    assert time.perf_counter() - started < 1.0
+
+@pytest.mark.parametrize('spec', [
+    {'start': 0, 'stop': 1, 'num': 0},
+    {'start': 0, 'stop': 1, 'num': -5},
+    {'start': 0, 'stop': 1},
+    {'start': 'a', 'stop': 1, 'num': 3},
+    {'start': 0, 'stop': float('inf'), 'num': 3},
+])
+def test_rejects_invalid_range_specs(engine, spec):
+    with pytest.raises(ValueError):
+        engine.expand(BASE, {'Age': spec})
+
+def test_limit_counts_perturbations(engine):
+    engine.expand(BASE, {'Age': {'start': 0, 'stop': 1, 'num': MAX_SIMULATION_ROWS - 2}}, [{'Age': 1}])
+    with pytest.raises(ValueError):
+        engine.expand(BASE, {'Age': {'start': 0, 'stop': 1, 'num': MAX_SIMULATION_ROWS - 1}}, [{'Age': 1}])
+
+def test_rejects_non_finite_perturbations(engine):
+    with pytest.raises(ValueError):
+        engine.expand(BASE, perturbations=[{'Age': float('nan')}])
@@ -0,0 +1,97 @@
+# tests/test_temperature_engine.py
+#
+# 顧客温度計の log_heat による順位付けが、全イベントから時間減衰付きの熱意を直接計算した場合と一致することを確認する
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.temperature_engine import EVENT_WEIGHTS, HALF_LIFE_DAYS, TemperatureEngine
+
+DAY = 86400.0
+# 現在時刻に近い値（exp(λt) が大きくなるため、log-sum-exp で桁あふれしないことも確認できる）
+NOW = 1_800_000_000.0
+
+def make_events(n_events=5000, n_customers=300, seed=0):
+    rng = np.random.default_rng(seed)
+    event_types = list(EVENT_WEIGHTS)
+    return pd.DataFrame({
+        'customer_id': [f'C{i:04d}' for i in rng.integers(0, n_customers, n_events)],
+        'event_type': [event_types[i] for i in rng.integers(0, len(event_types), n_events)],
+        'occurred_at': NOW - rng.uniform(0, 120 * DAY, n_events),
+    })
+
+def brute_force_heat(events, now, half_life_days=HALF_LIFE_DAYS):
+    """ 熱意(t) = Σ 重み × 2^(-経過日数 / 半減期) を顧客ごとに直接計算する """
+    age_days = (now - events['occurred_at']) / DAY
+    terms = events['event_type'].map(EVENT_WEIGHTS) * np.power(0.5, age_days / half_life_days)
+    return terms.groupby(events['customer_id']).sum()
+
+@pytest.fixture
+def engine():
+    engine = TemperatureEngine()
+    yield engine
+    engine.close()
+
+def test_heat_matches_brute_force(engine):
+    events = make_events()
+    assert engine.ingest(events) == len(events)
+    expected = brute_force_heat(events, NOW)
+    assert len(engine) == len(expected)
+
+    actual = engine.get(expected.index, now=NOW).set_index('customer_id')['heat']
+    np.testing.assert_allclose(actual[expected.index], expected, rtol=1e-9)
+
+def test_ranking_order_matches_brute_force(engine):
+    events = make_events()
+    engine.ingest(events)
+    # 最後のイベントから時間が経っても、順位は変わらない（熱意はすべての顧客で同じ割合で冷める）
+    for now in (NOW, NOW + 30 * DAY):
+        expected = brute_force_heat(events, now).sort_values(ascending=False)
+
+        hottest = engine.ranking(20, hottest=True, now=now)
+        assert list(hottest['customer_id']) == list(expected.index[:20])
+        np.testing.assert_allclose(hottest['heat'], expected.iloc[:20], rtol=1e-9)
+        assert hottest['temperature'].is_monotonic_decreasing
+
+        coldest = engine.ranking(20, hottest=False, now=now)
+        assert list(coldest['customer_id']) == list(expected.index[::-1][:20])
+        assert coldest['temperature'].is_monotonic_increasing
+
+def test_incremental_ingest_matches_one_shot(engine):
+    events = make_events()
+    engine.ingest(events)
+    incremental = TemperatureEngine()
+    try:
+        # バッチの分け方・イベントの順序によらず、同じ log_heat になる
+        shuffled = events.sample(frac=1.0, random_state=1)
+        for start in range(0, len(shuffled), 700):
+            incremental.ingest(shuffled.iloc[start:start + 700], batch_size=256)
+        expected = engine.ranking(len(engine), now=NOW).set_index('customer_id')
+        actual = incremental.ranking(len(incremental), now=NOW).set_index('customer_id')
+        assert list(actual.index) == list(expected.index)
+        np.testing.assert_allclose(actual['heat'], expected['heat'], rtol=1e-9)
+        assert (actual['event_count'] == expected['event_count']).all()
+        assert (actual['last_event_type'] == expected['last_event_type']).all()
+    finally:
+        incremental.close()
+
+def test_half_life_is_halving(engine):
+    engine.ingest([{'customer_id': 'A', 'event_type': 'call', 'occurred_at': NOW}])
+    now_heat = engine.get(['A'], now=NOW)['heat'].iloc[0]
+    later_heat = engine.get(['A'], now=NOW + HALF_LIFE_DAYS * DAY)['heat'].iloc[0]
+    assert now_heat == pytest.approx(EVENT_WEIGHTS['call'])
+    assert later_heat == pytest.approx(EVENT_WEIGHTS['call'] / 2)
+
+def test_rejects_unknown_event_types(engine):
+    with pytest.raises(ValueError):
+        engine.ingest([{'customer_id': 'A', 'event_type': 'unknown', 'occurred_at': NOW}])
+    with pytest.raises(ValueError):
+        engine.ingest([{'customer_id': 'A', 'event_type': 'call'}])
+
+def test_half_life_mismatch_is_rejected(tmp_path):
+    path = str(tmp_path / 'temperature.db')
+    TemperatureEngine(path).close()
+    with pytest.raises(ValueError):
+        TemperatureEngine(path, half_life_days=HALF_LIFE_DAYS * 2)
+    TemperatureEngine(path).close()
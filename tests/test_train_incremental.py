@@ -0,0 +1,84 @@
+# tests/test_train_incremental.py
+#
+# 夜間の追加学習が、与信スコアの ATLAS モデルには触れずに、別の成果物の成約モデルだけを作成・更新することを確認する
+
+import os
+import shutil
+
+import joblib
+import numpy as np
+import pytest
+
+from conftest import MODELS_DIR
+from app.services.capture_store import CaptureStore
+from app.services.model_registry import ModelRegistry
+from ml.train_incremental import DEAL_MODEL_SUBDIR, deal_model_paths, latest_deal_version, run
+
+pytestmark = pytest.mark.filterwarnings('ignore:X does not have valid feature names')
+
+def record_deals(store, n, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        income = int(rng.integers(300, 1200))
+        store.record('成約' if income > 700 else '見送り', {
+            'Age': int(rng.integers(20, 70)),
+            'Residence_Type': str(rng.choice(['Own_House', 'Rental', 'Family_House'])),
+            'Years_at_Work': int(rng.integers(0, 30)),
+            'Annual_Income_JPY_10k': income,
+            'Other_Debt_JPY_10k': int(rng.integers(0, 200)),
+            'Guarantor': str(rng.choice(['Yes', 'No'])),
+            'Medical_History': str(rng.choice(['なし', '高血圧'])),
+            'Payment_Rate': float(rng.uniform(0.8, 1.0)),
+        })
+    assert store.flush()
+
+@pytest.fixture
+def models_dir(tmp_path):
+    models_dir = tmp_path / 'models'
+    models_dir.mkdir()
+    for name in os.listdir(MODELS_DIR):
+        if name.endswith('.pkl'):
+            shutil.copy(os.path.join(MODELS_DIR, name), models_dir)
+    return str(models_dir)
+
+def test_trains_separate_deal_model(tmp_path, models_dir):
+    capture_path = str(tmp_path / 'captures.db')
+    store = CaptureStore(capture_path, flush_interval=0.01)
+    credit_files = {name: (tmp_path / 'models' / name).read_bytes() for name in os.listdir(models_dir)}
+    credit_version = ModelRegistry(models_dir).resolve_version()
+    deal_dir = os.path.join(models_dir, DEAL_MODEL_SUBDIR)
+    try:
+        # 初回は成約モデルを新しく作る
+        record_deals(store, 60, seed=0)
+        assert run(capture_path, models_dir, trees_per_run=5, n_jobs=1) == 'v1'
+        model = joblib.load(deal_model_paths(deal_dir, 'v1')[0])
+        assert len(model.estimators_) == 5
+        assert list(model.classes_) == [0, 1]
+
+        # 新しい記録が無ければ何もしない
+        assert run(capture_path, models_dir, trees_per_run=5, n_jobs=1) is None
+
+        # 2回目以降は前回以降の記録だけで木を追加し、上限を超えた分は外す
+        record_deals(store, 60, seed=1)
+        assert run(capture_path, models_dir, trees_per_run=5, max_trees=8, n_jobs=1) == 'v2'
+        assert latest_deal_version(deal_dir) == 'v2'
+        assert len(joblib.load(deal_model_paths(deal_dir, 'v2')[0]).estimators_) == 8
+        assert store.training_watermark() == 120
+    finally:
+        store.close()
+
+    # 与信スコアのモデル・稼働中のバージョンはそのまま
+    assert {name: (tmp_path / 'models' / name).read_bytes() for name in credit_files} == credit_files
+    assert not os.path.exists(os.path.join(models_dir, 'CURRENT'))
+    assert ModelRegistry(models_dir).resolve_version() == credit_version
+
+def test_waits_for_enough_rows(tmp_path, models_dir):
+    capture_path = str(tmp_path / 'captures.db')
+    store = CaptureStore(capture_path, flush_interval=0.01)
+    try:
+        record_deals(store, 5, seed=0)
+        assert run(capture_path, models_dir, min_rows=20, n_jobs=1) is None
+        assert store.training_watermark() == 0
+        assert latest_deal_version(os.path.join(models_dir, DEAL_MODEL_SUBDIR)) is None
+    finally:
+        store.close()